@@ -0,0 +1,99 @@
+import threading
+from collections import deque
+
+
+class RouteClass:
+    """Admission settings for a group of routes."""
+
+    __slots__ = ("name", "priority", "limit", "queue", "wait", "retry_after")
+
+    def __init__(self, name, priority, limit, queue, wait, retry_after=1):
+        self.name = name
+        self.priority = priority  # higher is served first when a slot frees up
+        self.limit = limit  # requests of this class running at once
+        self.queue = queue  # requests allowed to wait for a slot; beyond that, shed
+        self.wait = wait  # seconds a queued request waits before it is shed
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """Caps how many requests run at once, per route class and overall.
+
+    A request that cannot start waits in its class's bounded queue; freed
+    slots go to the highest-priority waiter first. A request that finds
+    its queue full, or times out waiting, is shed so the caller can answer
+    503 right away instead of letting every route slow down together.
+    """
+
+    def __init__(self, capacity, classes):
+        self.capacity = capacity
+        self.classes = {route_class.name: route_class for route_class in classes}
+        self.by_priority = sorted(classes, key=lambda route_class: -route_class.priority)
+        self.active = 0
+        self.running = dict.fromkeys(self.classes, 0)
+        self.waiters = {name: deque() for name in self.classes}
+        self.admitted = dict.fromkeys(self.classes, 0)
+        self.shed = dict.fromkeys(self.classes, 0)
+        self.timed_out = dict.fromkeys(self.classes, 0)
+        self.lock = threading.Lock()
+
+    def admit(self, name):
+        """Block until a request of class name may run; returns False if it should be shed."""
+        route_class = self.classes[name]
+        with self.lock:
+            if self._has_room(route_class) and not self._queued_ahead(route_class):
+                self._start(route_class)
+                return True
+            if len(self.waiters[name]) >= route_class.queue:
+                self.shed[name] += 1
+                return False
+            ready = threading.Event()
+            self.waiters[name].append(ready)
+        if ready.wait(route_class.wait):
+            return True
+        with self.lock:
+            if ready.is_set():
+                return True  # handed a slot just as the wait ran out
+            self.waiters[name].remove(ready)
+            self.timed_out[name] += 1
+            return False
+
+    def release(self, name):
+        with self.lock:
+            self.active -= 1
+            self.running[name] -= 1
+            # Hand freed slots to waiters, most important class first
+            for route_class in self.by_priority:
+                waiters = self.waiters[route_class.name]
+                while waiters and self._has_room(route_class):
+                    self._start(route_class)
+                    waiters.popleft().set()
+
+    def _has_room(self, route_class):
+        return self.active < self.capacity and self.running[route_class.name] < route_class.limit
+
+    def _queued_ahead(self, route_class):
+        return any(self.waiters[other.name] for other in self.by_priority if other.priority >= route_class.priority)
+
+    def _start(self, route_class):
+        self.active += 1
+        self.running[route_class.name] += 1
+        self.admitted[route_class.name] += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "capacity": self.capacity,
+                "active": self.active,
+                "classes": {
+                    name: {
+                        "limit": route_class.limit,
+                        "running": self.running[name],
+                        "waiting": len(self.waiters[name]),
+                        "admitted": self.admitted[name],
+                        "shed": self.shed[name],
+                        "timed_out": self.timed_out[name]
+                    }
+                    for name, route_class in self.classes.items()
+                }
+            }
@@ -1,12 +1,35 @@
-from flask import Flask, request, jsonify, session
+from flask import Flask, request, jsonify, session, g
 
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
+from cachelib import FileSystemCache
 import json
 import os
 import threading
 import time
 from datetime import timedelta
+from functools import wraps
+
+from admission import AdmissionControl, RouteClass
+from bus import BusClient, BusHub
+from device_registry import DeviceRegistry
+from device_tokens import GATEWAY_TABLE, DeviceTokens
+from device_ws import DeviceHub, closed_response
+from events import EventLog, normalize_event
+from idempotency import IdempotencyCache
+from leader import LeaderElection
+from lock_profiler import LockProfiler, ProfiledLock
+from metrics import SIZE_BUCKETS, MeteredLock, MetricsRegistry
+from presence import PresenceMonitor
+from profiling import MemoryTracker, SamplingProfiler, collapsed
+from ratelimit import RateLimiter, TokenBucket
+from request_timing import RequestTimer
+from session_free import SessionFreeInterface, session_free
+from session_store import ServerSessionInterface, SessionStore
+from simple_websocket import ConnectionClosed
+from sqlite_timers import SqliteTimers
+from table_slots import TableSlots
+from timers import Timers
 
 app = Flask(__name__)
 app.secret_key = "your_secret_key"  # Replace with a secure key
@@ -22,98 +45,426 @@ CORS(app, supports_credentials=True, resources={r"/*": {"origins": "http://local
 
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-# Timer Management
-class Timers:
-    def __init__(self, filepath):
-        self.filepath = filepath
-        self.timers = {}
-        self.tables = {}  # Tracks table occupancy
-        self.default_duration = 900  # Default timer duration: 15 minutes
-        self.load_timers()
-        self.lock = threading.Lock()
-
-    def load_timers(self):
-        if os.path.exists(self.filepath):
-            with open(self.filepath, "r") as file:
-                data = json.load(file)
-                self.timers = data.get("timers", {})
-                self.tables = data.get("tables", {})
+# Set MULTI_WORKER=1 when running several worker processes (e.g. gunicorn -w 4, without --preload):
+# state moves to a shared SQLite file and one elected worker runs the timer thread
+MULTI_WORKER = os.environ.get("MULTI_WORKER") == "1"
+
+# SESSION_TYPE 'filesystem': session data lives in SESSION_DIR, the cookie only holds its id.
+# Sessions are read from an in-memory LRU; renewals of permanent sessions are written in batches.
+SESSION_DIR = "data/sessions"
+SESSION_MAX_FILES = 10000  # FileSystemCache deletes expired, then oldest, files beyond this
+SESSION_CACHE_ENTRIES = 4096
+SESSION_RENEW_AFTER = 60  # seconds a stored expiry may lag before a renewal is written
+SESSION_REVALIDATE_AFTER = 2 if MULTI_WORKER else None  # seconds; another worker may have changed it
+
+session_store = SessionStore(
+    FileSystemCache(SESSION_DIR, threshold=SESSION_MAX_FILES,
+                    default_timeout=int(app.permanent_session_lifetime.total_seconds())),
+    max_entries=SESSION_CACHE_ENTRIES, renew_after=SESSION_RENEW_AFTER, revalidate_after=SESSION_REVALIDATE_AFTER)
+# Views marked @session_free (device and public routes) never load or save a session
+app.session_interface = SessionFreeInterface(ServerSessionInterface(session_store))
+
+# Retried device writes carrying the same Idempotency-Key replay the first response
+IDEMPOTENCY_MAX_ENTRIES = 1024
+IDEMPOTENCY_TTL = 120  # seconds
+
+# Device sensor events (PIR, card taps, clashes)
+EVENT_BUFFER_SIZE = 10000
+EVENT_BATCH_MAX = 500
+
+# A chope on a table with a PIR sensor is released after this long without anyone present
+PRESENCE_ABSENCE_WINDOW = 180  # seconds
+
+# A table device that sends nothing (requests, socket frames or heartbeats) for this long is offline.
+# Only devices with a verified token are tracked, and at most DEVICE_REGISTRY_MAX of them.
+DEVICE_OFFLINE_AFTER = 90  # seconds; devices heartbeat every 30
+DEVICE_REGISTRY_MAX = 8192
+DEVICE_FORGET_AFTER = 7 * 24 * 3600  # seconds offline before a device is dropped from /admin/devices
+DEVICE_SEEN_SHARE_INTERVAL = 5  # seconds between a worker's batches of last-seen times (MULTI_WORKER)
+
+# Admission control: device writes and polls may use every slot and are served first, dashboard
+# reads only part of them, so a lunch-rush burst of reads is shed with a fast 503 instead of slowing
+# devices. Device polls and heartbeats are shed last: older firmware gives up a chope on any non-200.
+ADMISSION_CAPACITY = 48  # below serve.py's thread pool, leaving threads for sockets and admin
+ADMISSION_CLASSES = [
+    RouteClass("device_write", priority=2, limit=48, queue=128, wait=2.0),
+    RouteClass("device_poll", priority=2, limit=48, queue=256, wait=2.0),
+    RouteClass("read", priority=1, limit=16, queue=16, wait=0.1),
+    RouteClass("default", priority=1, limit=16, queue=16, wait=0.5),
+]
+# Flask endpoint -> class; unlisted endpoints are "default", None is never limited
+ADMISSION_ROUTES = {
+    "start_timer": "device_write",
+    "end_timer": "device_write",
+    "set_table_vacant": "device_write",
+    "device_chope": "device_write",
+    "device_release": "device_write",
+    "ingest_events": "device_write",
+    "get_timer_status": "device_poll",
+    "count_occupied_tables": "read",
+    "get_timer_duration": "read",
+    "get_user": "read",
+    "device_heartbeat": "device_poll",
+    "device_ws": None,  # long-lived socket, would hold a slot for hours
+    "admission_stats": None,
+    "sample_profile": None,  # holds its thread for the whole profile
+    "metrics_endpoint": None,  # the scrape must get through when the server is busiest
+}
+
+# Token buckets (requests per second, burst) per table device, card and client IP. A bucket listed
+# under several routes is one budget across them. Every device in a canteen may sit behind one
+# NAT address, so per-IP buckets only stop runaway scripts and are kept generous.
+RATE_IP = TokenBucket("ip", rate=100, burst=300)
+RATE_DEVICE = TokenBucket("table_id", rate=2, burst=10)
+RATE_LIMITS = {
+    "get_timer_status": [TokenBucket("can_id", rate=2, burst=10), RATE_IP],
+    "start_timer": [TokenBucket("can_id", rate=0.5, burst=5), RATE_DEVICE, RATE_IP],
+    "end_timer": [TokenBucket("can_id", rate=0.5, burst=5), RATE_IP],
+    "device_chope": [RATE_DEVICE, RATE_IP],
+    "device_release": [RATE_DEVICE, RATE_IP],
+    "ingest_events": [TokenBucket("table_id", rate=1, burst=10), RATE_IP],
+    # Per account and address, not per address: a shared NAT address must not lock everyone out
+    "login": [TokenBucket("account", rate=0.2, burst=10), RATE_IP],
+    "device_heartbeat": [RATE_DEVICE, RATE_IP],
+    "device_ws": [],
+    "metrics_endpoint": [],  # scraped from one address; must not be refused along with a flood
+}
+
+# Devices send X-Device-Token (issued by POST /admin/device_tokens) instead of a session cookie.
+# A token that is sent must be genuine; set DEVICE_TOKEN_REQUIRED=1 once every table has one.
+DEVICE_TOKEN_SECRET = os.environ.get("DEVICE_TOKEN_SECRET", app.secret_key)
+DEVICE_TOKEN_REQUIRED = os.environ.get("DEVICE_TOKEN_REQUIRED") == "1"
+DEVICE_TOKEN_CACHE = 4096  # verified tokens remembered, at least one per table
+DEVICE_TOKEN_REVOKED_PATH = "data/revoked_tokens.json"
+
+# Browsers only get alerts over Socket.IO; table devices get every frame for their table
+SOCKETIO_EVENTS = ('timer_alert', 'timer_ended', 'chope_released')
+
+device_hub = DeviceHub()
+emit_alert = socketio.emit
+count_socketio_clients = lambda: len(socketio.server.eio.sockets)
+
+# asgi.py serves browsers and devices from asyncio and routes published events there instead
+def use_clients(alerts, devices, count_clients=None):
+    global emit_alert, device_hub, count_socketio_clients
+    emit_alert, device_hub = alerts, devices
+    if count_clients is not None:
+        count_socketio_clients = count_clients
+
+def alert_browsers(event, payload):
+    socketio_emits.inc(labels=(event,))
+    emit_alert(event, payload)
+
+# Fan events out to this process's clients
+def publish(events):
+    table_events = []
+    for event, payload in events:
+        if event == "device_events":
+            presence.on_device_events(payload["events"])
+        elif event == "device_token_revoked":
+            device_tokens.revoke(payload["token_id"], persist=False)
+        elif event == "device_seen":
+            device_registry.merge(payload["seen"])
+        elif event in ("device_offline", "device_online"):
+            device_registry.apply(event, payload)
+            alert_browsers(event, payload)
         else:
-            self.timers = {}
-            self.tables = {}
-
-    def save_timers(self):
-        with open(self.filepath, "w") as file:
-            json.dump({"timers": self.timers, "tables": self.tables}, file)
-
-    def start_timer(self, can_id, table_id):
-        with self.lock:
-            self.timers[can_id] = {
-                "table_id": table_id,
-                "remaining_time": self.default_duration,
-                "alerts_sent": []
-            }
-            self.tables[table_id] = {"occupied": True, "can_id": can_id}
-            self.save_timers()
-        return self.default_duration
-
-    def get_timer_status(self, can_id):
-        with self.lock:
-            return self.timers.get(can_id, None)
-
-    def end_timer(self, can_id):
-        with self.lock:
-            if can_id in self.timers:
-                table_id = self.timers[can_id]["table_id"]
-                self.tables[table_id]["occupied"] = True  # Table remains occupied
-                del self.timers[can_id]
-                self.save_timers()
-                return True
-        return False
+            if event in SOCKETIO_EVENTS:
+                alert_browsers(event, payload)
+            device_hub.push(payload["table_id"], event, payload)
+            table_events.append((event, payload))
+    presence.on_timer_events(table_events, time.time())
+
+# Fan events out to every worker's clients
+def broadcast(events):
+    if MULTI_WORKER:
+        timers.enqueue(events)
+    else:
+        publish(events)
 
-    def set_table_vacant(self, table_id):
-        with self.lock:
-            if table_id in self.tables and self.tables[table_id]["occupied"]:
-                self.tables[table_id]["occupied"] = False
-                self.tables[table_id]["can_id"] = None
-                self.save_timers()
-                return True
+def release_no_show(table_id, can_id):
+    if timers.release_table(table_id, can_id=can_id) is None:
         return False
-
-    def count_occupied_tables(self):
-        with self.lock:
-            return sum(1 for table in self.tables.values() if table["occupied"])
-
-    def decrement_timers(self):
-        with self.lock:
-            for can_id, timer_data in list(self.timers.items()):
-                timer_data["remaining_time"] -= 1
-                remaining_time = timer_data["remaining_time"]
-                if remaining_time in [300, 240, 180, 120, 60]:
-                    if remaining_time not in timer_data["alerts_sent"]:
-                        socketio.emit('timer_alert', {
-                            "can_id": can_id,
-                            "table_id": timer_data["table_id"],
-                            "remaining_time": remaining_time
-                        })
-                        timer_data["alerts_sent"].append(remaining_time)
-                if remaining_time <= 0:
-                    socketio.emit('timer_ended', {
-                        "can_id": can_id,
-                        "table_id": timer_data["table_id"]
-                    })
-                    del self.timers[can_id]
-            self.save_timers()
-
-timers = Timers(filepath="data/timers.json")
+    broadcast([("chope_released", {"table_id": table_id, "can_id": can_id, "reason": "no_show"})])
+    return True
+
+presence = PresenceMonitor(absence_window=PRESENCE_ABSENCE_WINDOW, release=release_no_show)
+
+def device_health_changed(event, payload):
+    # Every worker tracks every device, but only the one running housekeeping announces changes
+    if leader is None or leader.is_leader:
+        broadcast([(event, payload)])
+
+device_registry = DeviceRegistry(offline_after=DEVICE_OFFLINE_AFTER, on_change=device_health_changed,
+                                 max_devices=DEVICE_REGISTRY_MAX, forget_after=DEVICE_FORGET_AFTER)
+
+if MULTI_WORKER:
+    # The leader mirrors table state into shared memory; every worker serves reads from it
+    table_slots = TableSlots()
+    timers = SqliteTimers(path="data/timers.db", import_from="data/timers.json", slots=table_slots)
+    leader = LeaderElection("data/leader.lock")
+    # Events reach every worker over a Unix socket served by the leader
+    bus_hub = BusHub("data/bus.sock", timers, on_batch=table_slots.apply)
+    bus = BusClient("data/bus.sock", publish)
+    timers.on_commit = bus.wake
+else:
+    timers = Timers(filepath="data/timers.json", on_events=publish)
+    table_slots = None
+    leader = None
+
+# /metrics: recorded per thread without locks and merged when scraped (see metrics.py)
+metrics = MetricsRegistry()
+request_latency = metrics.histogram("http_request_duration_seconds", "Request latency by Flask endpoint",
+                                    labels=("route", "method"))
+requests_total = metrics.counter("http_requests_total", "Responses by Flask endpoint and status", labels=("route", "code"))
+tick_duration = metrics.histogram("timer_tick_duration_seconds", "Time spent in one decrement_timers tick")
+tick_lag = metrics.histogram("timer_tick_lag_seconds", "How late a tick started after it was due")
+lock_wait = metrics.histogram("timers_lock_wait_seconds", "Wait to acquire a Timers shard lock", labels=("shard",))
+lock_hold = metrics.histogram("timers_lock_hold_seconds", "Time a Timers shard lock was held", labels=("shard",))
+save_duration = metrics.histogram("timers_save_duration_seconds", "Time to write the timers state file")
+save_bytes = metrics.histogram("timers_save_bytes", "Size of each timers state file write", buckets=SIZE_BUCKETS)
+socketio_emits = metrics.counter("socketio_emits_total", "Socket.IO alerts emitted to browsers", labels=("event",))
+metrics.gauge("timers_active", "Running timers", lambda: timers.active_timers())
+metrics.gauge("tables_occupied", "Occupied tables", lambda: timers.count_occupied_tables())
+metrics.gauge("socketio_clients", "Connected Socket.IO clients", lambda: count_socketio_clients())
+metrics.gauge("device_sockets", "Connected device WebSockets", lambda: device_hub.count())
+
+def record_save(seconds, size):
+    save_duration.observe(seconds)
+    save_bytes.observe(size)
+
+# Per-call-site contention on the Timers locks; toggled at runtime from /admin/lock_profile
+lock_profiler = LockProfiler(enabled=os.environ.get("LOCK_PROFILE") == "1")
+
+# Per-route phase timings (session, JSON, lock wait, handler, serialization) and the slowest
+# requests; toggled at runtime from /admin/request_timing. Socket.IO polls are left out.
+request_timer = RequestTimer(enabled=os.environ.get("REQUEST_TIMING") == "1", skip_prefixes=("/socket.io/",))
+request_timer.install(app)
+
+if not MULTI_WORKER:
+    # SqliteTimers locks inside SQLite, so lock and save metrics only cover the in-memory Timers
+    for shard in timers.shards:
+        shard.lock = ProfiledLock(MeteredLock(shard.lock, lock_wait, lock_hold, labels=(str(shard.index),),
+                                              on_wait=request_timer.lock_wait),
+                                  lock_profiler, f"shard{shard.index}")
+    timers.save_lock = ProfiledLock(timers.save_lock, lock_profiler, "save")
+    timers.on_save = record_save
+
+@app.before_request
+def start_request_clock():
+    # Registered before every other hook so rate limiting and admission are part of the latency
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.endpoint or "unmatched"
+        request_latency.observe(time.perf_counter() - started, (route, request.method))
+        requests_total.inc(labels=(route, str(response.status_code)))
+    return response
+
+# Presence expiry and the stale sweep; the timer thread runs this every tick
+def housekeeping():
+    presence.expire(time.time())
+    device_registry.expire(time.time())
+    timers.sweep_stale(time.time())  # counts are at /admin/sweeper
+    if table_slots is not None:
+        table_slots.heartbeat(time.time())
 
 # Background Timer Thread
+def tick():
+    started = time.perf_counter()
+    timers.decrement_timers()
+    tick_duration.observe(time.perf_counter() - started)
+
 def timer_thread():
+    due = time.monotonic()
     while True:
-        timers.decrement_timers()
+        tick_lag.observe(max(0, time.monotonic() - due))
+        tick()
+        housekeeping()
+        due = time.monotonic() + 1
         time.sleep(1)
 
-threading.Thread(target=timer_thread, daemon=True).start()
+def lead():
+    table_slots.create()
+    states, outbox_id = timers.dump_tables()
+    table_slots.load(states, outbox_id)
+    bus_hub.start(outbox_id)
+    timer_thread()
+
+# Each worker only sees its own device requests; the leader needs all of them to spot silent devices
+def share_device_seen():
+    while True:
+        time.sleep(DEVICE_SEEN_SHARE_INTERVAL)
+        seen = device_registry.take_unseen()
+        if seen:
+            broadcast([("device_seen", {"seen": seen})])
+
+idempotency = IdempotencyCache(max_entries=IDEMPOTENCY_MAX_ENTRIES, ttl=IDEMPOTENCY_TTL)
+
+event_log = EventLog(journal_path="data/events.jsonl", capacity=EVENT_BUFFER_SIZE)
+if MULTI_WORKER:
+    # Only the leader expires chopes, so PIR events from every worker go through the outbox
+    event_log.subscribe(lambda batch: broadcast([("device_events", {"events": batch})]))
+else:
+    event_log.subscribe(presence.on_device_events)
+
+background_started = False
+background_lock = threading.Lock()
+
+# Entry points call this once per process; timer_engine=False leaves ticking to the caller (asgi.py)
+def start_background(timer_engine=True):
+    global background_started
+    with background_lock:
+        if background_started:
+            return
+        background_started = True
+    event_log.start()
+    session_store.start()
+    if MULTI_WORKER:
+        threading.Thread(target=leader.run, args=(lead,), daemon=True).start()
+        threading.Thread(target=share_device_seen, daemon=True).start()
+        bus.start()
+    elif timer_engine:
+        threading.Thread(target=timer_thread, daemon=True).start()
+
+@app.before_request
+def ensure_background():
+    # Servers that load app:app themselves (e.g. gunicorn) get it started by the first request
+    if not background_started:
+        start_background()
+
+rate_limiter = RateLimiter(RATE_LIMITS, default=[RATE_IP])
+
+def rate_key(value):
+    return value if isinstance(value, str) else None
+
+@app.before_request
+def rate_limit():
+    # Runs before admission control so a flood is refused before it can take a queue place
+    args = request.view_args or {}
+    body = request.get_json(silent=True) if request.method == "POST" else None
+    body = body if isinstance(body, dict) else {}
+    account = "admin" if body.get("is_admin") else rate_key(body.get("can_id"))
+    retry_after = rate_limiter.check(request.endpoint, {
+        "table_id": rate_key(args.get("table_id", body.get("table_id"))),
+        "can_id": rate_key(args.get("can_id", body.get("can_id"))),
+        "account": f"{account} {request.remote_addr}" if account else None,
+        "ip": request.remote_addr
+    })
+    if retry_after:
+        response = jsonify({"error": "Too many requests"})
+        response.headers["Retry-After"] = str(retry_after)
+        return response, 429
+    return None
+
+admission = AdmissionControl(capacity=ADMISSION_CAPACITY, classes=ADMISSION_CLASSES)
+
+@app.before_request
+def admit_request():
+    name = ADMISSION_ROUTES.get(request.endpoint, "default")
+    if name is None:
+        return None
+    if not admission.admit(name):
+        response = jsonify({"error": "Server busy, retry shortly"})
+        response.headers["Retry-After"] = str(admission.classes[name].retry_after)
+        return response, 503
+    g.admission_class = name
+    return None
+
+@app.teardown_request
+def release_request(exc):
+    name = g.pop("admission_class", None)
+    if name is not None:
+        admission.release(name)
+
+def timer_response(payload, status=200):
+    response = jsonify(payload)
+    timer = payload.get("timer", payload)
+    response.headers["X-Poll-After"] = str(timer["poll_after"])
+    return response, status
+
+def json_object():
+    # None for a body that is not a JSON object (malformed, a list, a bare string...)
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else None
+
+def valid_id(value):
+    # Card and table ids key dicts and database rows, so only non-empty strings will do
+    return isinstance(value, str) and value != ""
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not session.get('is_admin'):
+            return jsonify({"error": "Admin login required"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+device_tokens = DeviceTokens(DEVICE_TOKEN_SECRET, revoked_path=DEVICE_TOKEN_REVOKED_PATH,
+                             cache_size=DEVICE_TOKEN_CACHE)
+
+def device_allowed(token, token_table_id, table_id=None):
+    # A token that is sent must verify, and on /device/<table_id>/... routes be for that table
+    if not token:
+        return not DEVICE_TOKEN_REQUIRED
+    return token_table_id is not None and (table_id is None or table_id == token_table_id)
+
+def device_auth(view):
+    # Views read the token's table from g.device_table_id (None when no token was sent) and check it
+    # against any table named in the body with device_may_act_for()
+    @session_free
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = request.headers.get("X-Device-Token")
+        token_table_id = device_tokens.verify(token) if token else None
+        if not device_allowed(token, token_table_id, kwargs.get("table_id")):
+            return jsonify({"error": "Invalid or missing device token"}), 401
+        g.device_table_id = token_table_id
+        # Anyone may name a table in the URL while tokens are optional, so only token holders are tracked
+        if token_table_id is not None and token_table_id != GATEWAY_TABLE:
+            device_registry.seen(token_table_id, time.time())
+        return view(*args, **kwargs)
+    return wrapper
+
+def device_may_act_for(table_id):
+    # Requests without a token only get this far while DEVICE_TOKEN_REQUIRED is off
+    token_table_id = g.get("device_table_id")
+    return token_table_id is None or token_table_id in (table_id, GATEWAY_TABLE)
+
+def token_mismatch():
+    return jsonify({"error": f"Device token is for table {g.device_table_id}"}), 403
+
+def idempotent(view):
+    # Devices may send Idempotency-Key (or X-Request-Id); replays skip the handler entirely
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        request_key = request.headers.get("Idempotency-Key") or request.headers.get("X-Request-Id")
+        if not request_key:
+            return view(*args, **kwargs)
+        key = f"{request.method} {request.path} {request_key}"
+        outcome, cached = idempotency.begin(key)
+        if outcome == IdempotencyCache.HIT:
+            body, status, headers = cached
+            response = app.response_class(body, status=status, headers=headers)
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+        if outcome == IdempotencyCache.BUSY:
+            # Retry-After tells a retrying device this 409 is worth retrying, unlike a table held by another card
+            return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409, {"Retry-After": "1"}
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency.release(key)
+            raise
+        if response.status_code >= 500:
+            idempotency.release(key)
+        else:
+            idempotency.store(key, (response.get_data(), response.status_code, list(response.headers)))
+        return response
+    return wrapper
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -123,6 +474,7 @@ def login():
     # Check if admin login
     if data.get("is_admin", False):
         if data.get("password") == "admin":  # Hardcoded password for admin
+            session.regenerate()  # new sid on every login, so a sid fixed beforehand is not logged in
             session['is_admin'] = True
             return jsonify({"is_admin": True, "message": "Admin login successful"}), 200
         else:
@@ -131,6 +483,7 @@ def login():
     # Regular user login
     can_id = data.get("can_id")
     if can_id:
+        session.regenerate()
         session['can_id'] = can_id
         session['is_admin'] = False
         return jsonify({"can_id": can_id, "is_admin": False, "message": "User login successful"}), 200
@@ -158,40 +511,169 @@ def get_user():
         return jsonify({"error": "Not logged in"}), 401
 
 @app.route('/start_timer', methods=['POST'])
+@device_auth
+@idempotent
 def start_timer():
-    data = request.json
+    data = json_object()
+    if data is None:
+        return jsonify({"error": "Expected a JSON object"}), 400
     can_id = data.get("can_id")
     table_id = data.get("table_id")
-    if not can_id or not table_id:
+    if not valid_id(can_id) or not valid_id(table_id):
         return jsonify({"error": "Missing can_id or table_id"}), 400
-    duration = timers.start_timer(can_id, table_id)
-    return jsonify({"message": "Timer started", "duration": duration}), 200
+    if not device_may_act_for(table_id):
+        return token_mismatch()
+    timer = timers.start_timer(can_id, table_id)
+    return timer_response({"message": "Timer started", "duration": timer["remaining_time"], **timer})
 
 @app.route('/get_timer_status/<can_id>', methods=['GET'])
+@device_auth
 def get_timer_status(can_id):
     timer = timers.get_timer_status(can_id)
-    if not timer:
+    # A table's token only sees timers on its own table
+    if not timer or not device_may_act_for(timer["table_id"]):
         return jsonify({"error": "Timer not found"}), 404
-    return jsonify(timer), 200
+    return timer_response(timer)
 
 @app.route('/end_timer/<can_id>', methods=['POST'])
+@device_auth
+@idempotent
 def end_timer(can_id):
+    if g.device_table_id is not None:
+        timer = timers.get_timer_status(can_id)
+        if timer and not device_may_act_for(timer["table_id"]):
+            return jsonify({"error": "Timer not found"}), 404
     success = timers.end_timer(can_id)
     if success:
         return jsonify({"message": "Timer ended"}), 200
     return jsonify({"error": "Timer not found"}), 404
 
 @app.route('/set_table_vacant', methods=['POST'])
+@device_auth
+@idempotent
 def set_table_vacant():
-    data = request.json
+    data = json_object()
+    if data is None:
+        return jsonify({"error": "Expected a JSON object"}), 400
     table_id = data.get("table_id")
-    if not table_id:
+    if not valid_id(table_id):
         return jsonify({"error": "Missing table_id"}), 400
+    if not device_may_act_for(table_id):
+        return token_mismatch()
     success = timers.set_table_vacant(table_id)
     if success:
         return jsonify({"message": f"Table {table_id} is now vacant"}), 200
     return jsonify({"error": "Table not found or already vacant"}), 404
 
+@app.route('/device/<table_id>/chope', methods=['POST'])
+@device_auth
+@idempotent
+def device_chope(table_id):
+    data = json_object()
+    if data is None:
+        return jsonify({"error": "Expected a JSON object"}), 400
+    can_id = data.get("can_id")
+    if not valid_id(can_id):
+        return jsonify({"error": "Missing can_id"}), 400
+    state = timers.chope_table(table_id, can_id)
+    if state["can_id"] != can_id:
+        return jsonify({"error": "Table already choped", **state}), 409
+    return timer_response({"message": "Table choped", **state})
+
+@app.route('/device/<table_id>/release', methods=['POST'])
+@device_auth
+@idempotent
+def device_release(table_id):
+    state = timers.release_table(table_id)
+    if state is None:
+        return jsonify({"error": "Table not found"}), 404
+    return jsonify({"message": f"Table {table_id} is now vacant", **state}), 200
+
+@app.route('/device/<table_id>/heartbeat', methods=['POST'])
+@device_auth
+def device_heartbeat(table_id):
+    # Idle devices have nothing else to send; device_auth records that this one is alive (if it has a token)
+    return jsonify({"table_id": table_id, "server_time": time.time()}), 200
+
+@app.route('/device/<table_id>/ws', websocket=True)
+@device_auth
+def device_ws(table_id):
+    # One persistent socket per device instead of a new HTTP request every poll
+    conn = device_hub.accept(request.environ, table_id)
+    try:
+        conn.send("table_state", timers.get_table_state(table_id))
+        while True:
+            reply = handle_device_frame(table_id, conn.receive(), track=g.device_table_id is not None)
+            if reply:
+                conn.send(*reply)
+    except ConnectionClosed:
+        pass
+    finally:
+        device_hub.remove(conn)
+    return closed_response(conn)
+
+def handle_device_frame(table_id, frame, track=False):
+    # track: the socket was opened with a verified token, so its frames count as the device being alive
+    if track:
+        device_registry.seen(table_id, time.time())
+    try:
+        message = json.loads(frame)
+    except (TypeError, ValueError):
+        return "error", {"error": "Invalid JSON frame"}
+    if not isinstance(message, dict):
+        return "error", {"error": "Invalid JSON frame"}
+    kind = message.get("type")
+    if kind == "card_tap":
+        can_id = message.get("can_id")
+        if not valid_id(can_id):
+            return "error", {"error": "Missing can_id"}
+        action, state = timers.tap_card(table_id, can_id)
+        event_log.append([normalize_event({"type": "clash" if action == "clash" else "card_tap", "can_id": can_id}, table_id)])
+        if action == "clash":
+            return "clash", state
+        return None  # the new table_state is pushed to every device on this table
+    if kind == "pir":
+        # The socket belongs to one table, so a table_id in the frame is ignored
+        event = normalize_event({**message, "type": "pir_high" if message.get("state") == "high" else "pir_low",
+                                 "table_id": table_id}, table_id)
+        event_log.append([event])
+        return None
+    if kind == "heartbeat":
+        return None  # already recorded above
+    return "error", {"error": f"Unknown frame type: {kind}"}
+
+@app.route('/ingest/events', methods=['POST'])
+@device_auth
+def ingest_events():
+    # Accepts {"table_id": ..., "events": [...]} from one device or a bare list from a gateway.
+    # A table's token may only send events for its own table; only gateway tokens mix tables.
+    data = request.get_json(silent=True)
+    table_id = None
+    if isinstance(data, dict):
+        table_id = data.get("table_id")
+        data = data.get("events")
+    if not isinstance(data, list):
+        return jsonify({"error": "Expected a list of events"}), 400
+    if len(data) > EVENT_BATCH_MAX:
+        return jsonify({"error": f"At most {EVENT_BATCH_MAX} events per batch"}), 413
+    if g.device_table_id not in (None, GATEWAY_TABLE):
+        if table_id is not None and table_id != g.device_table_id:
+            return token_mismatch()
+        table_id = g.device_table_id
+        if any(isinstance(raw, dict) and raw.get("table_id", table_id) != table_id for raw in data):
+            return token_mismatch()
+    received_at = time.time()
+    events = [normalize_event(raw, table_id, received_at) for raw in data]
+    accepted = [event for event in events if event is not None]
+    cursor = event_log.append(accepted)
+    return jsonify({"accepted": len(accepted), "rejected": len(events) - len(accepted), "cursor": cursor}), 200
+
+@app.route('/ingest/events', methods=['GET'])
+@admin_required
+def list_events():
+    since = request.args.get("since", 0, type=int)
+    return jsonify({"events": event_log.since(since), **event_log.stats()}), 200
+
 @app.route('/count_occupied_tables', methods=['GET'])
 def count_occupied_tables():
     if 'can_id' in session or 'is_admin' in session:
@@ -202,7 +684,201 @@ def count_occupied_tables():
 
 
 
+@app.route('/admin/idempotency', methods=['GET'])
+@admin_required
+def idempotency_stats():
+    return jsonify(idempotency.stats()), 200
+
+@app.route('/admin/presence', methods=['GET'])
+@admin_required
+def presence_stats():
+    return jsonify(presence.stats()), 200
+
+@app.route('/admin/sweeper', methods=['GET'])
+@admin_required
+def sweeper_stats():
+    return jsonify(timers.sweeper_stats()), 200
+
+@app.route('/admin/admission', methods=['GET'])
+@admin_required
+def admission_stats():
+    return jsonify(admission.stats()), 200
+
+@app.route('/admin/ratelimit', methods=['GET'])
+@admin_required
+def ratelimit_stats():
+    return jsonify(rate_limiter.stats()), 200
+
+@app.route('/admin/sessions', methods=['GET'])
+@admin_required
+def session_stats():
+    return jsonify(session_store.stats()), 200
+
+@app.route('/admin/device_tokens', methods=['POST'])
+@admin_required
+def issue_device_token():
+    # {"table_id": ...} for a table's device, or {"gateway": true} for a gateway sending events for any table
+    data = request.get_json(silent=True) or {}
+    table_id = GATEWAY_TABLE if data.get("gateway") is True else data.get("table_id")
+    if not table_id or not isinstance(table_id, str):
+        return jsonify({"error": "Missing table_id"}), 400
+    if table_id == GATEWAY_TABLE and data.get("gateway") is not True:
+        return jsonify({"error": f"{GATEWAY_TABLE} is not a table id; send gateway: true for a gateway token"}), 400
+    token, token_id = device_tokens.issue(table_id)
+    return jsonify({"table_id": table_id, "token_id": token_id, "token": token}), 201
+
+@app.route('/admin/device_tokens/revoke', methods=['POST'])
+@admin_required
+def revoke_device_token():
+    # By token_id, or by the token itself if the id was not kept
+    data = request.get_json(silent=True) or {}
+    token_id = data.get("token_id")
+    if not token_id and data.get("token"):
+        claims = device_tokens.load(data["token"])
+        token_id = claims[1] if claims else None
+    if not token_id or not isinstance(token_id, str):
+        return jsonify({"error": "Missing or invalid token_id"}), 400
+    device_tokens.revoke(token_id)
+    broadcast([("device_token_revoked", {"token_id": token_id})])  # every worker's revoked set
+    return jsonify({"message": f"Token {token_id} revoked"}), 200
+
+@app.route('/admin/device_tokens', methods=['GET'])
+@admin_required
+def device_token_stats():
+    return jsonify(device_tokens.stats()), 200
+
+@app.route('/admin/devices', methods=['GET'])
+@admin_required
+def device_health():
+    # Lists only the offline devices, so it stays cheap with thousands of healthy tables
+    return jsonify({**device_registry.stats(), "unhealthy": device_registry.unhealthy(time.time())}), 200
+
+@app.route('/admin/lock_profile', methods=['GET'])
+@admin_required
+def lock_profile():
+    return jsonify(lock_profiler.report()), 200
+
+@app.route('/admin/lock_profile', methods=['POST'])
+@admin_required
+def toggle_lock_profile():
+    # {"enabled": true, "reset": true} starts a fresh profile
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get("enabled"), bool):
+        return jsonify({"error": "Expected a boolean enabled"}), 400
+    lock_profiler.set_enabled(data["enabled"], reset=bool(data.get("reset")))
+    return jsonify(lock_profiler.report()), 200
+
+@app.route('/admin/lock_profile/collapsed', methods=['GET'])
+@admin_required
+def lock_profile_collapsed():
+    # flamegraph.pl / speedscope input; ?metric=hold for hold time instead of wait time
+    metric = request.args.get("metric", "wait")
+    if metric not in ("wait", "hold"):
+        return jsonify({"error": "metric must be wait or hold"}), 400
+    return lock_profiler.collapsed(metric), 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+@app.route('/admin/request_timing', methods=['GET'])
+@admin_required
+def request_timing():
+    # ?route=<endpoint> narrows both lists; ?limit= caps the slowest requests returned
+    return jsonify(request_timer.report(request.args.get("route"), request.args.get("limit", type=int))), 200
+
+@app.route('/admin/request_timing', methods=['POST'])
+@admin_required
+def toggle_request_timing():
+    # {"enabled": true, "reset": true} starts from empty routes and slowest list
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get("enabled"), bool):
+        return jsonify({"error": "Expected a boolean enabled"}), 400
+    request_timer.set_enabled(data["enabled"], reset=bool(data.get("reset")))
+    return jsonify(request_timer.report(limit=0)), 200
+
+sampler = SamplingProfiler()
+memory = MemoryTracker()
+
+@app.route('/admin/profile', methods=['GET'])
+@admin_required
+def sample_profile():
+    # Blocks this request for ?seconds= (default 5, at most 60) while every other thread is sampled
+    seconds = request.args.get("seconds", 5, type=float)
+    interval = request.args.get("interval", 0.01, type=float)
+    result = sampler.profile(seconds, interval)
+    if result is None:
+        return jsonify({"error": "A profile is already running"}), 409
+    stacks, samples = result
+    if request.args.get("format") == "json":
+        top = sorted(stacks.items(), key=lambda item: -item[1])[:50]
+        return jsonify({"samples": samples, "stacks": [{"stack": stack, "count": count} for stack, count in top]}), 200
+    return collapsed(stacks), 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+@app.route('/admin/tracemalloc', methods=['GET'])
+@admin_required
+def tracemalloc_stats():
+    return jsonify(memory.stats()), 200
+
+@app.route('/admin/tracemalloc/start', methods=['POST'])
+@admin_required
+def tracemalloc_start():
+    # More frames give fuller tracebacks but cost more memory and time per allocation
+    frames = (request.get_json(silent=True) or {}).get("frames", 1)
+    if not isinstance(frames, int) or not 1 <= frames <= 100:
+        return jsonify({"error": "frames must be between 1 and 100"}), 400
+    if not memory.start(frames):
+        return jsonify({"error": "tracemalloc is already tracing"}), 409
+    return jsonify(memory.stats()), 200
+
+@app.route('/admin/tracemalloc/stop', methods=['POST'])
+@admin_required
+def tracemalloc_stop():
+    memory.stop()
+    return jsonify(memory.stats()), 200
+
+def tracemalloc_query():
+    key = request.args.get("key", "lineno")
+    limit = request.args.get("limit", 20, type=int)
+    return (key, limit) if key in ("lineno", "filename", "traceback") else (None, limit)
+
+@app.route('/admin/tracemalloc/snapshot', methods=['POST'])
+@admin_required
+def tracemalloc_snapshot():
+    # Becomes the baseline that /admin/tracemalloc/diff compares against
+    key, limit = tracemalloc_query()
+    if key is None:
+        return jsonify({"error": "key must be lineno, filename or traceback"}), 400
+    if not memory.stats()["tracing"]:
+        return jsonify({"error": "tracemalloc is not tracing; POST /admin/tracemalloc/start first"}), 409
+    return jsonify({**memory.stats(), "top": memory.snapshot(key, limit)}), 200
+
+@app.route('/admin/tracemalloc/diff', methods=['GET'])
+@admin_required
+def tracemalloc_diff():
+    key, limit = tracemalloc_query()
+    if key is None:
+        return jsonify({"error": "key must be lineno, filename or traceback"}), 400
+    if not memory.stats()["tracing"]:
+        return jsonify({"error": "tracemalloc is not tracing"}), 409
+    growth = memory.diff(key, limit)
+    if growth is None:
+        return jsonify({"error": "No baseline; POST /admin/tracemalloc/snapshot first"}), 409
+    return jsonify({**memory.stats(), "growth": growth}), 200
+
+@app.route('/admin/leader', methods=['GET'])
+@admin_required
+def leader_stats():
+    if leader is None:
+        return jsonify({"multi_worker": False, "pid": os.getpid(), "is_leader": True}), 200
+    stats = {"multi_worker": True, **leader.stats(), "table_slots": table_slots.stats(), "bus": bus.stats()}
+    if leader.is_leader:
+        stats["bus_hub"] = bus_hub.stats()
+    return jsonify(stats), 200
+
+@app.route('/metrics', methods=['GET'])
+@session_free
+def metrics_endpoint():
+    return metrics.render(), 200, {"Content-Type": MetricsRegistry.CONTENT_TYPE}
+
 @app.route('/get_timer_duration', methods=['GET'])
+@session_free
 def get_timer_duration():
     return jsonify({"duration": timers.default_duration}), 200
 
@@ -215,5 +891,7 @@ def update_timer_duration():
     timers.default_duration = new_duration
     return jsonify({"message": "Timer duration updated", "new_duration": new_duration}), 200
 
+# Development only; run serve.py in production. The reloader would start a second timer engine
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    start_background()
+    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
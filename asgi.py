@@ -0,0 +1,296 @@
+import asyncio
+import io
+import json
+import math
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import socketio
+
+import app as backend
+from timers import next_deadline
+
+# Flask views run on a bounded pool; sockets and long-polls are coroutines and hold no thread
+WSGI_THREADS = 32
+WSGI_MAX_BODY = 1024 * 1024  # bytes
+HOUSEKEEPING_INTERVAL = 5  # seconds between presence expiry / stale sweeps
+DEVICE_SEND_QUEUE = 64  # frames buffered per device before the oldest is dropped
+
+DEVICE_WS_PATH = re.compile(r"^/device/([^/]+)/ws$")
+
+executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
+
+
+class WsgiBridge:
+    """Serves a WSGI app to an ASGI server, running each request on the executor."""
+
+    def __init__(self, wsgi_app, executor, max_body=WSGI_MAX_BODY):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1000})
+            return
+        body = b""
+        more = True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+            if len(body) > self.max_body:
+                await self.respond(send, 413, [(b"content-type", b"text/plain")], b"Request body too large")
+                return
+        loop = asyncio.get_running_loop()
+        status, headers, content = await loop.run_in_executor(self.executor, self.call, self.environ(scope, body))
+        await self.respond(send, status, headers, content)
+
+    async def respond(self, send, status, headers, content):
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": content})
+
+    def environ(self, scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+            "PATH_INFO": scope["path"].encode().decode("latin-1"),
+            "QUERY_STRING": scope["query_string"].decode("latin-1"),
+            "CONTENT_LENGTH": str(len(body)),  # the body is already buffered, chunked or not
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope["headers"]:
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name == "CONTENT_TYPE":
+                environ[name] = value
+            elif name == "CONTENT_LENGTH":
+                continue
+            else:
+                key = f"HTTP_{name}"
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def call(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            content = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return response["status"], response["headers"], content
+
+
+class AsyncDeviceConnection:
+    __slots__ = ("table_id", "queue")
+
+    def __init__(self, table_id):
+        self.table_id = table_id
+        self.queue = asyncio.Queue(DEVICE_SEND_QUEUE)
+
+    def put(self, event, payload):
+        # Loop thread only; a device that stops reading loses its oldest frames, not the server's memory
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(json.dumps({"event": event, **payload}))
+
+
+class AsyncDeviceHub:
+    """DeviceHub for device WebSockets served as coroutines; push() may be called from any thread."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.connections = {}  # table_id -> set of AsyncDeviceConnection, touched on the loop only
+
+    def add(self, table_id):
+        conn = AsyncDeviceConnection(table_id)
+        self.connections.setdefault(table_id, set()).add(conn)
+        return conn
+
+    def remove(self, conn):
+        table_conns = self.connections.get(conn.table_id)
+        if table_conns is not None:
+            table_conns.discard(conn)
+            if not table_conns:
+                del self.connections[conn.table_id]
+
+    def push(self, table_id, event, payload):
+        self.loop.call_soon_threadsafe(self._push, table_id, event, payload)
+
+    def _push(self, table_id, event, payload):
+        for conn in self.connections.get(table_id, ()):
+            conn.put(event, payload)
+
+    def count(self):
+        return sum(len(table_conns) for table_conns in self.connections.values())
+
+
+class TimerEngine:
+    """Runs decrement_timers only when an alert mark or expiry is due, via loop.call_at.
+
+    Every published table_state carrying a timer may pull the wake-up
+    earlier; after each tick the engine sleeps until Timers.next_deadline.
+    Presence expiry and the stale sweep run every HOUSEKEEPING_INTERVAL.
+    """
+
+    def __init__(self, loop, timers, executor):
+        self.loop = loop
+        self.timers = timers
+        self.executor = executor
+        self.handle = None
+        self.due = math.inf  # wall-clock time the pending call_at is for
+        self.ticks = 0
+
+    def start(self):
+        self.schedule(self.timers.next_deadline(time.time()))
+        self.loop.create_task(self.housekeeping())
+
+    def schedule(self, deadline):
+        # Loop thread only
+        if deadline is None or deadline >= self.due:
+            return
+        if self.handle is not None:
+            self.handle.cancel()
+        self.due = deadline
+        self.handle = self.loop.call_at(self.loop.time() + max(0, deadline - time.time()), self.fire)
+
+    def fire(self):
+        backend.tick_lag.observe(max(0, time.time() - self.due))
+        self.handle = None
+        self.due = math.inf
+        self.loop.create_task(self.tick())
+
+    async def tick(self):
+        try:
+            await self.loop.run_in_executor(self.executor, backend.tick)
+        finally:
+            self.ticks += 1
+            self.schedule(self.timers.next_deadline(time.time()))
+
+    def on_events(self, events):
+        # Called from whichever thread published; a new or restarted timer may be due sooner
+        now = time.time()
+        for event, payload in events:
+            if event == "table_state" and payload["timer"]:
+                self.loop.call_soon_threadsafe(self.schedule, next_deadline(payload["timer"], now))
+
+    async def housekeeping(self):
+        while True:
+            await asyncio.sleep(HOUSEKEEPING_INTERVAL)
+            try:
+                await self.loop.run_in_executor(self.executor, backend.housekeeping)
+            except Exception as e:
+                print("Housekeeping failed:", e)
+
+    def stats(self):
+        return {"ticks": self.ticks, "next_due_in": self.due - time.time() if self.due != math.inf else None}
+
+
+devices = None
+engine = None
+
+
+async def device_socket(scope, receive, send, table_id):
+    # Same frames as the threaded /device/<table_id>/ws view in app.py
+    loop = asyncio.get_running_loop()
+    if (await receive())["type"] != "websocket.connect":
+        return
+    token = dict(scope["headers"]).get(b"x-device-token", b"").decode("latin-1")
+    if not backend.device_allowed(token, table_id):
+        await send({"type": "websocket.close", "code": 1008})  # policy violation
+        return
+    await send({"type": "websocket.accept"})
+    backend.device_registry.seen(table_id, time.time())
+    conn = devices.add(table_id)
+
+    async def writer():
+        while True:
+            await send({"type": "websocket.send", "text": await conn.queue.get()})
+
+    sender = loop.create_task(writer())
+    try:
+        conn.put("table_state", await loop.run_in_executor(executor, backend.timers.get_table_state, table_id))
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            frame = message.get("text") or message.get("bytes")
+            reply = await loop.run_in_executor(executor, backend.handle_device_frame, table_id, frame)
+            if reply:
+                conn.put(*reply)
+    finally:
+        sender.cancel()
+        devices.remove(conn)
+
+
+async def startup():
+    global devices, engine
+    loop = asyncio.get_running_loop()
+    devices = AsyncDeviceHub(loop)
+
+    def alert(event, payload):
+        asyncio.run_coroutine_threadsafe(sio.emit(event, payload), loop)
+
+    backend.use_clients(alert, devices, count_clients=lambda: len(sio.eio.sockets))
+    if backend.MULTI_WORKER:
+        backend.start_background()  # the elected leader's timer thread drives every worker
+        return
+    engine = TimerEngine(loop, backend.timers, executor)
+
+    def on_timer_events(events):
+        backend.publish(events)
+        engine.on_events(events)
+
+    backend.timers.on_events = on_timer_events
+    backend.start_background(timer_engine=False)
+    engine.start()
+
+
+async def shutdown():
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, backend.session_store.flush)
+    if not backend.MULTI_WORKER:
+        await loop.run_in_executor(executor, backend.timers.save_timers)
+
+
+bridge = WsgiBridge(backend.app, executor)
+
+
+async def routes(scope, receive, send):
+    match = DEVICE_WS_PATH.match(scope["path"]) if scope["type"] == "websocket" else None
+    if match:
+        await device_socket(scope, receive, send, match.group(1))
+    else:
+        await bridge(scope, receive, send)
+
+
+# uvicorn asgi:application --host 0.0.0.0 --port 5000
+application = socketio.ASGIApp(sio, other_asgi_app=routes, on_startup=startup, on_shutdown=shutdown)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(application, host="0.0.0.0", port=5000, ws="wsproto", timeout_keep_alive=30)
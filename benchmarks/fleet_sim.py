@@ -0,0 +1,524 @@
+"""Drive a running backend with a fleet of simulated chopethingy table devices.
+
+Each virtual table is one asyncio task running the firmware's loop: a
+diner arrives (PIR high) and either taps a card, which chopes the table
+(POST /device/<table>/chope) and polls /get_timer_status/<card> as often
+as poll_after says, or just sits down (OCCUPIED). The chope ends when the
+diner taps again on leaving, or when the server reports the timer over,
+and the device then releases the table. Like the firmware, a poll the
+server could not answer (429, 5xx or no response) keeps the chope and is
+retried after Retry-After, or 2s without one; any other status but 200
+releases it. Sensor events are batched to
+/ingest/events every 10s and every device sends a heartbeat every 30s.
+
+Arrivals per table are Poisson: "steady" at --arrival-rate, "lunch" rising
+to --peak times that rate in the middle of the run, "burst" with every
+table getting its first diner within the first 5s. Reports throughput,
+p50/p95/p99 latency and failures per endpoint, plus timer accuracy: how
+far each reported remaining_time strays from the chope's expires_at, and
+how late devices learn that their timer ended. remaining_time is rounded
+up to whole seconds, so a drift between 0 and 1s is exact. Both compare
+against the server's wall clock, so run it on the same host as the backend.
+
+Like the firmware, every request opens its own connection unless
+--keepalive is given. Every device on one address shares the per-IP rate
+limit, so against a loopback backend --source-ips spreads the tables
+over that many 127.0.0.0/8 source addresses.
+
+    python serve.py &
+    python benchmarks/fleet_sim.py [--tables 1000] [--seconds 300] [--arrivals lunch] [--timer-duration 120]
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import math
+import os
+import random
+import secrets
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from device_tokens import DeviceTokens
+
+# Firmware constants (chopethingy.ino)
+POLL_INTERVAL = 1  # seconds until the first status poll after a chope
+STATUS_RETRY_DELAY = 2  # seconds before re-polling after a 429, 5xx or no response without Retry-After
+RETRY_AFTER_MAX = 5  # seconds; the firmware caps a server's Retry-After here (WRITE_RETRY_MAX_DELAY)
+EVENT_FLUSH_INTERVAL = 10
+HEARTBEAT_INTERVAL = 30
+EVENT_BUFFER_SIZE = 16
+BURST_WINDOW = 5  # seconds in which every table gets its first diner with --arrivals burst
+
+AVAILABLE, CHOPED, OCCUPIED = "available", "choped", "occupied"
+ENDPOINTS = ("chope", "status", "release", "events", "heartbeat")
+
+
+def percentile(samples, pct):
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+class Stats:
+    def __init__(self):
+        self.latency = {endpoint: [] for endpoint in ENDPOINTS}
+        self.statuses = {endpoint: {} for endpoint in ENDPOINTS}
+        self.failures = {endpoint: 0 for endpoint in ENDPOINTS}  # timeouts and connection errors
+        self.drift = []  # reported remaining_time minus what the chope's expires_at implies, seconds
+        self.end_lateness = []  # when the device learned its timer ended minus expires_at, seconds
+        self.chopes = 0
+        self.chopes_failed = 0  # not a 200; the device still counts as choped until its next poll
+        self.released_by_diner = 0
+        self.released_on_expiry = 0
+        self.released_on_error = 0  # a poll refused outright (401, 400, ...) made the device give the table up
+        self.polls_retried = 0  # 429, 5xx or no response: the device kept the chope and asked again later
+        self.sat_without_tap = 0
+
+    def record(self, endpoint, status, seconds):
+        self.latency[endpoint].append(seconds)
+        statuses = self.statuses[endpoint]
+        statuses[status] = statuses.get(status, 0) + 1
+
+    def requests(self):
+        return sum(len(samples) for samples in self.latency.values()) + sum(self.failures.values())
+
+    def summary(self, seconds):
+        endpoints = {}
+        for endpoint in ENDPOINTS:
+            samples = sorted(self.latency[endpoint])
+            statuses = self.statuses[endpoint]
+            count = len(samples) + self.failures[endpoint]
+            errors = self.failures[endpoint] + sum(n for status, n in statuses.items() if status in (401, 429) or status >= 500)
+            endpoints[endpoint] = {
+                "requests": count,
+                "rps": count / seconds,
+                "p50_ms": percentile(samples, 50) * 1000 if samples else None,
+                "p95_ms": percentile(samples, 95) * 1000 if samples else None,
+                "p99_ms": percentile(samples, 99) * 1000 if samples else None,
+                "error_rate": errors / count if count else 0.0,
+                "statuses": {str(status): n for status, n in sorted(statuses.items())},
+                "failures": self.failures[endpoint]
+            }
+        return {
+            "seconds": seconds,
+            "requests": self.requests(),
+            "rps": self.requests() / seconds,
+            "endpoints": endpoints,
+            "chopes": self.chopes,
+            "chopes_failed": self.chopes_failed,
+            "released_by_diner": self.released_by_diner,
+            "released_on_expiry": self.released_on_expiry,
+            "released_on_error": self.released_on_error,
+            "polls_retried": self.polls_retried,
+            "sat_without_tap": self.sat_without_tap,
+            "timer_drift_s": distribution(self.drift),
+            "end_lateness_s": distribution(self.end_lateness)
+        }
+
+
+def distribution(samples):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return {"samples": len(samples), "min": samples[0], "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95), "p99": percentile(samples, 99), "max": samples[-1]}
+
+
+class HttpClient:
+    """Just enough HTTP/1.1 for the device endpoints: JSON bodies, Content-Length or chunked replies."""
+
+    def __init__(self, host, port, timeout, keepalive, limit):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.limit = limit  # semaphore bounding open connections, so a big fleet does not run out of fds
+
+    async def request(self, conn, method, path, body=None, headers=None):
+        """Returns (status, parsed JSON body or None, lower-cased headers); conn is the table's Connection."""
+        payload = b"" if body is None else json.dumps(body).encode()
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(payload)}",
+                 "Connection: keep-alive" if self.keepalive else "Connection: close"]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        data = ("\r\n".join(lines) + "\r\n\r\n").encode() + payload
+        async with self.limit:
+            return await asyncio.wait_for(self._exchange(conn, data), self.timeout)
+
+    async def _exchange(self, conn, data):
+        for attempt in (0, 1):
+            fresh = conn.reader is None
+            if fresh:
+                conn.reader, conn.writer = await asyncio.open_connection(self.host, self.port, local_addr=conn.local_addr)
+            try:
+                conn.writer.write(data)
+                await conn.writer.drain()
+                status, headers, body = await self._read_response(conn.reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                conn.close()
+                if fresh or attempt:
+                    raise
+                continue  # the server closed an idle keep-alive connection; retry once on a new one
+            if not self.keepalive or headers.get("connection", "").lower() == "close":
+                conn.close()
+            try:
+                return status, json.loads(body) if body else None, headers
+            except ValueError:
+                return status, None, headers
+
+    async def _read_response(self, reader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        status = int(status_line.split(" ", 2)[1])
+        headers = {}
+        for line in header_lines:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readuntil(b"\r\n")
+                    break
+                chunks.append((await reader.readexactly(size + 2))[:-2])
+            return status, headers, b"".join(chunks)
+        if "content-length" in headers:
+            return status, headers, await reader.readexactly(int(headers["content-length"]))
+        return status, headers, await reader.read()
+
+
+class Connection:
+    def __init__(self, local_addr):
+        self.local_addr = local_addr
+        self.reader = None
+        self.writer = None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class ArrivalProfile:
+    """Poisson diner arrivals per table; the rate may vary over the run (sampled by thinning)."""
+
+    def __init__(self, kind, per_minute, peak, seconds):
+        self.kind = kind
+        self.base = per_minute / 60
+        self.peak = peak if kind == "lunch" else 1
+        self.seconds = seconds
+
+    def rate(self, t):
+        if self.kind != "lunch":
+            return self.base
+        # Gaussian rush centred on the middle of the run
+        width = self.seconds / 10
+        return self.base * (1 + (self.peak - 1) * math.exp(-0.5 * ((t - self.seconds / 2) / width) ** 2))
+
+    def next_arrival(self, rng, t, first):
+        """Seconds into the run of the next diner after t, or inf if none comes before the end."""
+        if first and self.kind == "burst":
+            return rng.uniform(0, BURST_WINDOW)
+        ceiling = self.base * self.peak
+        if ceiling <= 0:
+            return math.inf
+        while True:
+            t += rng.expovariate(ceiling)
+            if t > self.seconds:
+                return math.inf
+            if rng.random() * ceiling <= self.rate(t):
+                return t
+
+
+def retry_after(headers):
+    # Like the firmware's retryAfterMs(): whole seconds, capped, STATUS_RETRY_DELAY when absent or unreadable
+    try:
+        seconds = int(headers.get("retry-after", ""))
+    except ValueError:
+        return STATUS_RETRY_DELAY
+    return min(seconds, RETRY_AFTER_MAX) if seconds > 0 else STATUS_RETRY_DELAY
+
+
+class VirtualTable:
+    """The firmware's state machine for one table, against the real endpoints."""
+
+    def __init__(self, sim, table_id, token, local_addr, rng):
+        self.sim = sim
+        self.table_id = table_id
+        self.token = token
+        self.conn = Connection(local_addr)
+        self.rng = rng
+        self.state = AVAILABLE
+        self.card = None
+        self.expires_at = None  # server wall clock, from the chope response
+        self.next_poll = math.inf
+        self.present = False
+        self.arrival = math.inf  # monotonic time the next diner turns up
+        self.leave_at = math.inf
+        self.events = []  # (type, monotonic time)
+        self.last_flush = 0.0
+        self.last_heartbeat = 0.0
+
+    async def call(self, endpoint, method, path, body=None, headers=None):
+        """Returns (status, JSON body, response headers); (None, None, {}) if the request failed."""
+        headers = dict(headers or {})
+        if self.token:
+            headers["X-Device-Token"] = self.token
+        started = time.perf_counter()
+        try:
+            status, data, response_headers = await self.sim.client.request(self.conn, method, path, body, headers)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            self.conn.close()
+            self.sim.stats.failures[endpoint] += 1
+            return None, None, {}
+        self.sim.stats.record(endpoint, status, time.perf_counter() - started)
+        return status, data, response_headers
+
+    def record_event(self, kind):
+        # A full buffer is flushed on the next pass of the loop; if that fails, new events are dropped
+        if len(self.events) < EVENT_BUFFER_SIZE:
+            self.events.append((kind, time.monotonic()))
+
+    async def run(self, started):
+        sim = self.sim
+        # Devices were not switched on at the same moment
+        self.last_heartbeat = started - self.rng.uniform(0, HEARTBEAT_INTERVAL)
+        self.last_flush = started - self.rng.uniform(0, EVENT_FLUSH_INTERVAL)
+        self.arrival = started + sim.profile.next_arrival(self.rng, 0.0, first=True)
+        while True:
+            now = time.monotonic()
+            if self.state == AVAILABLE and not self.present and now >= self.arrival:
+                await self.arrive(now)
+            if self.present and now >= self.leave_at:
+                await self.leave()
+            if self.state == CHOPED and now >= self.next_poll:
+                await self.poll()
+            if self.events and (now - self.last_flush >= EVENT_FLUSH_INTERVAL or len(self.events) >= EVENT_BUFFER_SIZE):
+                await self.flush_events()
+            if now - self.last_heartbeat >= HEARTBEAT_INTERVAL:
+                await self.heartbeat()
+            wake = min(self.arrival if self.state == AVAILABLE and not self.present else math.inf,
+                       self.leave_at if self.present else math.inf,
+                       self.next_poll if self.state == CHOPED else math.inf,
+                       self.last_flush + EVENT_FLUSH_INTERVAL if self.events else math.inf,
+                       self.last_heartbeat + HEARTBEAT_INTERVAL)
+            await asyncio.sleep(max(0.0, wake - time.monotonic()))
+
+    async def arrive(self, now):
+        sim = self.sim
+        self.present = True
+        self.leave_at = now + self.rng.expovariate(1 / sim.args.stay)
+        self.record_event("pir_high")
+        if self.rng.random() < sim.args.tap_prob:
+            self.card = f"{sim.run_id}-{self.table_id}-{secrets.token_hex(3)}"
+            self.record_event("card_tap")
+            await self.chope()
+        else:
+            self.state = OCCUPIED
+            sim.stats.sat_without_tap += 1
+
+    async def leave(self):
+        self.present = False
+        self.leave_at = math.inf
+        self.record_event("pir_low")
+        if self.state == CHOPED:
+            self.record_event("card_tap")  # same card again: the diner ends the reservation
+            self.sim.stats.released_by_diner += 1
+            await self.release()
+        self.state = AVAILABLE
+        # Poisson arrivals are memoryless, so diners who would have found the table taken are simply not drawn
+        sim = self.sim
+        self.arrival = sim.started + sim.profile.next_arrival(self.rng, time.monotonic() - sim.started, first=False)
+
+    async def chope(self):
+        sim = self.sim
+        self.state = CHOPED
+        self.next_poll = time.monotonic() + POLL_INTERVAL
+        self.expires_at = None
+        sim.stats.chopes += 1
+        status, data, _ = await self.call("chope", "POST", f"/device/{self.table_id}/chope", {"can_id": self.card},
+                                       {"Idempotency-Key": f"{self.table_id}-{secrets.token_hex(4)}"})
+        # The firmware ignores the outcome and lets the next poll sort it out
+        if status == 200 and isinstance(data, dict) and data.get("timer"):
+            self.expires_at = data["timer"]["expires_at"]
+        else:
+            sim.stats.chopes_failed += 1
+
+    async def poll(self):
+        stats = self.sim.stats
+        status, data, headers = await self.call("status", "GET", f"/get_timer_status/{self.card}")
+        received = time.time()
+        if status is None or status == 429 or status >= 500:
+            # Not an answer about the timer: keep the chope and the local countdown, ask again later
+            stats.polls_retried += 1
+            self.next_poll = time.monotonic() + retry_after(headers)
+            return
+        remaining = data.get("remaining_time", -1) if status == 200 and isinstance(data, dict) else -1
+        if remaining > 0:
+            if self.expires_at is not None:
+                stats.drift.append(remaining - (self.expires_at - received))
+            self.next_poll = time.monotonic() + max(data.get("poll_after", POLL_INTERVAL), POLL_INTERVAL)
+            return
+        if status in (200, 404) and self.expires_at is not None:
+            stats.released_on_expiry += 1
+            stats.end_lateness.append(received - self.expires_at)
+        else:
+            stats.released_on_error += 1
+        await self.release()
+        # Still seated once the timer runs out: the PIR keeps the table OCCUPIED
+        self.state = OCCUPIED if self.present else AVAILABLE
+
+    async def release(self):
+        self.state = AVAILABLE
+        self.next_poll = math.inf
+        self.card = None
+        await self.call("release", "POST", f"/device/{self.table_id}/release", {},
+                        {"Idempotency-Key": f"{self.table_id}-{secrets.token_hex(4)}"})
+
+    async def flush_events(self):
+        self.last_flush = time.monotonic()
+        now = time.monotonic()
+        batch = self.events[:EVENT_BUFFER_SIZE]
+        payload = {"table_id": self.table_id,
+                   "events": [{"type": kind, "age_ms": int((now - at) * 1000)} for kind, at in batch]}
+        status, _, _ = await self.call("events", "POST", "/ingest/events", payload)
+        if status == 200:
+            del self.events[:len(batch)]
+
+    async def heartbeat(self):
+        self.last_heartbeat = time.monotonic()
+        await self.call("heartbeat", "POST", f"/device/{self.table_id}/heartbeat")
+
+
+class Simulation:
+    def __init__(self, args):
+        self.args = args
+        self.stats = Stats()
+        self.profile = ArrivalProfile(args.arrivals, args.arrival_rate, args.peak, args.seconds)
+        self.client = HttpClient(args.host, args.port, args.timeout, args.keepalive,
+                                 asyncio.Semaphore(args.max_connections))
+        self.run_id = secrets.token_hex(3)  # card ids never collide with an earlier run's leftovers
+        self.started = None
+
+
+def source_addresses(host, count):
+    if count <= 1:
+        return [None]
+    address = ipaddress.ip_address("127.0.0.1" if host == "localhost" else host)
+    if not address.is_loopback:
+        raise SystemExit("--source-ips needs a loopback --host")
+    base = ipaddress.ip_address("127.1.0.1")
+    return [(str(base + i), 0) for i in range(count)]
+
+
+async def report_progress(sim, tables, every=10):
+    last = 0
+    while True:
+        await asyncio.sleep(every)
+        requests = sim.stats.requests()
+        choped = sum(1 for table in tables if table.state == CHOPED)
+        failures = sum(sim.stats.failures.values())
+        print(f"{time.monotonic() - sim.started:6.0f}s {(requests - last) / every:9.1f} req/s"
+              f"  choped {choped:6d}  seated {sum(table.present for table in tables):6d}  failures {failures}",
+              file=sys.stderr)
+        last = requests
+
+
+async def simulate(args):
+    sim = Simulation(args)
+    if args.timer_duration:
+        control = Connection(None)
+        status, _, _ = await sim.client.request(control, "POST", "/update_timer_duration", {"duration": args.timer_duration})
+        control.close()
+        if status != 200:
+            raise SystemExit(f"Setting the timer duration failed with {status}")
+    tokens = DeviceTokens(args.token_secret) if args.token_secret else None
+    sources = source_addresses(args.host, args.source_ips)
+    tables = []
+    for i in range(args.tables):
+        table_id = f"{args.table_prefix}{i}"
+        token = tokens.issue(table_id)[0] if tokens else None
+        tables.append(VirtualTable(sim, table_id, token, sources[i % len(sources)], random.Random(args.seed * 100003 + i)))
+
+    sim.started = time.monotonic()
+    tasks = [asyncio.create_task(table.run(sim.started)) for table in tables]
+    tasks.append(asyncio.create_task(report_progress(sim, tables)))
+    await asyncio.sleep(args.seconds)
+    elapsed = time.monotonic() - sim.started
+    for task in tasks:
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if not isinstance(result, asyncio.CancelledError):
+            raise result  # a table task died before the end: a bug here, not a server error
+    summary = sim.stats.summary(elapsed)
+
+    # Leave no simulated chopes running on the server
+    leftover = [table for table in tables if table.state == CHOPED]
+    for table in tables:
+        table.conn.close()
+    await asyncio.gather(*(table.release() for table in leftover))
+    for table in tables:
+        table.conn.close()
+    summary["released_at_end"] = len(leftover)
+    return summary
+
+
+def print_summary(summary):
+    print(f"{summary['requests']} requests in {summary['seconds']:.0f}s, {summary['rps']:.1f} req/s")
+    print(f"{'endpoint':<11}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}  statuses")
+    for endpoint, row in summary["endpoints"].items():
+        latency = "".join(f"{row[key]:>9.1f}" if row[key] is not None else f"{'-':>9}"
+                          for key in ("p50_ms", "p95_ms", "p99_ms"))
+        statuses = " ".join(f"{status}:{n}" for status, n in row["statuses"].items())
+        if row["failures"]:
+            statuses += f" failed:{row['failures']}"
+        print(f"{endpoint:<11}{row['requests']:>9}{row['rps']:>9.1f}{latency}{row['error_rate']:>8.1%}  {statuses}")
+    print(f"chopes {summary['chopes']} ({summary['chopes_failed']} failed): released by diner {summary['released_by_diner']}, on expiry "
+          f"{summary['released_on_expiry']}, after a refused poll {summary['released_on_error']}, still held at the end "
+          f"{summary['released_at_end']}; polls retried without releasing {summary['polls_retried']}; "
+          f"diners who sat without tapping {summary['sat_without_tap']}")
+    for key, label in (("timer_drift_s", "remaining_time - (expires_at - now)"),
+                       ("end_lateness_s", "timer end seen by device - expires_at")):
+        spread = summary[key]
+        if spread is None:
+            print(f"{label}: no samples")
+            continue
+        print(f"{label} ({spread['samples']} samples): min {spread['min']:.3f}s p50 {spread['p50']:.3f}s "
+              f"p95 {spread['p95']:.3f}s p99 {spread['p99']:.3f}s max {spread['max']:.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--tables", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=120)
+    parser.add_argument("--arrivals", choices=("steady", "lunch", "burst"), default="steady")
+    parser.add_argument("--arrival-rate", type=float, default=0.5, help="diners per free table per minute")
+    parser.add_argument("--peak", type=float, default=6, help="lunch rush multiple of --arrival-rate")
+    parser.add_argument("--tap-prob", type=float, default=0.7, help="share of diners who tap a card to chope")
+    parser.add_argument("--stay", type=float, default=240, help="mean seconds a diner stays seated")
+    parser.add_argument("--timer-duration", type=int, help="set the server's chope duration first (seconds)")
+    parser.add_argument("--token-secret", help="DEVICE_TOKEN_SECRET, to mint X-Device-Token for every table")
+    parser.add_argument("--table-prefix", default="SIM")
+    parser.add_argument("--source-ips", type=int, default=1, help="loopback source addresses to spread tables over")
+    parser.add_argument("--keepalive", action="store_true", help="reuse one connection per table")
+    parser.add_argument("--max-connections", type=int, default=512, help="open connections at once")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    summary = asyncio.run(simulate(args))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
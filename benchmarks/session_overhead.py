@@ -0,0 +1,100 @@
+"""Per-request cost of the Flask session on a trivial view, with and without @session_free.
+
+Every request carries a logged-in user's permanent session cookie, so the
+plain route decodes and verifies it and then re-signs and sets it on the
+response (SESSION_REFRESH_EACH_REQUEST). The session-free route matches
+the URL once more instead. "server session" is the same route with
+app.py's SessionStore, where the cookie is a bare id looked up in memory.
+Requests go straight to app.wsgi_app, so the
+numbers are Flask's own overhead, with no server or socket in the way.
+
+    python benchmarks/session_overhead.py [--requests 20000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from cachelib import FileSystemCache
+from flask import Flask, jsonify
+from werkzeug.test import EnvironBuilder
+
+from device_tokens import DeviceTokens
+from session_free import SessionFreeInterface, session_free
+from session_store import ServerSessionInterface, SessionStore
+
+
+def make_app(store=None):
+    app = Flask(__name__)
+    app.secret_key = "benchmark"
+    app.permanent_session_lifetime = timedelta(days=1)
+    inner = app.session_interface if store is None else ServerSessionInterface(store)
+    app.session_interface = SessionFreeInterface(inner)
+
+    @app.route("/with_session/<can_id>")
+    def with_session(can_id):
+        return jsonify({"can_id": can_id, "remaining_time": 42})
+
+    @app.route("/session_free/<can_id>")
+    @session_free
+    def without_session(can_id):
+        return jsonify({"can_id": can_id, "remaining_time": 42})
+
+    return app
+
+
+def run(app, path, headers, requests):
+    environ = EnvironBuilder(path=path, headers=headers).get_environ()
+    statuses = []
+
+    def start_response(status, response_headers, exc_info=None):
+        statuses.append(status)
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        b"".join(app.wsgi_app(dict(environ), start_response))
+    elapsed = time.perf_counter() - started
+    assert all(status.startswith("200") for status in statuses)
+    return elapsed / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    app = make_app()
+    serializer = app.session_interface.inner.get_signing_serializer(app)
+    cookie = serializer.dumps({"_permanent": True, "can_id": "card1", "is_admin": False})
+    session_headers = {"Cookie": f"session={cookie}"}
+    store = SessionStore(FileSystemCache(tempfile.mkdtemp()))
+    store.set("benchmark-sid", {"_permanent": True, "can_id": "card1", "is_admin": False}, time.time() + 86400)
+    server_app = make_app(store)
+    tokens = DeviceTokens(app.secret_key)
+    token, _ = tokens.issue("T1")
+
+    cases = [
+        ("session, no cookie", app, "/with_session/card1", {}),
+        ("session, cookie", app, "/with_session/card1", session_headers),
+        ("session_free, no cookie", app, "/session_free/card1", {}),
+        ("session_free, cookie", app, "/session_free/card1", session_headers),
+        ("server session, cookie", server_app, "/with_session/card1", {"Cookie": "session=benchmark-sid"}),
+    ]
+    run(app, "/with_session/card1", session_headers, 1000)  # warm up
+    print(f"{'case':<24}{'us/request':>12}")
+    for name, case_app, path, headers in cases:
+        print(f"{name:<24}{run(case_app, path, headers, args.requests):>12.1f}")
+
+    for name, check in (("device token, signature", tokens.load), ("device token, cached", tokens.verify)):
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            assert check(token)
+        print(f"{name:<24}{(time.perf_counter() - started) / args.requests * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
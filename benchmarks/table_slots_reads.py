@@ -0,0 +1,70 @@
+"""Cross-process timer status reads: shared-memory table slots vs the SQLite store.
+
+Loads --tables running timers into a fresh SQLite store, publishes them into
+a TableSlots array, then starts 1..--procs reader processes that each call
+get_timer_status on random cards for --seconds. Prints reads/sec per
+process, which is per core while procs <= cores.
+
+    python benchmarks/table_slots_reads.py [--tables 300] [--procs 4] [--seconds 3]
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlite_timers import SqliteTimers
+from table_slots import TableSlots
+
+
+def reader(mode, db_path, slots_name, tables, seconds):
+    slots = TableSlots(name=slots_name) if mode == "slots" else None
+    timers = SqliteTimers(db_path, slots=slots)
+    can_ids = [f"card{i}" for i in range(tables)]
+    reads = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            timers.get_timer_status(random.choice(can_ids))
+        reads += 100
+    print(reads)
+
+
+def main():
+    if sys.argv[1:2] == ["--reader"]:
+        mode, db_path, slots_name, tables, seconds = sys.argv[2:]
+        reader(mode, db_path, slots_name, int(tables), float(seconds))
+        return
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tables", type=int, default=300)
+    parser.add_argument("--procs", type=int, default=os.cpu_count())
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "timers.db")
+    timers = SqliteTimers(db_path)
+    timers.default_duration = 3600
+    for i in range(args.tables):
+        timers.start_timer(f"card{i}", f"T{i}")
+    slots = TableSlots(name=f"wanton_bench_{os.getpid()}")
+    slots.create()
+    slots.load(*timers.dump_tables())
+
+    # Readers are separate interpreters like real workers, not multiprocessing children sharing our resource tracker
+    print(f"{args.tables} tables, {args.seconds}s per run, {os.cpu_count()} cores")
+    for mode in ("sqlite", "slots"):
+        for procs in sorted({1, args.procs}):
+            command = [sys.executable, __file__, "--reader", mode, db_path, slots.name, str(args.tables), str(args.seconds)]
+            slots.heartbeat(time.time())
+            workers = [subprocess.Popen(command, stdout=subprocess.PIPE, text=True) for _ in range(procs)]
+            counts = [int(worker.communicate()[0]) for worker in workers]
+            print(f"{mode:>7} x{procs:<3}: {sum(counts) / args.seconds:10.0f} reads/s total"
+                  f"  {sum(counts) / args.seconds / procs:10.0f} reads/s per process")
+
+
+if __name__ == "__main__":
+    main()
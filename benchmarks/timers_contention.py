@@ -0,0 +1,120 @@
+"""Timers latency under contention: locked reads vs snapshot reads vs shards.
+
+200 reader threads call get_timer_status in a loop while the tick thread
+runs and writers keep choping and releasing tables. "locked" reproduces
+the old behaviour: one lock, reads take it and saves run under it.
+"snapshot" is one shard with lock-free reads; "sharded" adds TIMER_SHARDS.
+
+Each reader pauses --think-ms between reads like a polling client would;
+with no pause, 200 spinning threads starve the tick and writer of the GIL.
+
+    python benchmarks/timers_contention.py [--readers 200] [--seconds 5]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timers import TIMER_SHARDS, Timers, timer_status
+
+
+class LockedTimers(Timers):
+    """Pre-snapshot behaviour: reads take the lock and saves happen while holding it."""
+
+    def __init__(self, filepath):
+        super().__init__(filepath, shards=1)
+        self.lock = self.shards[0].lock
+
+    def get_timer_status(self, can_id):
+        with self.lock:
+            timer_data = self.shards[0].timers.get(can_id)
+            if timer_data is None:
+                return None
+            return timer_status(timer_data, time.time(), self.active_timers())
+
+    def save_timers(self):
+        with self.lock:
+            super().save_timers()
+
+
+class SingleShardTimers(Timers):
+    def __init__(self, filepath):
+        super().__init__(filepath, shards=1)
+
+
+def percentile(samples, pct):
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def run(timers_class, tables, readers, writers, seconds, think):
+    workdir = tempfile.mkdtemp()
+    timers = timers_class(filepath=os.path.join(workdir, "timers.json"))
+    can_ids = [f"card{i}" for i in range(tables)]
+    for i, can_id in enumerate(can_ids):
+        timers.start_timer(can_id, f"T{i}")
+
+    samples = [[] for _ in range(readers)]
+    write_samples = [[] for _ in range(writers)]
+    deadline = time.perf_counter() + seconds
+
+    def tick():
+        while time.perf_counter() < deadline:
+            timers.decrement_timers()
+            timers.sweep_stale(time.time())
+            time.sleep(1)
+
+    def writer(out):
+        while time.perf_counter() < deadline:
+            i = random.randrange(tables)
+            started = time.perf_counter()
+            timers.release_table(f"T{i}")
+            timers.chope_table(f"T{i}", can_ids[i])
+            out.append(time.perf_counter() - started)
+            time.sleep(0.005)
+
+    def reader(out):
+        while time.perf_counter() < deadline:
+            can_id = random.choice(can_ids)
+            started = time.perf_counter()
+            timers.get_timer_status(can_id)
+            out.append(time.perf_counter() - started)
+            time.sleep(think)
+
+    threads = [threading.Thread(target=tick)]
+    threads += [threading.Thread(target=writer, args=(out,)) for out in write_samples]
+    threads += [threading.Thread(target=reader, args=(out,)) for out in samples]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reads = sorted(sample for out in samples for sample in out)
+    writes = sorted(sample for out in write_samples for sample in out)
+    return reads, writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tables", type=int, default=300)
+    parser.add_argument("--readers", type=int, default=200)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--think-ms", type=float, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.readers} readers, {args.writers} writers, {args.tables} tables, {args.seconds}s per mode")
+    modes = (("locked", LockedTimers), ("snapshot", SingleShardTimers), (f"sharded/{TIMER_SHARDS}", Timers))
+    for name, timers_class in modes:
+        reads, writes = run(timers_class, args.tables, args.readers, args.writers, args.seconds, args.think_ms / 1000)
+        for kind, samples in (("reads", reads), ("writes", writes)):
+            print(f"{name:>10} {kind:>6}: {len(samples) / args.seconds:9.0f}/s"
+                  f"  p50 {percentile(samples, 50) * 1e6:9.1f}us  p99 {percentile(samples, 99) * 1e6:9.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import json
+import os
+import queue
+import socket
+import threading
+import time
+
+BUS_POLL_INTERVAL = 0.1  # the hub re-reads the outbox at least this often even without a wake-up
+BUS_MAX_PENDING = 64  # frames queued for one worker before it is cut off and made to replay
+BUS_RECONNECT_INTERVAL = 1  # seconds
+
+
+def encode(rows):
+    return (json.dumps({"batches": rows}) + "\n").encode()
+
+
+class Subscriber:
+    __slots__ = ("sock", "pending", "closed")
+
+    def __init__(self, sock, max_pending):
+        self.sock = sock
+        self.pending = queue.Queue(max_pending)
+        self.closed = False
+
+
+class BusHub:
+    """Leader side of the cross-worker bus: pushes outbox batches to every worker over a Unix socket.
+
+    Each read of the outbox goes out as one frame, so the alerts from a tick
+    travel together. Workers wake the hub after they commit, and it also
+    rereads every poll_interval. Every worker has a bounded send queue; one
+    that falls max_pending frames behind is disconnected and replays from
+    the outbox when it reconnects, so a slow worker never holds up the rest.
+    """
+
+    def __init__(self, path, timers, on_batch=None, max_pending=BUS_MAX_PENDING, poll_interval=BUS_POLL_INTERVAL):
+        self.path = path
+        self.timers = timers
+        self.on_batch = on_batch  # on_batch(events, outbox_id), run in outbox order on the hub thread
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self.subscribers = set()
+        self.cursor = 0  # outbox id of the newest batch pushed
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.overflows = 0
+        self.replayed = 0
+        self.gaps = 0
+
+    def start(self, cursor):
+        """Serve from outbox id cursor onwards."""
+        self.cursor = cursor
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left by a previous leader
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(64)
+        threading.Thread(target=self._accept, daemon=True).start()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def wake(self):
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            try:
+                self.pump()
+            except Exception as e:
+                print("Bus pump failed:", e)
+
+    def pump(self):
+        with self.lock:
+            rows = self.timers.read_outbox(self.cursor)
+            if not rows:
+                return
+            self.cursor = rows[-1][0]
+            if self.on_batch is not None:
+                for row_id, events in rows:
+                    self.on_batch(events, row_id)
+            frame = encode(rows)
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.pending.put_nowait(frame)
+                except queue.Full:
+                    self.overflows += 1
+                    self._drop(subscriber)
+            self.frames += 1
+
+    def _drop(self, subscriber):
+        # Caller holds self.lock
+        if subscriber.closed:
+            return
+        subscriber.closed = True
+        self.subscribers.discard(subscriber)
+        try:
+            subscriber.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        while True:  # make room for the sentinel so the sender thread exits
+            try:
+                subscriber.pending.put_nowait(None)
+                return
+            except queue.Full:
+                try:
+                    subscriber.pending.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _accept(self):
+        while True:
+            sock, _ = self.server.accept()
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock):
+        reader = sock.makefile("rb")
+        try:
+            after = json.loads(reader.readline()).get("subscribe")
+        except (OSError, ValueError, AttributeError):
+            sock.close()
+            return
+        subscriber = Subscriber(sock, self.max_pending)
+        with self.lock:
+            # A reconnecting worker first gets whatever it missed, still in outbox order
+            if after is not None and after < self.cursor:
+                rows = self.timers.read_outbox(after, until=self.cursor)
+                if not rows or rows[0][0] > after + 1:
+                    self.gaps += 1  # some of it was already pruned
+                if rows:
+                    subscriber.pending.put_nowait(encode(rows))
+                    self.replayed += len(rows)
+            self.subscribers.add(subscriber)
+        threading.Thread(target=self._send, args=(subscriber,), daemon=True).start()
+        try:
+            for _ in reader:  # every later line is a wake-up
+                self.wakeup.set()
+        except OSError:
+            pass
+        with self.lock:
+            self._drop(subscriber)
+
+    def _send(self, subscriber):
+        while True:
+            frame = subscriber.pending.get()
+            if frame is None:
+                break
+            try:
+                subscriber.sock.sendall(frame)
+            except OSError:
+                break
+        with self.lock:
+            self._drop(subscriber)
+        subscriber.sock.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "subscribers": len(self.subscribers),
+                "cursor": self.cursor,
+                "frames": self.frames,
+                "overflows": self.overflows,
+                "replayed": self.replayed,
+                "gaps": self.gaps,
+                "max_pending": max((s.pending.qsize() for s in self.subscribers), default=0)
+            }
+
+
+class BusClient:
+    """Worker side of the bus: hands each batch from the leader's hub to handler(events).
+
+    Reconnects (to whichever process is leader by then) and asks for
+    everything after the last batch it handled.
+    """
+
+    def __init__(self, path, handler, reconnect_interval=BUS_RECONNECT_INTERVAL):
+        self.path = path
+        self.handler = handler
+        self.reconnect_interval = reconnect_interval
+        self.cursor = None  # outbox id of the last batch handled
+        self.sock = None
+        self.batches = 0
+        self.reconnects = 0
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                sock.sendall((json.dumps({"subscribe": self.cursor}) + "\n").encode())
+                self.sock = sock
+                for line in sock.makefile("rb"):
+                    self._receive(json.loads(line)["batches"])
+            except (OSError, ValueError):
+                pass
+            finally:
+                if self.sock is not None:
+                    self.reconnects += 1
+                self.sock = None
+                sock.close()
+            time.sleep(self.reconnect_interval)
+
+    def _receive(self, rows):
+        for row_id, events in rows:
+            if self.cursor is not None and row_id <= self.cursor:
+                continue  # already handled before a reconnect
+            self.cursor = row_id
+            self.batches += 1
+            try:
+                self.handler([tuple(event) for event in events])
+            except Exception as e:
+                print("Bus handler failed:", e)
+
+    def wake(self):
+        """Tell the hub there is something new in the outbox; never blocks."""
+        sock = self.sock
+        if sock is None:
+            return  # the hub polls anyway
+        try:
+            sock.send(b"{}\n", socket.MSG_DONTWAIT)
+        except OSError:
+            pass
+
+    def stats(self):
+        return {"connected": self.sock is not None, "cursor": self.cursor, "batches": self.batches,
+                "reconnects": self.reconnects}
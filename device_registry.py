@@ -0,0 +1,158 @@
+import heapq
+import threading
+
+
+class DeviceHealth:
+    __slots__ = ("last_seen", "online", "scheduled")
+
+    def __init__(self, last_seen):
+        self.last_seen = last_seen
+        self.online = True
+        self.scheduled = False  # has an entry in the deadline heap
+
+
+class DeviceRegistry:
+    """Last-seen time of every table device, with offline detection.
+
+    seen() only updates memory; nothing is written to disk. Each online
+    device has at most one entry in a deadline heap, for the moment it
+    would go offline if it stayed silent. expire() pops the due entries and
+    either pushes a device's entry back (it was seen since) or marks it
+    offline, so a check costs O(log n) per due device, not a scan. Offline
+    devices are kept in their own dict, so listing them is O(k). At most
+    max_devices are tracked, and a device offline for forget_after seconds
+    is dropped, so the registry cannot grow without bound.
+
+    on_change(event, payload) gets "device_offline" and "device_online".
+    With several workers, each shares what it saw via take_unseen()/merge()
+    and only one of them (the leader) should call expire().
+    """
+
+    def __init__(self, offline_after, on_change=None, max_devices=8192, forget_after=7 * 24 * 3600):
+        self.offline_after = offline_after
+        self.on_change = on_change
+        self.max_devices = max_devices
+        self.forget_after = forget_after
+        self.devices = {}  # table_id -> DeviceHealth
+        self.offline = {}  # table_id -> DeviceHealth, in the order they went offline
+        self.deadlines = []  # heap of (deadline, table_id)
+        self.unshared = {}  # table_id -> last_seen not yet handed to take_unseen()
+        self.went_offline = 0
+        self.came_back = 0
+        self.dropped = 0  # sightings of new devices turned away because the registry was full
+        self.forgotten = 0
+        self.lock = threading.Lock()
+
+    def seen(self, table_id, now):
+        self._seen({table_id: now}, share=True)
+
+    def merge(self, seen):
+        """Apply another worker's take_unseen()."""
+        self._seen(seen, share=False)
+
+    def _seen(self, seen, share):
+        changes = []
+        with self.lock:
+            for table_id, now in seen.items():
+                device = self.devices.get(table_id)
+                if device is None:
+                    if len(self.devices) >= self.max_devices:
+                        self.dropped += 1
+                        continue
+                    device = self.devices[table_id] = DeviceHealth(now)
+                elif now > device.last_seen:
+                    device.last_seen = now
+                if share:
+                    self.unshared[table_id] = device.last_seen
+                if not device.online:
+                    device.online = True
+                    del self.offline[table_id]
+                    self.came_back += 1
+                    changes.append(("device_online", {"table_id": table_id, "last_seen": device.last_seen}))
+                if not device.scheduled:
+                    self._schedule(table_id, device)
+        self._notify(changes)
+
+    def take_unseen(self):
+        """Last-seen times recorded here since the previous call, for other workers to merge()."""
+        with self.lock:
+            unshared, self.unshared = self.unshared, {}
+        return unshared
+
+    def _schedule(self, table_id, device):
+        device.scheduled = True
+        heapq.heappush(self.deadlines, (device.last_seen + self.offline_after, table_id))
+
+    def expire(self, now):
+        """Mark every device silent for offline_after seconds as offline; returns how many.
+
+        Also forgets devices that have been offline for forget_after seconds.
+        """
+        changes = []
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                _, table_id = heapq.heappop(self.deadlines)
+                device = self.devices[table_id]
+                device.scheduled = False
+                if device.last_seen + self.offline_after > now:
+                    self._schedule(table_id, device)  # seen since this entry was pushed
+                    continue
+                self._offline(table_id, device)
+                changes.append(("device_offline", {"table_id": table_id, "last_seen": device.last_seen}))
+            # offline is in the order devices went quiet, so the ones to forget are at the front
+            while self.offline:
+                table_id, device = next(iter(self.offline.items()))
+                if device.last_seen + self.forget_after > now:
+                    break
+                del self.offline[table_id]
+                del self.devices[table_id]
+                self.forgotten += 1
+        self._notify(changes)
+        return len(changes)
+
+    def _offline(self, table_id, device):
+        # Caller holds self.lock
+        device.online = False
+        self.offline[table_id] = device
+        self.went_offline += 1
+
+    def apply(self, event, payload):
+        """Follow a device_offline / device_online decided by another worker."""
+        with self.lock:
+            device = self.devices.get(payload["table_id"])
+            if device is None:
+                if len(self.devices) >= self.max_devices:
+                    return
+                device = self.devices[payload["table_id"]] = DeviceHealth(payload["last_seen"])
+            if event == "device_offline" and device.online and device.last_seen <= payload["last_seen"]:
+                self._offline(payload["table_id"], device)
+            elif event == "device_online" and not device.online:
+                device.online = True
+                del self.offline[payload["table_id"]]
+                self.came_back += 1
+
+    def _notify(self, changes):
+        if self.on_change is not None:
+            for event, payload in changes:
+                self.on_change(event, payload)
+
+    def unhealthy(self, now):
+        """Offline devices, longest silent first."""
+        with self.lock:
+            return [{"table_id": table_id, "last_seen": device.last_seen, "silent_for": now - device.last_seen}
+                    for table_id, device in self.offline.items()]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "devices": len(self.devices),
+                "online": len(self.devices) - len(self.offline),
+                "offline": len(self.offline),
+                "offline_after": self.offline_after,
+                "pending_deadlines": len(self.deadlines),
+                "went_offline": self.went_offline,
+                "came_back": self.came_back,
+                "max_devices": self.max_devices,
+                "dropped": self.dropped,
+                "forgotten": self.forgotten
+            }
@@ -0,0 +1,98 @@
+import json
+import os
+import secrets
+import sys
+import threading
+from collections import OrderedDict
+
+from itsdangerous import BadSignature, URLSafeSerializer
+
+GATEWAY_TABLE = "*"  # table id of gateway tokens, which may send events on behalf of any table
+
+
+class DeviceTokens:
+    """Signed per-table device tokens, each with its own id so it can be revoked on its own.
+
+    A token is itsdangerous-signed {"t": table_id, "i": token_id}; the
+    server keeps no record of issued tokens. Devices present the same
+    token every poll, so verified tokens sit in a small LRU and a repeat
+    costs one dict lookup plus a check of the revoked-id set instead of
+    an HMAC and a JSON decode. Revoked ids are kept in revoked_path.
+    Tokens issued for GATEWAY_TABLE belong to a gateway, not a table.
+    """
+
+    def __init__(self, secret, revoked_path=None, cache_size=4096):
+        self.serializer = URLSafeSerializer(secret, salt="device-token")
+        self.revoked_path = revoked_path
+        self.cache_size = cache_size
+        self.verified = OrderedDict()  # token -> (table_id, token_id), least recently used first
+        self.revoked = set()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        if revoked_path and os.path.exists(revoked_path):
+            with open(revoked_path) as f:
+                self.revoked.update(json.load(f))
+
+    def issue(self, table_id):
+        """Return (token, token_id) for a new token for table_id."""
+        token_id = secrets.token_hex(8)
+        return self.serializer.dumps({"t": table_id, "i": token_id}), token_id
+
+    def load(self, token):
+        """Check the signature; returns (table_id, token_id) or None. Does not consult the cache or revocations."""
+        try:
+            claims = self.serializer.loads(token)
+        except BadSignature:
+            return None
+        if not isinstance(claims, dict) or not isinstance(claims.get("t"), str) or not claims.get("i"):
+            return None
+        return claims["t"], claims["i"]
+
+    def verify(self, token):
+        """Return the table id the token was issued for, or None if it is forged or revoked."""
+        with self.lock:
+            claims = self.verified.get(token)
+            if claims is not None:
+                self.verified.move_to_end(token)
+                self.hits += 1
+        if claims is None:
+            claims = self.load(token)
+            with self.lock:
+                self.misses += 1
+                if claims is not None:
+                    self.verified[token] = claims
+                    if len(self.verified) > self.cache_size:
+                        self.verified.popitem(last=False)
+        if claims is None or claims[1] in self.revoked:
+            with self.lock:
+                self.rejected += 1
+            return None
+        return claims[0]
+
+    def revoke(self, token_id, persist=True):
+        """Revoke a token by id; persist=False only updates this process (e.g. told by another worker)."""
+        with self.lock:
+            self.revoked.add(token_id)
+            revoked = sorted(self.revoked)
+        if persist and self.revoked_path:
+            tmp = f"{self.revoked_path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(revoked, f)
+            os.replace(tmp, self.revoked_path)
+
+    def stats(self):
+        with self.lock:
+            return {"cached": len(self.verified), "cache_size": self.cache_size, "revoked": len(self.revoked),
+                    "hits": self.hits, "misses": self.misses, "rejected": self.rejected}
+
+
+if __name__ == "__main__":
+    # python device_tokens.py K9  -> the X-Device-Token to flash onto table K9 (or POST /admin/device_tokens)
+    # python device_tokens.py '*' -> a gateway token
+    import app as backend
+
+    for table_id in sys.argv[1:]:
+        token, token_id = backend.device_tokens.issue(table_id)
+        print(table_id, token_id, token)
@@ -0,0 +1,80 @@
+import json
+import threading
+
+from flask import Response
+from simple_websocket import ConnectionClosed, Server
+
+DEVICE_PING_INTERVAL = 25  # seconds; keeps NAT/Wi-Fi idle timeouts from dropping the socket
+
+
+class DeviceConnection:
+    """A table device's WebSocket, safe to send on from any thread."""
+
+    def __init__(self, table_id, ws):
+        self.table_id = table_id
+        self.ws = ws
+        self.send_lock = threading.Lock()
+
+    def send(self, event, payload):
+        frame = json.dumps({"event": event, **payload})
+        with self.send_lock:
+            self.ws.send(frame)
+
+    def receive(self):
+        return self.ws.receive()
+
+
+class DeviceHub:
+    """Tracks device WebSockets by table_id and pushes timer engine frames to them."""
+
+    def __init__(self):
+        self.connections = {}  # table_id -> set of DeviceConnection
+        self.lock = threading.Lock()
+
+    def accept(self, environ, table_id):
+        """Upgrade the request to a WebSocket and register it for table_id."""
+        conn = DeviceConnection(table_id, Server.accept(environ, ping_interval=DEVICE_PING_INTERVAL))
+        with self.lock:
+            self.connections.setdefault(table_id, set()).add(conn)
+        return conn
+
+    def remove(self, conn):
+        with self.lock:
+            table_conns = self.connections.get(conn.table_id)
+            if table_conns is not None:
+                table_conns.discard(conn)
+                if not table_conns:
+                    del self.connections[conn.table_id]
+
+    def push(self, table_id, event, payload):
+        """Send a frame to every device subscribed to table_id."""
+        with self.lock:
+            table_conns = list(self.connections.get(table_id, ()))
+        for conn in table_conns:
+            try:
+                conn.send(event, payload)
+            except (ConnectionClosed, ConnectionError, OSError):
+                self.remove(conn)
+
+    def count(self):
+        with self.lock:
+            return sum(len(table_conns) for table_conns in self.connections.values())
+
+
+def closed_response(conn):
+    """Response for a WebSocket view to return once its socket has closed.
+
+    The server already gave up the connection, so this tells it not to write
+    an HTTP response of its own.
+    """
+    mode = conn.ws.mode
+
+    class WebSocketResponse(Response):
+        def __call__(self, *args, **kwargs):
+            if mode == 'gunicorn':
+                raise StopIteration()
+            if mode == 'werkzeug':
+                raise ConnectionError()
+            return []
+
+    return WebSocketResponse()
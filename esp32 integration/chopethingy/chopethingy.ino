@@ -67,11 +67,15 @@ String serverURL          = "http://172.20.10.11:5000";
 // Table ID
 String tableID           = "K9";  // Must match what your server expects
 
+// From POST /admin/device_tokens {"table_id": "K9"}; leave empty if tokens are not required
+String deviceToken       = "";
+
 // Flask endpoints
-String startTimerURL     = serverURL + "/start_timer";
-String endTimerURL       = serverURL + "/end_timer/";    
-String setTableVacantURL = serverURL + "/set_table_vacant";
+String chopeTableURL     = serverURL + "/device/" + tableID + "/chope";
+String releaseTableURL   = serverURL + "/device/" + tableID + "/release";
 String getTimerStatusBaseURL = serverURL + "/get_timer_status/";
+String ingestEventsURL   = serverURL + "/ingest/events";
+String heartbeatURL      = serverURL + "/device/" + tableID + "/heartbeat";
 
 // Forward declarations
 int  detectCard();
@@ -80,9 +84,15 @@ void changeState(int new_state);
 int  getTimerStatusFromServer(const String &canID);
 void updateTimerLCD(int remaining);
 
-bool startTimerOnServer(String canID, String tableID);
-bool endTimerOnServer(String canID);
-bool setTableVacantOnServer(String tableID);
+String newRequestKey();
+unsigned long retryAfterMs(HTTPClient &http);
+int  postDeviceWrite(const char *label, const String &url, const String &payload, const String &requestKey);
+void addDeviceToken(HTTPClient &http);
+void recordEvent(const char *type);
+void flushEvents();
+void sendHeartbeat();
+bool chopeTableOnServer(String canID);
+bool releaseTableOnServer();
 
 String card_data         = "";
 int    prgm_state        = AVAILABLE;
@@ -92,7 +102,32 @@ String choping_card           = "";
 
 // For polling the server status
 unsigned long lastStatusPoll  = 0;       // track when we last polled
-unsigned long pollInterval    = 1000;    // poll every 1 second
+unsigned long pollInterval    = 1000;    // server tells us via poll_after
+#define STATUS_RETRY -2                  // getTimerStatusFromServer: no answer, keep the chope
+unsigned long STATUS_RETRY_DELAY = 2000; // ms before re-polling when the server sent no Retry-After
+
+// Sensor events, sent to the server in batches
+#define EVENT_BUFFER_SIZE 16
+unsigned long EVENT_FLUSH_INTERVAL = 10000;  // ms
+const char   *eventTypes[EVENT_BUFFER_SIZE];
+unsigned long eventTimes[EVENT_BUFFER_SIZE];
+int           eventCount     = 0;
+unsigned long lastEventFlush = 0;
+
+// Lets the server tell a quiet table from a dead one (it marks devices offline after 90s)
+unsigned long HEARTBEAT_INTERVAL = 30000;  // ms
+
+// Chope and release are retried with the same Idempotency-Key on transient failures
+#define WRITE_ATTEMPTS 3
+unsigned long WRITE_RETRY_DELAY     = 500;   // ms before the 2nd attempt, doubled after that
+unsigned long WRITE_RETRY_MAX_DELAY = 5000;  // ms; cap on a server's Retry-After
+unsigned long lastHeartbeat      = 0;
+bool          pirWasHigh     = false;
+
+// Local countdown between polls, anchored to the last server sync
+int           syncedRemaining = 0;
+unsigned long syncedAt        = 0;
+unsigned long lastLcdUpdate   = 0;
 
 // ----------------------------------------------------
 //  Sanitize for JSON: remove/escape control chars
@@ -115,13 +150,13 @@ String sanitizeForJson(const String &input) {
 }
 
 // ----------------------------------------------------
-// Basic JSON parse for remaining_time
+// Basic JSON parse for an integer field
 // If parsing fails, returns -1
 // ----------------------------------------------------
-int parseRemainingTime(const String &jsonResponse) {
-  // Example: {"table_id": "K9", "remaining_time": 891, "alerts_sent": []}
-  // We'll do a naive search for "remaining_time"
-  int idx = jsonResponse.indexOf("\"remaining_time\"");
+int parseJsonInt(const String &jsonResponse, const String &key) {
+  // Example: {"table_id": "K9", "remaining_time": 891, "poll_after": 30}
+  // We'll do a naive search for "<key>"
+  int idx = jsonResponse.indexOf("\"" + key + "\"");
   if (idx == -1) return -1;
   
   // skip ahead to the colon
@@ -141,6 +176,10 @@ int parseRemainingTime(const String &jsonResponse) {
   return val.toInt();  // if invalid, toInt() returns 0
 }
 
+int parseRemainingTime(const String &jsonResponse) {
+  return parseJsonInt(jsonResponse, "remaining_time");
+}
+
 // ----------------------------------------------------
 void setup() {
   Serial.begin(9600);
@@ -180,6 +219,7 @@ void loop() {
   if (card_result == CARD_DETECTED) {
     Serial.print("Card detected: ");
     Serial.println(card_data);
+    recordEvent("card_tap");
 
     // If table is free (AVAILABLE) or physically occupied (OCCUPIED),
     // scanning card means user wants to CHOPE
@@ -192,6 +232,7 @@ void loop() {
         changeState(AVAILABLE);
       } else {
         Serial.println("NOT SAME USER - Clash!");
+        recordEvent("clash");
         printLCD(USER_CLASH);
         user_clash_trig = millis();
       }
@@ -200,6 +241,10 @@ void loop() {
 
   // PIR detection
   int pir_result = digitalRead(pir_pin);
+  if ((pir_result == HIGH) != pirWasHigh) {
+    pirWasHigh = (pir_result == HIGH);
+    recordEvent(pirWasHigh ? "pir_high" : "pir_low");
+  }
   if ((prgm_state == AVAILABLE || prgm_state == OCCUPIED) && pir_result == HIGH) {
     changeState(OCCUPIED);
     last_pir_trig = millis();
@@ -211,19 +256,38 @@ void loop() {
   // If CHOPED: poll the server to see how much time is left
   if (prgm_state == CHOPED) {
     unsigned long now = millis();
-    // Poll once every 1 second
+    // Poll only as often as the server asked us to
     if (now - lastStatusPoll >= pollInterval) {
       lastStatusPoll = now;
       int remaining = getTimerStatusFromServer(choping_card);
       if (remaining > 0) {
-        // Display the real time left from the server
-        updateTimerLCD(remaining);
+        // Re-anchor the local countdown to the server's time left
+        syncedRemaining = remaining;
+        syncedAt = now;
+        lastLcdUpdate = 0;
+      } else if (remaining == STATUS_RETRY) {
+        // Server busy or unreachable: keep the chope and the local countdown, ask again later
       } else {
         // Means server says "Timer not found or ended"
         // so let's revert to AVAILABLE
         changeState(AVAILABLE);
       }
     }
+
+    // Between polls, count down locally once a second
+    if (prgm_state == CHOPED && syncedAt != 0 && now - lastLcdUpdate >= 1000) {
+      lastLcdUpdate = now;
+      long left = syncedRemaining - (long)((now - syncedAt) / 1000);
+      updateTimerLCD(left > 0 ? left : 0);
+    }
+  }
+
+  if (eventCount > 0 && millis() - lastEventFlush >= EVENT_FLUSH_INTERVAL) {
+    flushEvents();
+  }
+
+  if (millis() - lastHeartbeat >= HEARTBEAT_INTERVAL) {
+    sendHeartbeat();
   }
 
   // If table is CHOPED but a different user tapped,
@@ -293,8 +357,13 @@ void changeState(int new_state) {
     prgm_state   = CHOPED;
     choping_card = card_data;
 
+    // Check in with the server right away for the new deadline
+    pollInterval   = 1000;
+    lastStatusPoll = millis();
+    syncedAt       = 0;
+
     // Start timer on server
-    startTimerOnServer(choping_card, tableID);
+    chopeTableOnServer(choping_card);
     return;
   }
 
@@ -308,8 +377,7 @@ void changeState(int new_state) {
 
     // If returning from CHOPED, user ended reservation
     if (prgm_state == CHOPED) {
-      endTimerOnServer(choping_card);
-      setTableVacantOnServer(tableID);
+      releaseTableOnServer();
       choping_card = "";
     }
     prgm_state = AVAILABLE;
@@ -379,12 +447,13 @@ void updateTimerLCD(int remaining) {
 
 // ----------------------------------------------------
 // Polls the Flask server for the current timer status
-// returns the remaining_time if found, else -1
+// returns the remaining_time if found, -1 if the server has no such timer,
+// or STATUS_RETRY if it could not answer (throttled, busy, down, Wi-Fi lost)
 // ----------------------------------------------------
 int getTimerStatusFromServer(const String &canID) {
   if (WiFi.status() != WL_CONNECTED) {
     Serial.println("Wi-Fi not connected for getTimerStatus");
-    return -1;
+    return STATUS_RETRY;
   }
 
   // Build the URL for GET /get_timer_status/<can_id>
@@ -393,6 +462,9 @@ int getTimerStatusFromServer(const String &canID) {
 
   HTTPClient http;
   http.begin(url);
+  const char *collect[] = {"Retry-After"};
+  http.collectHeaders(collect, 1);
+  addDeviceToken(http);
   int httpResponseCode = http.GET();
 
   if (httpResponseCode == 200) {
@@ -401,10 +473,23 @@ int getTimerStatusFromServer(const String &canID) {
     Serial.println(response);
 
     int remaining = parseRemainingTime(response);
+
+    // Server picks when we should check back (also sent as X-Poll-After)
+    int pollAfter = parseJsonInt(response, "poll_after");
+    if (pollAfter > 0) {
+      pollInterval = (unsigned long)pollAfter * 1000;
+    }
+    http.end();
     return remaining;
-  } else {
-    Serial.print("getTimerStatus error code: ");
-    Serial.println(httpResponseCode);
+  }
+  Serial.print("getTimerStatus error code: ");
+  Serial.println(httpResponseCode);
+  if (httpResponseCode <= 0 || httpResponseCode == 429 || httpResponseCode >= 500) {
+    // Throttled (429), shed (503) or failed: not an answer about the timer, so retry when the server says
+    unsigned long wait = retryAfterMs(http);
+    pollInterval = wait > 0 ? wait : STATUS_RETRY_DELAY;
+    http.end();
+    return STATUS_RETRY;
   }
   http.end();
   return -1;
@@ -413,78 +498,140 @@ int getTimerStatusFromServer(const String &canID) {
 // ----------------------------------------------------
 //  Basic server calls
 // ----------------------------------------------------
-bool startTimerOnServer(String canID, String tableID) {
-  if (WiFi.status() == WL_CONNECTED) {
-    HTTPClient http;
-    http.begin(startTimerURL); 
-    http.addHeader("Content-Type", "application/json");
+// Authenticates this table without a session cookie
+void addDeviceToken(HTTPClient &http) {
+  if (deviceToken.length() > 0) {
+    http.addHeader("X-Device-Token", deviceToken);
+  }
+}
 
-    String safeCanID    = sanitizeForJson(canID);
-    String safeTableID  = sanitizeForJson(tableID);
-    String jsonPayload = "{\"can_id\":\"" + safeCanID +
-                         "\", \"table_id\":\"" + safeTableID + "\"}";
+// Unique per logical write (one chope, one release); every retry of it sends the same key,
+// so the server replays its first answer instead of applying the write twice
+String newRequestKey() {
+  return tableID + "-" + String((uint32_t)esp_random(), HEX);
+}
 
-    int httpResponseCode = http.POST(jsonPayload);
-    if (httpResponseCode > 0) {
-      String response = http.getString();
-      Serial.print("startTimer response: ");
-      Serial.println(response);
-    } else {
-      Serial.print("startTimer error code: ");
-      Serial.println(httpResponseCode);
-    }
-    http.end();
-    return (httpResponseCode == 200);
-  }
-  Serial.println("Wi-Fi not connected for startTimerOnServer");
-  return false;
+// Milliseconds the server asked us to wait (Retry-After, whole seconds), or 0
+unsigned long retryAfterMs(HTTPClient &http) {
+  String retryAfter = http.header("Retry-After");
+  if (retryAfter.length() == 0) return 0;
+  unsigned long wait = (unsigned long)retryAfter.toInt() * 1000;
+  return wait < WRITE_RETRY_MAX_DELAY ? wait : WRITE_RETRY_MAX_DELAY;
 }
 
-bool endTimerOnServer(String canID) {
-  if (WiFi.status() == WL_CONNECTED) {
+// POSTs a device write, retrying transient failures (no connection, 5xx, 429, or 409 while the
+// first attempt with this key is still running) with the same Idempotency-Key
+int postDeviceWrite(const char *label, const String &url, const String &payload, const String &requestKey) {
+  const char *collect[] = {"Retry-After"};
+  unsigned long delayMs = WRITE_RETRY_DELAY;
+  int httpResponseCode = -1;
+  for (int attempt = 1; attempt <= WRITE_ATTEMPTS; attempt++) {
+    if (WiFi.status() != WL_CONNECTED) {
+      Serial.print("Wi-Fi not connected for ");
+      Serial.println(label);
+      return -1;
+    }
     HTTPClient http;
-    String safeCanID = sanitizeForJson(canID);
-    String url = endTimerURL + safeCanID;
     http.begin(url);
+    http.collectHeaders(collect, 1);
     http.addHeader("Content-Type", "application/json");
+    http.addHeader("Idempotency-Key", requestKey);
+    addDeviceToken(http);
 
-    int httpResponseCode = http.POST("{}");  // empty JSON
+    httpResponseCode = http.POST(payload);
     if (httpResponseCode > 0) {
       String response = http.getString();
-      Serial.print("endTimer response: ");
+      Serial.print(label);
+      Serial.print(" response: ");
       Serial.println(response);
     } else {
-      Serial.print("endTimer error code: ");
+      Serial.print(label);
+      Serial.print(" error code: ");
       Serial.println(httpResponseCode);
     }
+    bool transient = httpResponseCode <= 0 || httpResponseCode >= 500 ||
+                     httpResponseCode == 429 || httpResponseCode == 409;
+    unsigned long wait = httpResponseCode > 0 ? retryAfterMs(http) : 0;
     http.end();
-    return (httpResponseCode == 200);
+    // 409 from the chope itself means another card holds the table; only retry the idempotency 409
+    if (!transient || attempt == WRITE_ATTEMPTS ||
+        (httpResponseCode == 409 && wait == 0)) {
+      return httpResponseCode;
+    }
+    delay(wait > 0 ? wait : delayMs);
+    delayMs *= 2;
   }
-  Serial.println("Wi-Fi not connected for endTimerOnServer");
-  return false;
+  return httpResponseCode;
 }
 
-bool setTableVacantOnServer(String tableID) {
-  if (WiFi.status() == WL_CONNECTED) {
-    HTTPClient http;
-    http.begin(setTableVacantURL);
-    http.addHeader("Content-Type", "application/json");
+bool chopeTableOnServer(String canID) {
+  String safeCanID   = sanitizeForJson(canID);
+  String jsonPayload = "{\"can_id\":\"" + safeCanID + "\"}";
+  return postDeviceWrite("chopeTable", chopeTableURL, jsonPayload, newRequestKey()) == 200;
+}
 
-    String safeTableID = sanitizeForJson(tableID);
-    String jsonPayload = "{\"table_id\":\"" + safeTableID + "\"}";
+// Ends the timer and vacates the table in one request
+bool releaseTableOnServer() {
+  return postDeviceWrite("releaseTable", releaseTableURL, "{}", newRequestKey()) == 200;
+}
 
-    int httpResponseCode = http.POST(jsonPayload);
-    if (httpResponseCode > 0) {
-      String response = http.getString();
-      Serial.print("setTableVacant response: ");
-      Serial.println(response);
-    } else {
-      Serial.print("setTableVacant error code: ");
-      Serial.println(httpResponseCode);
-    }
-    http.end();
-    return (httpResponseCode == 200);
+// ----------------------------------------------------
+//  Sensor event batching for POST /ingest/events
+// ----------------------------------------------------
+void recordEvent(const char *type) {
+  if (eventCount == EVENT_BUFFER_SIZE) {
+    flushEvents();
+  }
+  if (eventCount < EVENT_BUFFER_SIZE) {  // still full if the flush failed: drop
+    eventTypes[eventCount] = type;
+    eventTimes[eventCount] = millis();
+    eventCount++;
+  }
+}
+
+void flushEvents() {
+  lastEventFlush = millis();
+  if (WiFi.status() != WL_CONNECTED) {
+    Serial.println("Wi-Fi not connected for flushEvents");
+    return;
   }
-  Serial.println("Wi-Fi not connected for setTableVacantOnServer");
-  return false;
+
+  // No wall clock here, so each event says how long ago it happened
+  unsigned long now = millis();
+  String jsonPayload = "{\"table_id\":\"" + sanitizeForJson(tableID) + "\", \"events\":[";
+  for (int i = 0; i < eventCount; i++) {
+    if (i > 0) jsonPayload += ",";
+    jsonPayload += "{\"type\":\"" + String(eventTypes[i]) +
+                   "\", \"age_ms\":" + String(now - eventTimes[i]) + "}";
+  }
+  jsonPayload += "]}";
+
+  HTTPClient http;
+  http.begin(ingestEventsURL);
+  http.addHeader("Content-Type", "application/json");
+  addDeviceToken(http);
+  int httpResponseCode = http.POST(jsonPayload);
+  if (httpResponseCode == 200) {
+    eventCount = 0;
+  } else {
+    Serial.print("flushEvents error code: ");
+    Serial.println(httpResponseCode);
+  }
+  http.end();
+}
+
+void sendHeartbeat() {
+  lastHeartbeat = millis();
+  if (WiFi.status() != WL_CONNECTED) {
+    return;
+  }
+  HTTPClient http;
+  http.begin(heartbeatURL);
+  addDeviceToken(http);
+  int httpResponseCode = http.POST("");
+  if (httpResponseCode != 200) {
+    Serial.print("heartbeat error code: ");
+    Serial.println(httpResponseCode);
+  }
+  http.end();
 }
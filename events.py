@@ -0,0 +1,97 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+EVENT_TYPES = ("pir_high", "pir_low", "card_tap", "clash")
+
+
+def normalize_event(raw, table_id=None, received_at=None):
+    """Validate one device event; returns the stored form or None if it is unusable."""
+    if not isinstance(raw, dict):
+        return None
+    table_id = raw.get("table_id", table_id)
+    kind = raw.get("type")
+    if not isinstance(table_id, str) or not table_id or kind not in EVENT_TYPES:
+        return None
+    received_at = received_at or time.time()
+    # Devices without a wall clock report how long ago the event happened instead
+    ts = raw.get("ts")
+    if not isinstance(ts, (int, float)):
+        age_ms = raw.get("age_ms")
+        ts = received_at - age_ms / 1000 if isinstance(age_ms, (int, float)) else received_at
+    event = {"table_id": table_id, "type": kind, "ts": ts, "received_at": received_at}
+    if isinstance(raw.get("can_id"), str):
+        event["can_id"] = raw["can_id"]
+    return event
+
+
+class EventLog:
+    """Ring buffer of device events, appended to a journal and handed to a background stage."""
+
+    def __init__(self, journal_path, capacity=10000, journal_max_bytes=10 * 1024 * 1024):
+        self.journal_path = journal_path
+        self.journal_max_bytes = journal_max_bytes
+        self.buffer = deque(maxlen=capacity)
+        self.cursor = 0  # seq of the newest event
+        self.pending = queue.Queue()
+        self.handlers = []
+        self.processed = 0
+        self.counts = dict.fromkeys(EVENT_TYPES, 0)
+        self.lock = threading.Lock()
+
+    def subscribe(self, handler):
+        """Register handler(batch) to run on the background stage."""
+        self.handlers.append(handler)
+
+    def append(self, events):
+        """Sequence, buffer and journal a batch; returns the cursor after it."""
+        if not events:
+            return self.cursor
+        with self.lock:
+            for event in events:
+                self.cursor += 1
+                event["seq"] = self.cursor
+                self.buffer.append(event)
+            self._journal(events)
+            cursor = self.cursor
+        self.pending.put(events)
+        return cursor
+
+    def _journal(self, events):
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > self.journal_max_bytes:
+            os.replace(self.journal_path, self.journal_path + ".1")
+        with open(self.journal_path, "a") as file:
+            file.write("".join(json.dumps(event) + "\n" for event in events))
+
+    def since(self, cursor, limit=500):
+        """Return buffered events newer than cursor, oldest first."""
+        with self.lock:
+            events = [event for event in self.buffer if event["seq"] > cursor]
+        return events[:limit]
+
+    def start(self):
+        threading.Thread(target=self._process, daemon=True).start()
+
+    def _process(self):
+        while True:
+            batch = self.pending.get()
+            for event in batch:
+                self.counts[event["type"]] += 1
+            for handler in self.handlers:
+                try:
+                    handler(batch)
+                except Exception as e:
+                    print("Event handler failed:", e)
+            self.processed += len(batch)
+
+    def stats(self):
+        return {
+            "cursor": self.cursor,
+            "buffered": len(self.buffer),
+            "processed": self.processed,
+            "backlog": self.pending.qsize(),
+            "counts": dict(self.counts)
+        }
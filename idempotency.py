@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class IdempotencyCache:
+    """Bounded TTL + LRU cache of responses to device writes, keyed by Idempotency-Key."""
+
+    HIT = "hit"
+    CLAIMED = "claimed"
+    BUSY = "busy"
+
+    def __init__(self, max_entries=1024, ttl=120):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (stored_at, response), least recently used first
+        self.in_flight = set()
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+        self.lock = threading.Lock()
+
+    def begin(self, key):
+        """Return (HIT, response) for a replay, (CLAIMED, None) for a new key or (BUSY, None)."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if now - entry[0] < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.HIT, entry[1]
+                del self.entries[key]
+            if key in self.in_flight:
+                self.conflicts += 1
+                return self.BUSY, None
+            self.in_flight.add(key)
+            self.misses += 1
+            return self.CLAIMED, None
+
+    def store(self, key, response):
+        """Cache the response for a claimed key."""
+        now = time.monotonic()
+        with self.lock:
+            self.in_flight.discard(key)
+            self.entries[key] = (now, response)
+            self.entries.move_to_end(key)
+            self._prune(now)
+
+    def release(self, key):
+        """Give up a claimed key without caching, so a retry runs again."""
+        with self.lock:
+            self.in_flight.discard(key)
+
+    def _prune(self, now):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        while self.entries:
+            stored_at = next(iter(self.entries.values()))[0]
+            if now - stored_at < self.ttl:
+                break
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        """Return dedupe counters and the replay hit rate."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "in_flight": len(self.in_flight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "conflicts": self.conflicts,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
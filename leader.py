@@ -0,0 +1,42 @@
+import fcntl
+import os
+import time
+
+
+class LeaderElection:
+    """Picks one process among the workers by holding an exclusive flock on a shared file.
+
+    The kernel drops the lock when the holder exits, so a waiting worker takes
+    over within retry_interval seconds if the leader dies.
+    """
+
+    def __init__(self, lock_path, retry_interval=1):
+        self.lock_path = lock_path
+        self.retry_interval = retry_interval
+        self.fd = None
+        self.is_leader = False
+
+    def acquire(self):
+        """Try once to become leader; returns True if this process holds the lock."""
+        if self.is_leader:
+            return True
+        if self.fd is None:
+            self.fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        os.ftruncate(self.fd, 0)
+        os.write(self.fd, f"{os.getpid()}\n".encode())
+        self.is_leader = True
+        return True
+
+    def run(self, work):
+        """Wait until this process is leader, then run work() for as long as it lives."""
+        while not self.acquire():
+            time.sleep(self.retry_interval)
+        print(f"Worker {os.getpid()} is now the timer leader")
+        work()
+
+    def stats(self):
+        return {"pid": os.getpid(), "is_leader": self.is_leader}
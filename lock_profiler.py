@@ -0,0 +1,159 @@
+import contextlib
+import os
+import sys
+import threading
+import time
+
+LOCK_PROFILE_DEPTH = 16  # frames kept per stack in the collapsed dump
+
+# Frames that belong to the locking machinery rather than to the code asking for the lock
+SKIP_FILES = (os.path.abspath(__file__), os.path.abspath(contextlib.__file__))
+SKIP_FUNCTIONS = ("locked", "acquire", "__enter__", "__exit__", "release")
+
+
+class SiteStats:
+    __slots__ = ("acquisitions", "contended", "wait", "wait_max", "hold", "hold_max", "waiters", "waiters_max")
+
+    def __init__(self):
+        self.acquisitions = 0
+        self.contended = 0  # acquisitions that found other threads already waiting or the lock taken
+        self.wait = 0.0
+        self.wait_max = 0.0
+        self.hold = 0.0
+        self.hold_max = 0.0
+        self.waiters = 0  # sum of threads already waiting when this site arrived
+        self.waiters_max = 0
+
+
+class LockProfiler:
+    """Per-call-site wait, hold and waiter counts for the locks wrapped in ProfiledLock.
+
+    Off by default; while disabled a ProfiledLock is one attribute check
+    away from the plain lock. The call site is the first frame outside the
+    locking helpers (e.g. start_timer rather than Timers.locked), and the
+    full stack is kept too, for collapsed() flamegraph dumps.
+    """
+
+    def __init__(self, enabled=False, depth=LOCK_PROFILE_DEPTH):
+        self.enabled = enabled
+        self.depth = depth
+        self.sites = {}  # (lock name, site) -> SiteStats
+        self.stacks = {}  # (lock name, stack) -> [wait, hold] seconds
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def set_enabled(self, enabled, reset=False):
+        with self.lock:
+            if reset:
+                self.sites = {}
+                self.stacks = {}
+                self.started = time.time()
+            self.enabled = enabled
+
+    def caller(self):
+        """(site, collapsed stack) of the code acquiring the lock."""
+        frame = sys._getframe(2)
+        while frame is not None and (frame.f_code.co_filename in SKIP_FILES
+                                     or frame.f_code.co_name in SKIP_FUNCTIONS):
+            frame = frame.f_back
+        site = frame.f_code.co_name if frame is not None else "?"
+        names = []
+        while frame is not None and len(names) < self.depth:
+            names.append(frame.f_code.co_name)
+            frame = frame.f_back
+        return site, ";".join(reversed(names))
+
+    def record(self, name, site, stack, wait, hold, waiters, contended):
+        with self.lock:
+            stats = self.sites.get((name, site))
+            if stats is None:
+                stats = self.sites[(name, site)] = SiteStats()
+            stats.acquisitions += 1
+            stats.contended += contended
+            stats.wait += wait
+            stats.wait_max = max(stats.wait_max, wait)
+            stats.hold += hold
+            stats.hold_max = max(stats.hold_max, hold)
+            stats.waiters += waiters
+            stats.waiters_max = max(stats.waiters_max, waiters)
+            totals = self.stacks.get((name, stack))
+            if totals is None:
+                totals = self.stacks[(name, stack)] = [0.0, 0.0]
+            totals[0] += wait
+            totals[1] += hold
+
+    def report(self):
+        with self.lock:
+            sites = [
+                {
+                    "lock": name,
+                    "site": site,
+                    "acquisitions": stats.acquisitions,
+                    "contended": stats.contended,
+                    "wait_total_ms": stats.wait * 1000,
+                    "wait_max_ms": stats.wait_max * 1000,
+                    "hold_total_ms": stats.hold * 1000,
+                    "hold_max_ms": stats.hold_max * 1000,
+                    "avg_waiters": stats.waiters / stats.acquisitions,
+                    "max_waiters": stats.waiters_max
+                }
+                for (name, site), stats in self.sites.items()
+            ]
+            enabled, started = self.enabled, self.started
+        sites.sort(key=lambda site: -site["wait_total_ms"])
+        return {"enabled": enabled, "seconds": time.time() - started, "sites": sites}
+
+    def collapsed(self, metric="wait"):
+        """One "lock;frame;...;frame microseconds" line per stack, for flamegraph.pl or speedscope."""
+        index = 0 if metric == "wait" else 1
+        with self.lock:
+            lines = [f"{name};{stack} {round(totals[index] * 1e6)}"
+                     for (name, stack), totals in self.stacks.items() if totals[index] >= 1e-6]
+        return "\n".join(sorted(lines)) + "\n"
+
+
+class ProfiledLock:
+    """Drop-in for a Lock that reports to a LockProfiler while it is enabled."""
+
+    def __init__(self, lock, profiler, name):
+        self.lock = lock
+        self.profiler = profiler
+        self.name = name
+        self.waiting = 0
+        self.count_lock = threading.Lock()
+        self.holder = None  # (site, stack, wait, waiters, contended, acquired_at), set by the holder
+
+    def acquire(self, blocking=True, timeout=-1):
+        if not self.profiler.enabled:
+            return self.lock.acquire(blocking, timeout)
+        site, stack = self.profiler.caller()
+        with self.count_lock:
+            waiters = self.waiting
+            self.waiting += 1
+        contended = waiters > 0 or self.lock.locked()
+        started = time.perf_counter()
+        try:
+            acquired = self.lock.acquire(blocking, timeout)
+        finally:
+            with self.count_lock:
+                self.waiting -= 1
+        if acquired:
+            now = time.perf_counter()
+            self.holder = (site, stack, now - started, waiters, contended, now)
+        return acquired
+
+    def release(self):
+        holder, self.holder = self.holder, None
+        released = time.perf_counter()
+        self.lock.release()
+        if holder is not None:
+            site, stack, wait, waiters, contended, acquired_at = holder
+            self.profiler.record(self.name, site, stack, wait, released - acquired_at, waiters, contended)
+
+    def locked(self):
+        return self.lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,214 @@
+import bisect
+import threading
+import time
+
+# Seconds; fine enough at the low end for lock waits, wide enough for a slow JSON save
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)  # bytes
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+    """A counter or histogram whose every thread records into its own dict.
+
+    Recording touches only the calling thread's dict, with no lock, so
+    instrumented hot paths do not contend with each other. A scrape merges
+    the dicts; those of threads that have exited are folded into
+    self.retired so short-lived request threads do not pile up.
+    """
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.local = threading.local()
+        self.threads = []  # (thread, values) per thread that has recorded anything
+        self.retired = {}
+        self.lock = threading.Lock()  # taken once per thread and on scrape, never per record
+
+    def values(self):
+        values = getattr(self.local, "values", None)
+        if values is None:
+            values = self.local.values = {}
+            with self.lock:
+                self.threads.append((threading.current_thread(), values))
+        return values
+
+    def merged(self):
+        with self.lock:
+            merged = {}
+            self.merge(merged, self.retired)
+            alive = []
+            for thread, values in self.threads:
+                self.merge(merged, values)
+                if thread.is_alive():
+                    alive.append((thread, values))
+                else:
+                    self.merge(self.retired, values)
+            self.threads = alive
+        return merged
+
+    def merge(self, into, values):
+        raise NotImplementedError
+
+    def render(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, labels=()):
+        values = self.values()
+        values[labels] = values.get(labels, 0) + amount
+
+    def merge(self, into, values):
+        for labels, value in list(values.items()):
+            into[labels] = into.get(labels, 0) + value
+
+    def render(self):
+        return [f"{self.name}{format_labels(self.labels, labels)} {value}"
+                for labels, value in self.merged().items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        values = self.values()
+        series = values.get(labels)
+        if series is None:
+            series = values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]  # per-bucket counts, sum, count
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def merge(self, into, values):
+        for labels, series in list(values.items()):
+            total = into.get(labels)
+            if total is None:
+                total = into[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            for index, count in enumerate(series[0]):
+                total[0][index] += count
+            total[1] += series[1]
+            total[2] += series[2]
+
+    def render(self):
+        lines = []
+        names = self.labels + ("le",)
+        for labels, (counts, total, count) in self.merged().items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{format_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class Gauge:
+    """A value read when scraped: collect() returns a number or {label values tuple: number}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, collect, labels=()):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labels = tuple(labels)
+
+    def render(self):
+        value = self.collect()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{format_labels(self.labels, labels)} {number}"
+                for labels, number in value.items()]
+
+
+class MetricsRegistry:
+    """Renders its metrics in the Prometheus text exposition format."""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, collect, labels=()):
+        return self.add(Gauge(name, help, collect, labels))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = metric.render()
+            except Exception as e:
+                print(f"Metric {metric.name} failed:", e)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class MeteredLock:
+    """Lock wrapper recording how long each acquire waited and how long the lock was then held.
+
+    on_wait(seconds), if given, also gets every wait (e.g. RequestTimer.lock_wait).
+    """
+
+    def __init__(self, lock, wait, hold, labels=(), on_wait=None):
+        self.lock = lock
+        self.wait = wait
+        self.hold = hold
+        self.labels = labels
+        self.on_wait = on_wait
+        self.acquired_at = 0.0  # written by the holder only
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        if acquired:
+            self.acquired_at = time.perf_counter()
+            self.wait.observe(self.acquired_at - started, self.labels)
+            if self.on_wait is not None:
+                self.on_wait(self.acquired_at - started)
+        return acquired
+
+    def release(self):
+        self.hold.observe(time.perf_counter() - self.acquired_at, self.labels)
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self.release()
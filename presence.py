@@ -0,0 +1,100 @@
+import heapq
+import threading
+
+
+class TablePresence:
+    __slots__ = ("can_id", "sensor", "present", "last_pir", "version")
+
+    def __init__(self):
+        self.can_id = None  # chope being watched, if any
+        self.sensor = False  # a PIR event has been seen from this table
+        self.present = False  # PIR currently high
+        self.last_pir = 0.0  # ts of the newest PIR edge applied
+        self.version = 0  # bumps whenever the pending deadline is replaced
+
+
+class PresenceMonitor:
+    """Releases chopes whose table reports no PIR presence for absence_window seconds.
+
+    Each table is a small state machine fed incrementally by PIR events and
+    timer events; pending releases sit in a deadline heap, so a tick only
+    touches tables whose window actually ran out. Chopes are tracked on
+    every table, but only released on tables that have sent a PIR event;
+    a table's first PIR edge puts a chope already running under watch.
+    """
+
+    def __init__(self, absence_window, release):
+        self.absence_window = absence_window
+        self.release = release  # release(table_id, can_id) -> bool
+        self.tables = {}  # table_id -> TablePresence, for PIR tables and choped ones
+        self.deadlines = []  # heap of (deadline, table_id, version)
+        self.released = 0
+        self.lock = threading.Lock()
+
+    def on_device_events(self, batch):
+        """EventLog handler: apply PIR edges in timestamp order."""
+        with self.lock:
+            for event in sorted(batch, key=lambda event: event["ts"]):
+                if event["type"] in ("pir_high", "pir_low"):
+                    self._pir(event["table_id"], event["type"] == "pir_high", event["ts"])
+
+    def on_timer_events(self, events, now):
+        """Timers listener: start watching new chopes, stop watching ended ones."""
+        with self.lock:
+            for event, payload in events:
+                table_id = payload["table_id"]
+                if event == "table_state" and payload["timer"]:
+                    self._choped(table_id, self.tables.setdefault(table_id, TablePresence()), payload["can_id"], now)
+                elif event in ("table_state", "timer_ended"):
+                    presence = self.tables.get(table_id)
+                    if presence is None:
+                        continue
+                    presence.can_id = None
+                    presence.version += 1
+                    if not presence.sensor:
+                        del self.tables[table_id]  # nothing to remember about a table without a sensor
+
+    def _choped(self, table_id, presence, can_id, now):
+        if presence.can_id == can_id:
+            return
+        presence.can_id = can_id
+        presence.version += 1
+        if presence.sensor and not presence.present:
+            self._schedule(table_id, presence, now + self.absence_window)
+
+    def _pir(self, table_id, high, ts):
+        presence = self.tables.setdefault(table_id, TablePresence())
+        presence.sensor = True
+        if ts < presence.last_pir:
+            return  # late event from an older batch
+        presence.last_pir = ts
+        presence.present = high
+        presence.version += 1
+        if not high and presence.can_id is not None:
+            self._schedule(table_id, presence, ts + self.absence_window)
+
+    def _schedule(self, table_id, presence, deadline):
+        heapq.heappush(self.deadlines, (deadline, table_id, presence.version))
+
+    def expire(self, now):
+        """Release every watched chope whose absence window has run out; returns how many."""
+        due = []
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                _, table_id, version = heapq.heappop(self.deadlines)
+                presence = self.tables[table_id]
+                if presence.version == version and presence.can_id is not None:
+                    due.append((table_id, presence.can_id))
+                    presence.can_id = None
+        released = sum(1 for table_id, can_id in due if self.release(table_id, can_id))
+        self.released += released
+        return released
+
+    def stats(self):
+        with self.lock:
+            return {
+                "sensor_tables": sum(1 for presence in self.tables.values() if presence.sensor),
+                "watching": sum(1 for presence in self.tables.values() if presence.sensor and presence.can_id is not None),
+                "pending_deadlines": len(self.deadlines),
+                "released": self.released
+            }
@@ -0,0 +1,147 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILE_MAX_SECONDS = 60
+PROFILE_MIN_INTERVAL = 0.001  # seconds between samples
+PROFILE_MAX_INTERVAL = 1.0
+TRACEMALLOC_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def thread_label(thread):
+    # "Thread-7 (timer_thread)" -> "timer_thread", so every thread running the same target merges
+    name = thread.name if thread is not None else "unknown"
+    if name.endswith(")") and " (" in name:
+        return name[name.index(" (") + 2:-1]
+    return name
+
+
+def clamp(value, low, high):
+    # NaN compares false both ways, so min/max would pass it through
+    return low if value != value else min(max(value, low), high)
+
+
+def frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """Samples the stack of every thread with sys._current_frames and counts collapsed stacks.
+
+    No hook or trace function is installed, so nothing runs between
+    profiles; during one, the cost is a stack walk per thread per interval
+    on the thread that asked for it. One profile runs at a time; the lock
+    only guards the running flag, so it is never held while sampling.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = False
+        self.runs = 0
+
+    def profile(self, seconds, interval=0.01):
+        """Sample for seconds; returns ({collapsed stack: samples}, samples taken) or None if already running."""
+        interval = clamp(interval, PROFILE_MIN_INTERVAL, PROFILE_MAX_INTERVAL)
+        seconds = clamp(seconds, interval, PROFILE_MAX_SECONDS)
+        with self.lock:
+            if self.running:
+                return None
+            self.running = True
+        try:
+            own = threading.get_ident()
+            stacks = {}
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                threads = {thread.ident: thread for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    names = []
+                    while frame is not None:
+                        names.append(frame_label(frame.f_code))
+                        frame = frame.f_back
+                    names.append(thread_label(threads.get(ident)))
+                    stack = ";".join(reversed(names))
+                    stacks[stack] = stacks.get(stack, 0) + 1
+                samples += 1
+                time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+            return stacks, samples
+        finally:
+            with self.lock:
+                self.running = False
+                self.runs += 1
+
+
+def collapsed(stacks):
+    return "\n".join(f"{stack} {count}" for stack, count in sorted(stacks.items())) + "\n"
+
+
+class MemoryTracker:
+    """tracemalloc on demand: start, take a baseline snapshot, then diff against it later."""
+
+    def __init__(self):
+        self.baseline = None
+        self.baseline_at = None
+        self.lock = threading.Lock()
+
+    def start(self, frames=1):
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start(frames)
+        return True
+
+    def stop(self):
+        with self.lock:
+            self.baseline = None
+            self.baseline_at = None
+        tracemalloc.stop()
+
+    def take(self):
+        return tracemalloc.take_snapshot().filter_traces(TRACEMALLOC_FILTERS)
+
+    def snapshot(self, key="lineno", limit=20):
+        """Keep a new baseline; returns its largest allocation sites."""
+        snapshot = self.take()
+        with self.lock:
+            self.baseline = snapshot
+            self.baseline_at = time.time()
+        return [self.describe(stat) for stat in snapshot.statistics(key)[:limit]]
+
+    def diff(self, key="lineno", limit=20):
+        """Growth since the baseline, largest first; None without a baseline."""
+        with self.lock:
+            baseline = self.baseline
+        if baseline is None:
+            return None
+        return [self.describe(stat) for stat in self.take().compare_to(baseline, key)[:limit]]
+
+    def describe(self, stat):
+        entry = {
+            "where": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+            "size_kb": stat.size / 1024,
+            "count": stat.count
+        }
+        if hasattr(stat, "size_diff"):
+            entry["size_diff_kb"] = stat.size_diff / 1024
+            entry["count_diff"] = stat.count_diff
+        return entry
+
+    def stats(self):
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {
+            "tracing": tracing,
+            "frames": tracemalloc.get_traceback_limit() if tracing else 0,
+            "traced_kb": current / 1024,
+            "peak_kb": peak / 1024,
+            "overhead_kb": tracemalloc.get_tracemalloc_memory() / 1024,
+            "baseline_age": time.time() - self.baseline_at if self.baseline_at else None
+        }
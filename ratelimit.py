@@ -0,0 +1,96 @@
+import math
+import threading
+import time
+
+RATELIMIT_SWEEP_EVERY = 1024  # new keys between sweeps of idle buckets
+
+
+class TokenBucket:
+    """One limit (rate per second, burst) applied per value of a request key such as "ip".
+
+    Buckets live in a dict of value -> [tokens, last_refill], updated in
+    place, so a request that already has a bucket costs one lookup. A
+    bucket that has been idle long enough to refill completely is the same
+    as no bucket, so sweeps drop those.
+    """
+
+    def __init__(self, key, rate, burst):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.idle_after = burst / rate  # seconds for an empty bucket to fill up again
+        self.buckets = {}
+        self.new_keys = 0
+        self.allowed = 0
+        self.limited = 0
+
+    def refill(self, value, now):
+        bucket = self.buckets.get(value)
+        if bucket is None:
+            bucket = self.buckets[value] = [self.burst, now]
+            self.new_keys += 1
+            if self.new_keys >= RATELIMIT_SWEEP_EVERY:
+                self.sweep(now)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def sweep(self, now):
+        self.new_keys = 0
+        idle = [value for value, bucket in self.buckets.items() if now - bucket[1] >= self.idle_after]
+        for value in idle:
+            del self.buckets[value]
+
+
+class RateLimiter:
+    """Applies each route's token buckets to a request."""
+
+    def __init__(self, routes, default=()):
+        self.routes = routes  # endpoint -> [TokenBucket], several routes may share one
+        self.default = default
+        self.limited = {}  # endpoint -> requests refused
+        self.lock = threading.Lock()
+
+    def check(self, endpoint, keys, now=None):
+        """Take a token from each of the route's buckets; returns 0, or whole seconds until a retry can pass.
+
+        keys maps a TokenBucket.key to this request's value; missing keys are not limited.
+        """
+        limits = self.routes.get(endpoint, self.default)
+        if not limits:
+            return 0
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            wait = 0
+            for limit in limits:
+                value = keys.get(limit.key)
+                if value:
+                    tokens = limit.refill(value, now)[0]
+                    if tokens < 1:
+                        wait = max(wait, (1 - tokens) / limit.rate)
+            if wait:
+                for limit in limits:
+                    value = keys.get(limit.key)
+                    if value and limit.buckets[value][0] < 1:
+                        limit.limited += 1
+                self.limited[endpoint] = self.limited.get(endpoint, 0) + 1
+                return max(1, math.ceil(wait))
+            for limit in limits:
+                value = keys.get(limit.key)
+                if value:
+                    limit.buckets[value][0] -= 1
+                    limit.allowed += 1
+            return 0
+
+    def stats(self):
+        with self.lock:
+            limits = {id(limit): limit for limits in list(self.routes.values()) + [self.default] for limit in limits}
+            return {
+                "limited_by_route": dict(self.limited),
+                "buckets": [
+                    {"key": limit.key, "rate": limit.rate, "burst": limit.burst, "tracked": len(limit.buckets),
+                     "allowed": limit.allowed, "limited": limit.limited}
+                    for limit in limits.values()
+                ]
+            }
@@ -0,0 +1,196 @@
+import heapq
+import itertools
+import operator
+import threading
+import time
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+REQUEST_TIMING_SLOWEST = 100  # requests kept with their phase breakdown
+
+# Each phase is exclusive: JSON parsing or a lock wait inside a view is not also counted as handler time.
+# Whatever no phase covers (routing, rate limiting, admission queueing, other hooks) is "other".
+PHASES = ("session_load", "json_parse", "lock_wait", "handler", "serialize", "session_save")
+SESSION_LOAD, JSON_PARSE, LOCK_WAIT, HANDLER, SERIALIZE, SESSION_SAVE = range(len(PHASES))
+
+
+class RequestTrace:
+    __slots__ = ("method", "path", "route", "status", "phases", "inner")
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.route = "unmatched"
+        self.status = None
+        self.phases = [0.0] * len(PHASES)
+        self.inner = 0.0  # seconds already counted by finished phases nested in the open one
+
+
+class RequestTimer:
+    """Per-route request timings split into phases, plus the slowest requests seen.
+
+    The WSGI middleware from wrap() opens a trace per request in a
+    thread-local; install() times the session interface, the JSON provider
+    and dispatch against it, and MeteredLock reports lock waits through
+    lock_wait(). Off by default: while disabled the middleware is one
+    attribute check and each hook one thread-local lookup. Finished
+    requests update per-route sums and a min-heap of the slowest keep.
+    """
+
+    def __init__(self, enabled=False, keep=REQUEST_TIMING_SLOWEST, skip_prefixes=()):
+        self.enabled = enabled
+        self.keep = keep
+        self.skip_prefixes = tuple(skip_prefixes)
+        self.local = threading.local()
+        self.slowest = []  # heap of (total, seq, trace, finished_at), fastest first
+        self.routes = {}  # (route, method) -> [count, total, max, per-phase sums]
+        self.seq = itertools.count()
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def set_enabled(self, enabled, reset=False):
+        with self.lock:
+            if reset:
+                self.slowest = []
+                self.routes = {}
+                self.started = time.time()
+            self.enabled = enabled
+
+    def wrap(self, wsgi_app):
+        return TimingMiddleware(wsgi_app, self)
+
+    def install(self, app):
+        """Time the session interface, JSON provider and view dispatch of a Flask app."""
+        interface = app.session_interface
+        interface.open_session = self.timed(SESSION_LOAD, interface.open_session)
+        interface.save_session = self.timed(SESSION_SAVE, interface.save_session)
+        app.dispatch_request = self.timed(HANDLER, app.dispatch_request)
+        app.json = TimedJSONProvider(app, self)
+        app.after_request(self.label)
+        app.wsgi_app = self.wrap(app.wsgi_app)
+
+    def timed(self, phase, func):
+        def timed_call(*args, **kwargs):
+            trace = getattr(self.local, "trace", None)
+            if trace is None:
+                return func(*args, **kwargs)
+            inner, trace.inner = trace.inner, 0.0
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                trace.phases[phase] += elapsed - trace.inner
+                trace.inner = inner + elapsed
+        return timed_call
+
+    def lock_wait(self, seconds):
+        trace = getattr(self.local, "trace", None)
+        if trace is not None:
+            trace.phases[LOCK_WAIT] += seconds
+            trace.inner += seconds
+
+    def label(self, response):
+        # after_request, so requests turned away by a before_request hook get their endpoint too
+        trace = getattr(self.local, "trace", None)
+        if trace is not None:
+            trace.route = request.endpoint or "unmatched"
+            trace.status = response.status_code
+        return response
+
+    def finish(self, trace, total):
+        key = (trace.route, trace.method)
+        with self.lock:
+            route = self.routes.get(key)
+            if route is None:
+                route = self.routes[key] = [0, 0.0, 0.0, [0.0] * len(PHASES)]
+            route[0] += 1
+            route[1] += total
+            if total > route[2]:
+                route[2] = total
+            route[3][:] = map(operator.add, route[3], trace.phases)
+            if len(self.slowest) < self.keep:
+                heapq.heappush(self.slowest, (total, next(self.seq), trace, time.time()))
+            elif total > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (total, next(self.seq), trace, time.time()))
+
+    def report(self, route=None, limit=None):
+        with self.lock:
+            slowest = sorted(self.slowest, key=lambda entry: -entry[0])
+            routes = [(key, count, total, longest, list(sums))
+                      for key, (count, total, longest, sums) in self.routes.items()]
+            enabled, started = self.enabled, self.started
+        if route is not None:
+            slowest = [entry for entry in slowest if entry[2].route == route]
+            routes = [entry for entry in routes if entry[0][0] == route]
+        routes.sort(key=lambda entry: -entry[2])
+        return {
+            "enabled": enabled,
+            "seconds": time.time() - started,
+            "phases": list(PHASES) + ["other"],
+            "routes": [
+                {
+                    "route": name,
+                    "method": method,
+                    "count": count,
+                    "total_ms": total * 1000,
+                    "avg_ms": total * 1000 / count,
+                    "max_ms": longest * 1000,
+                    "avg_phases_ms": breakdown(sums, total, count)
+                }
+                for (name, method), count, total, longest, sums in routes
+            ],
+            "slowest": [
+                {
+                    "route": trace.route,
+                    "method": trace.method,
+                    "path": trace.path,
+                    "status": trace.status,
+                    "at": finished_at,
+                    "total_ms": total * 1000,
+                    "phases_ms": breakdown(trace.phases, total)
+                }
+                for total, _, trace, finished_at in slowest[:limit]
+            ]
+        }
+
+
+def breakdown(phases, total, count=1):
+    result = {name: seconds * 1000 / count for name, seconds in zip(PHASES, phases)}
+    result["other"] = max(total - sum(phases), 0.0) * 1000 / count
+    return result
+
+
+class TimingMiddleware:
+    """WSGI middleware opening a RequestTrace around each request while its RequestTimer is enabled."""
+
+    def __init__(self, wsgi_app, timer):
+        self.wsgi_app = wsgi_app
+        self.timer = timer
+
+    def __call__(self, environ, start_response):
+        timer = self.timer
+        if (not timer.enabled or environ.get("PATH_INFO", "").startswith(timer.skip_prefixes)
+                or environ.get("HTTP_UPGRADE", "").lower() == "websocket"):
+            # Sockets live for hours and would crowd every real request out of the slowest list
+            return self.wsgi_app(environ, start_response)
+        trace = RequestTrace(environ.get("REQUEST_METHOD"), environ.get("PATH_INFO"))
+        timer.local.trace = trace
+        started = time.perf_counter()
+        try:
+            # Flask buffers the body of every view here, so returning means the request is done
+            return self.wsgi_app(environ, start_response)
+        finally:
+            total = time.perf_counter() - started
+            timer.local.trace = None
+            timer.finish(trace, total)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, with request.json parsing and jsonify() timed as their own phases."""
+
+    def __init__(self, app, timer):
+        super().__init__(app)
+        self.loads = timer.timed(JSON_PARSE, self.loads)
+        self.dumps = timer.timed(SERIALIZE, self.dumps)
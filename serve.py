@@ -0,0 +1,183 @@
+import argparse
+import importlib.util
+import os
+import queue
+import signal
+import threading
+import time
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+SERVE_THREADS = 64  # requests handled at once; each websocket or long-poll holds one
+SERVE_QUEUE = 128  # accepted connections waiting for a thread before new ones get a 503
+SERVE_BACKLOG = 256  # kernel listen backlog
+# gunicorn keep-alive; werkzeug always closes after a response, so there it bounds how long
+# a connection may sit idle before sending its request
+SERVE_KEEPALIVE = 5  # seconds
+SERVE_GRACE = 10  # seconds to let in-flight requests finish on shutdown
+
+BUSY_RESPONSE = (b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\n"
+                 b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+
+
+class TimeoutHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1"  # chunked responses
+    timeout = SERVE_KEEPALIVE  # socket timeout, so a silent client cannot pin a pool thread
+
+    def run_wsgi(self):
+        # The timeout guards the request line and headers. An upgraded socket is idle between
+        # frames for as long as its own pings allow, so it must not inherit the keepalive timeout.
+        # Werkzeug closes every connection after its one request, so the timeout is never needed again.
+        if self.headers.get("Upgrade", "").lower() == "websocket":
+            self.connection.settimeout(None)
+        super().run_wsgi()
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server with a fixed pool of threads and a bounded accept queue.
+
+    Werkzeug's threaded server starts a thread per connection with no limit;
+    here a burst beyond threads + queue_depth is answered 503 straight away.
+    """
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads=SERVE_THREADS, queue_depth=SERVE_QUEUE,
+                 backlog=SERVE_BACKLOG, keepalive=SERVE_KEEPALIVE):
+        self.request_queue_size = backlog
+        handler = type("Handler", (TimeoutHandler,), {"timeout": keepalive})
+        super().__init__(host, port, app, handler=handler)
+        self.pending = queue.Queue(queue_depth)
+        self.busy = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        for _ in range(threads):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            self.rejected += 1
+            try:
+                request.sendall(BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def work(self):
+        while True:
+            request, client_address = self.pending.get()
+            with self.lock:
+                self.busy += 1
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self.lock:
+                    self.busy -= 1
+
+    def drain(self, grace):
+        """Wait up to grace seconds for queued and in-flight requests; returns how many were left."""
+        deadline = time.monotonic() + grace
+        while (self.busy or not self.pending.empty()) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        return self.busy + self.pending.qsize()
+
+
+def flush(backend):
+    backend.session_store.flush()  # batched session renewals
+    # SqliteTimers commits every change; the in-memory Timers needs a final save
+    if not backend.MULTI_WORKER:
+        backend.timers.save_timers()
+        print("Timers saved")
+
+
+def serve_werkzeug(args):
+    import app as backend
+
+    backend.start_background()
+    server = PooledWSGIServer(args.host, args.port, backend.app, threads=args.threads, queue_depth=args.queue,
+                              backlog=args.backlog, keepalive=args.keepalive)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever, which is running on this (main) thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Serving on http://{args.host}:{args.port} with {args.threads} threads")
+    server.serve_forever()
+    server.server_close()
+    left = server.drain(args.grace)
+    if left:
+        print(f"Shutting down with {left} requests still open")
+    flush(backend)
+
+
+def serve_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    def post_worker_init(worker):
+        import app as backend
+        backend.start_background()
+
+    def worker_exit(server, worker):
+        import app as backend
+        flush(backend)
+
+    class Application(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{args.host}:{args.port}",
+                "workers": args.workers,
+                "worker_class": "gthread",
+                "threads": args.threads,
+                "keepalive": args.keepalive,
+                "backlog": args.backlog,
+                "graceful_timeout": args.grace,
+                "preload_app": False,  # each worker imports app and starts its own threads after the fork
+                "post_worker_init": post_worker_init,
+                "worker_exit": worker_exit,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            import app as backend
+            return backend.app
+
+    Application().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the backend with a production server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--server", choices=("auto", "gunicorn", "werkzeug"), default="auto")
+    parser.add_argument("--workers", type=int, default=1, help="processes; more than one needs gunicorn")
+    parser.add_argument("--threads", type=int, default=SERVE_THREADS)
+    parser.add_argument("--queue", type=int, default=SERVE_QUEUE, help="connections waiting for a thread (werkzeug)")
+    parser.add_argument("--backlog", type=int, default=SERVE_BACKLOG)
+    parser.add_argument("--keepalive", type=float, default=SERVE_KEEPALIVE)
+    parser.add_argument("--grace", type=float, default=SERVE_GRACE)
+    args = parser.parse_args()
+
+    server = args.server
+    if server == "auto":
+        server = "gunicorn" if importlib.util.find_spec("gunicorn") else "werkzeug"
+    if args.workers > 1:
+        if server != "gunicorn":
+            parser.error("--workers > 1 needs gunicorn")
+        os.environ["MULTI_WORKER"] = "1"  # shared SQLite state and one elected timer leader
+
+    if server == "gunicorn":
+        serve_gunicorn(args)
+    else:
+        serve_werkzeug(args)
+
+
+if __name__ == "__main__":
+    main()
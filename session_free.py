@@ -0,0 +1,61 @@
+from flask.globals import request_ctx
+from flask.sessions import NullSession, SessionInterface
+from werkzeug.exceptions import HTTPException
+
+
+def session_free(view):
+    """Mark a view as never touching session, so its requests skip loading and saving one.
+
+    The mark survives functools.wraps, so it may sit under other decorators.
+    """
+    view.session_free = True
+    return view
+
+
+class NoSession(NullSession):
+    """Empty, read-only session handed to session-free views."""
+
+    def _fail(self, *args, **kwargs):
+        raise RuntimeError("This endpoint is session-free; remove @session_free to use the session.")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = update = setdefault = _fail
+
+
+class SessionFreeInterface(SessionInterface):
+    """Wraps the app's session interface and skips it for views marked @session_free.
+
+    Flask opens the session before it matches the URL, so the endpoint is
+    matched here first. A NoSession counts as a null session, so Flask does
+    not call save_session for it either: no cookie is decoded, re-signed or
+    set on those responses.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.skipped = 0
+
+    def is_session_free(self, app, request):
+        adapter = request_ctx.url_adapter
+        if adapter is None:
+            return False
+        try:
+            rule, _ = adapter.match(return_rule=True)
+        except HTTPException:
+            return False  # 404, 405 or a redirect; let the normal path produce it
+        view = app.view_functions.get(rule.endpoint)
+        return getattr(view, "session_free", False)
+
+    def open_session(self, app, request):
+        if self.is_session_free(app, request):
+            self.skipped += 1
+            return NoSession()
+        return self.inner.open_session(app, request)
+
+    def save_session(self, app, session, response):
+        self.inner.save_session(app, session, response)
+
+    def make_null_session(self, app):
+        return self.inner.make_null_session(app)
+
+    def is_null_session(self, obj):
+        return self.inner.is_null_session(obj)
@@ -0,0 +1,239 @@
+import math
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SecureCookieSession, SessionInterface
+
+SESSION_FLUSH_INTERVAL = 10  # seconds between writes of batched renewals
+SESSION_GC_INTERVAL = 300  # seconds between sweeps of expired session files
+
+
+class ServerSession(SecureCookieSession):
+    """Session whose data is kept server-side; the cookie only carries sid."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        super().__init__(initial)
+        self.sid = sid
+        self.new = new
+        self.replaces = None  # sid given up by regenerate(), deleted when the session is saved
+
+    def regenerate(self):
+        """Move the session to a fresh sid, e.g. on login, so an id planted before it is worthless."""
+        if not self.new and self.replaces is None:
+            self.replaces = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class SessionStore:
+    """In-memory TTL + LRU cache of sessions in front of a cachelib backend (e.g. FileSystemCache).
+
+    Reads are served from memory and only go to the backend on a miss.
+    Changed sessions are written through at once. A permanent session that
+    is only being renewed is not rewritten on every request: its new expiry
+    is kept in memory and written in a batch by flush(), and only once the
+    stored expiry lags by renew_after seconds, so a client polling every
+    second costs one write per renew_after, not one per request.
+
+    With several worker processes each has its own cache; revalidate_after
+    bounds how long a worker may serve a session another worker changed.
+    """
+
+    def __init__(self, backend, max_entries=4096, renew_after=60, revalidate_after=None):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.renew_after = renew_after
+        self.revalidate_after = revalidate_after
+        self.entries = OrderedDict()  # sid -> [expires_at, stored_expires_at, loaded_at, data], LRU first
+        self.pending = {}  # sid -> (expires_at, data) renewals not written yet
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()  # orders backend writes of one sid between set() and flush()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.renewals = 0
+        self.flushed = 0
+        self.evicted = 0
+        self.collected = 0
+
+    def get(self, sid, now=None):
+        """Return the data of a live session, or None."""
+        now = time.time() if now is None else now
+        with self.lock:
+            entry = self.entries.get(sid)
+            if entry is not None:
+                fresh = self.revalidate_after is None or now - entry[2] < self.revalidate_after
+                if entry[0] > now and fresh:
+                    self.entries.move_to_end(sid)
+                    self.hits += 1
+                    return entry[3]
+                del self.entries[sid]
+            self.misses += 1
+        stored = self.backend.get(sid)
+        if stored is None:
+            return None
+        expires_at, data = stored
+        if expires_at <= now:
+            return None
+        with self.lock:
+            pending = self.pending.get(sid)
+            if pending is not None:
+                expires_at = max(expires_at, pending[0])  # renewed here, not written yet
+            self._cache(sid, [expires_at, stored[0], now, data])
+        return data
+
+    def set(self, sid, data, expires_at, now=None):
+        now = time.time() if now is None else now
+        with self.write_lock:
+            self._write(sid, expires_at, data, now)
+            with self.lock:
+                self.pending.pop(sid, None)
+                self._cache(sid, [expires_at, expires_at, now, data])
+                self.writes += 1
+
+    def renew(self, sid, expires_at):
+        """Extend an unchanged session; the backend sees it on the next flush()."""
+        with self.lock:
+            entry = self.entries.get(sid)
+            if entry is None:
+                return  # evicted since it was read; its stored expiry still covers this request
+            entry[0] = expires_at
+            if sid in self.pending or expires_at - entry[1] >= self.renew_after:
+                if sid not in self.pending:
+                    self.renewals += 1
+                self.pending[sid] = (expires_at, entry[3])
+
+    def delete(self, sid):
+        with self.write_lock:
+            self.backend.delete(sid)
+            with self.lock:
+                self.entries.pop(sid, None)
+                self.pending.pop(sid, None)
+
+    def flush(self, now=None):
+        """Write batched renewals to the backend; returns how many were written."""
+        now = time.time() if now is None else now
+        with self.lock:
+            sids = list(self.pending)
+        written = 0
+        for sid in sids:
+            with self.write_lock:
+                with self.lock:
+                    pending = self.pending.pop(sid, None)  # gone if set() or delete() got there first
+                if pending is None or pending[0] <= now:
+                    continue
+                self._write(sid, pending[0], pending[1], now)
+                with self.lock:
+                    entry = self.entries.get(sid)
+                    if entry is not None:
+                        entry[1] = max(entry[1], pending[0])
+                written += 1
+        with self.lock:
+            self.flushed += written
+        return written
+
+    def collect(self, now=None):
+        """Drop expired sessions from memory and from the backend's files."""
+        now = time.time() if now is None else now
+        with self.lock:
+            expired = [sid for sid, entry in self.entries.items() if entry[0] <= now]
+            for sid in expired:
+                del self.entries[sid]
+        # FileSystemCache only removes expired files once it is over its threshold
+        remove_expired = getattr(self.backend, "_remove_expired", None)
+        if remove_expired is not None:
+            remove_expired(now)
+        with self.lock:
+            self.collected += len(expired)
+
+    def start(self, flush_interval=SESSION_FLUSH_INTERVAL, gc_interval=SESSION_GC_INTERVAL):
+        threading.Thread(target=self._maintain, args=(flush_interval, gc_interval), daemon=True).start()
+
+    def _maintain(self, flush_interval, gc_interval):
+        next_gc = time.monotonic() + gc_interval
+        while True:
+            time.sleep(flush_interval)
+            try:
+                self.flush()
+                if time.monotonic() >= next_gc:
+                    next_gc = time.monotonic() + gc_interval
+                    self.collect()
+            except Exception as e:
+                print("Session maintenance failed:", e)
+
+    def _write(self, sid, expires_at, data, now):
+        # Caller holds self.write_lock
+        self.backend.set(sid, (expires_at, data), timeout=max(1, math.ceil(expires_at - now)))
+
+    def _cache(self, sid, entry):
+        # Caller holds self.lock
+        self.entries[sid] = entry
+        self.entries.move_to_end(sid)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "cached": len(self.entries),
+                "max_entries": self.max_entries,
+                "pending_renewals": len(self.pending),
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "renewals": self.renewals,
+                "flushed": self.flushed,
+                "evicted": self.evicted,
+                "collected": self.collected
+            }
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keeps session data in a SessionStore; the cookie holds a random session id."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        # Unknown or expired ids are never reused, so a client cannot pick its own
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        partitioned = self.get_cookie_partitioned(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+        if session.replaces is not None:
+            self.store.delete(session.replaces)
+        if not session:
+            if session.modified and not session.new:  # cleared, e.g. on logout
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite,
+                                       httponly=httponly, partitioned=partitioned)
+            return
+        if not self.should_set_cookie(app, session):
+            return
+
+        expires = self.get_expiration_time(app, session)  # None for a browser-session cookie
+        expires_at = time.time() + app.permanent_session_lifetime.total_seconds()
+        if session.modified or session.new:
+            self.store.set(session.sid, dict(session), expires_at)
+        else:
+            self.store.renew(session.sid, expires_at)
+        response.set_cookie(name, session.sid, expires=expires, httponly=httponly, domain=domain, path=path,
+                            secure=secure, samesite=samesite, partitioned=partitioned)
@@ -0,0 +1,333 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from timers import ALERT_GRACE, ALERT_MARKS, STALE_SWEEP_BATCH, STALE_TABLE_AFTER, remaining_time, timer_status
+
+OUTBOX_RETENTION = 60  # seconds an event batch stays in the outbox
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tables (
+    table_id TEXT PRIMARY KEY,
+    occupied INTEGER NOT NULL,
+    can_id TEXT,
+    last_activity REAL
+);
+CREATE INDEX IF NOT EXISTS tables_idle ON tables (occupied, last_activity);
+CREATE TABLE IF NOT EXISTS timers (
+    can_id TEXT PRIMARY KEY,
+    table_id TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    alerts_sent TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timers_table ON timers (table_id);
+CREATE INDEX IF NOT EXISTS timers_expiry ON timers (expires_at);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    events TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SqliteTimers:
+    """Timers kept in a shared SQLite file so several worker processes see one state.
+
+    Same interface as timers.Timers. Instead of calling on_events, every
+    mutation writes its events to an outbox table in the same transaction
+    and calls on_commit() once it is durable; the leader's bus.BusHub reads
+    the outbox and pushes the batches to every worker.
+
+    Given a TableSlots, status and occupancy reads are answered from shared
+    memory when it can, and from the database otherwise.
+    """
+
+    def __init__(self, path, import_from=None, idle_after=STALE_TABLE_AFTER, slots=None):
+        self.path = path
+        self.idle_after = idle_after
+        self.slots = slots
+        self.on_commit = None  # called after a transaction that added to the outbox
+        self.reclaimed = 0
+        self.local = threading.local()  # one connection per thread
+        self.db().executescript(SCHEMA)
+        if import_from:
+            self.import_json(import_from)
+
+    def db(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")  # readers never block the writer
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        # IMMEDIATE takes the write lock up front, so read-modify-write cannot interleave
+        db = self.db()
+        self.local.enqueued = False
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        if self.local.enqueued and self.on_commit is not None:
+            self.on_commit()
+
+    def import_json(self, filepath):
+        # First worker to start moves the single-process state file into the store
+        if not os.path.exists(filepath):
+            return
+        with self.transaction() as db:
+            if db.execute("SELECT 1 FROM settings WHERE key = 'imported'").fetchone():
+                return
+            with open(filepath, "r") as file:
+                data = json.load(file)
+            now = time.time()
+            for table_id, table in data.get("tables", {}).items():
+                db.execute("INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?)",
+                           (table_id, int(table["occupied"]), table["can_id"], table.get("last_activity", now)))
+            for can_id, timer_data in data.get("timers", {}).items():
+                expires_at = timer_data.get("expires_at", now + timer_data.get("remaining_time", 0))
+                db.execute("INSERT OR REPLACE INTO timers VALUES (?, ?, ?, ?)",
+                           (can_id, timer_data["table_id"], expires_at, json.dumps(timer_data["alerts_sent"])))
+            db.execute("INSERT INTO settings VALUES ('imported', '1')")
+
+    @property
+    def default_duration(self):
+        row = self.db().execute("SELECT value FROM settings WHERE key = 'default_duration'").fetchone()
+        return int(row[0]) if row else 900  # Default timer duration: 15 minutes
+
+    @default_duration.setter
+    def default_duration(self, duration):
+        with self.transaction() as db:
+            db.execute("INSERT OR REPLACE INTO settings VALUES ('default_duration', ?)", (str(duration),))
+
+    # Outbox
+    def enqueue(self, events, db=None):
+        """Add an event batch to the outbox, inside the caller's transaction if given."""
+        if not events:
+            return
+        if db is None:
+            with self.transaction() as db:
+                self.enqueue(events, db)
+            return
+        db.execute("INSERT INTO outbox (created_at, events) VALUES (?, ?)", (time.time(), json.dumps(events)))
+        self.local.enqueued = True
+
+    def read_outbox(self, after_id, until=None):
+        """Committed batches with after_id < id <= until, oldest first, as [outbox_id, events] pairs."""
+        rows = self.db().execute("SELECT id, events FROM outbox WHERE id > ? AND id <= ? ORDER BY id",
+                                 (after_id, until if until is not None else 2 ** 63 - 1)).fetchall()
+        return [[row_id, json.loads(events)] for row_id, events in rows]
+
+    # Reads
+    def _table(self, db, table_id):
+        row = db.execute("SELECT occupied, can_id FROM tables WHERE table_id = ?", (table_id,)).fetchone()
+        return {"occupied": bool(row[0]), "can_id": row[1]} if row else None
+
+    def _timer(self, db, can_id):
+        row = db.execute("SELECT table_id, expires_at, alerts_sent FROM timers WHERE can_id = ?", (can_id,)).fetchone()
+        if row is None:
+            return None
+        return {"table_id": row[0], "expires_at": row[1], "alerts_sent": json.loads(row[2])}
+
+    def _holder(self, db, table_id):
+        row = db.execute(
+            "SELECT t.can_id FROM tables t JOIN timers m ON m.can_id = t.can_id AND m.table_id = t.table_id"
+            " WHERE t.table_id = ?", (table_id,)).fetchone()
+        return row[0] if row else None
+
+    def _table_state(self, db, table_id, now):
+        table = self._table(db, table_id) or {"occupied": False, "can_id": None}
+        can_id = self._holder(db, table_id)
+        return {
+            "table_id": table_id,
+            "occupied": table["occupied"],
+            "can_id": table["can_id"],
+            "timer": timer_status(self._timer(db, can_id), now, self._active(db)) if can_id else None
+        }
+
+    def _active(self, db):
+        return db.execute("SELECT COUNT(*) FROM timers").fetchone()[0]
+
+    def active_timers(self):
+        return self._active(self.db())
+
+    def get_timer_status(self, can_id):
+        now = time.time()
+        if self.slots is not None:
+            timer = self.slots.timer_status(can_id, now)
+            if timer is not None:
+                return timer
+        db = self.db()
+        timer_data = self._timer(db, can_id)
+        if timer_data is None:
+            return None
+        return timer_status(timer_data, now, self._active(db))
+
+    def get_table_state(self, table_id):
+        now = time.time()
+        if self.slots is not None:
+            state = self.slots.table_state(table_id, now)
+            if state is not None:
+                return state
+        return self._table_state(self.db(), table_id, now)
+
+    def count_occupied_tables(self):
+        if self.slots is not None:
+            count = self.slots.count_occupied(time.time())
+            if count is not None:
+                return count
+        return self.db().execute("SELECT COUNT(*) FROM tables WHERE occupied = 1").fetchone()[0]
+
+    def dump_tables(self):
+        """Every table's state plus the outbox id it is current as of, read in one snapshot."""
+        db = self.db()
+        now = time.time()
+        db.execute("BEGIN")
+        try:
+            outbox_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM outbox").fetchone()[0]
+            table_ids = [row[0] for row in db.execute("SELECT table_id FROM tables")]
+            states = [self._table_state(db, table_id, now) for table_id in table_ids]
+        finally:
+            db.execute("COMMIT")
+        return states, outbox_id
+
+    # Writes
+    def _start(self, db, can_id, table_id, now):
+        # can_id is the timers key, so a card's timer elsewhere is replaced
+        db.execute("INSERT OR REPLACE INTO timers VALUES (?, ?, ?, '[]')",
+                   (can_id, table_id, now + self.default_duration))
+        db.execute("INSERT OR REPLACE INTO tables VALUES (?, 1, ?, ?)", (table_id, can_id, now))
+
+    def _release(self, db, table_id):
+        can_id = self._holder(db, table_id)
+        if can_id is not None:
+            db.execute("DELETE FROM timers WHERE can_id = ?", (can_id,))
+        db.execute("UPDATE tables SET occupied = 0, can_id = NULL WHERE table_id = ?", (table_id,))
+
+    def start_timer(self, can_id, table_id):
+        now = time.time()
+        with self.transaction() as db:
+            self._start(db, can_id, table_id, now)
+            state = self._table_state(db, table_id, now)
+            self.enqueue([("table_state", state)], db)
+        return state["timer"]
+
+    def end_timer(self, can_id):
+        now = time.time()
+        with self.transaction() as db:
+            timer_data = self._timer(db, can_id)
+            if timer_data is None:
+                return False
+            table_id = timer_data["table_id"]
+            db.execute("DELETE FROM timers WHERE can_id = ?", (can_id,))
+            # Table remains occupied
+            db.execute("UPDATE tables SET occupied = 1, last_activity = ? WHERE table_id = ?", (now, table_id))
+            self.enqueue([("table_state", self._table_state(db, table_id, now))], db)
+        return True
+
+    def set_table_vacant(self, table_id):
+        now = time.time()
+        with self.transaction() as db:
+            table = self._table(db, table_id)
+            if table is None or not table["occupied"]:
+                return False
+            db.execute("UPDATE tables SET occupied = 0, can_id = NULL WHERE table_id = ?", (table_id,))
+            self.enqueue([("table_state", self._table_state(db, table_id, now))], db)
+        return True
+
+    def chope_table(self, table_id, can_id):
+        now = time.time()
+        with self.transaction() as db:
+            if self._holder(db, table_id) in (None, can_id):
+                self._start(db, can_id, table_id, now)
+                state = self._table_state(db, table_id, now)
+                self.enqueue([("table_state", state)], db)
+            else:
+                state = self._table_state(db, table_id, now)
+        return state
+
+    def release_table(self, table_id, can_id=None):
+        now = time.time()
+        with self.transaction() as db:
+            if self._table(db, table_id) is None or (can_id is not None and self._holder(db, table_id) != can_id):
+                return None
+            self._release(db, table_id)
+            state = self._table_state(db, table_id, now)
+            self.enqueue([("table_state", state)], db)
+        return state
+
+    def tap_card(self, table_id, can_id):
+        now = time.time()
+        with self.transaction() as db:
+            current = self._holder(db, table_id)
+            if current is None:
+                action = "choped"
+                self._start(db, can_id, table_id, now)
+            elif current == can_id:
+                action = "released"
+                self._release(db, table_id)
+            else:
+                return "clash", self._table_state(db, table_id, now)
+            state = self._table_state(db, table_id, now)
+            self.enqueue([("table_state", state)], db)
+        return action, state
+
+    # Leader-only work
+    def decrement_timers(self):
+        # Only timers close enough to an alert mark or expiry need looking at
+        now = time.time()
+        events = []
+        with self.transaction() as db:
+            rows = db.execute("SELECT can_id, table_id, expires_at, alerts_sent FROM timers WHERE expires_at <= ?",
+                              (now + max(ALERT_MARKS) + 1,)).fetchall()
+            for can_id, table_id, expires_at, alerts_sent in rows:
+                alerts_sent = json.loads(alerts_sent)
+                remaining = remaining_time({"expires_at": expires_at}, now)
+                fired = False
+                for mark in ALERT_MARKS:
+                    if remaining <= mark < remaining + ALERT_GRACE and mark not in alerts_sent:
+                        events.append(("timer_alert", {"can_id": can_id, "table_id": table_id, "remaining_time": mark}))
+                        alerts_sent.append(mark)
+                        fired = True
+                if remaining <= 0:
+                    events.append(("timer_ended", {"can_id": can_id, "table_id": table_id}))
+                    db.execute("DELETE FROM timers WHERE can_id = ?", (can_id,))
+                    db.execute("UPDATE tables SET last_activity = ? WHERE table_id = ?", (now, table_id))
+                elif fired:
+                    db.execute("UPDATE timers SET alerts_sent = ? WHERE can_id = ?", (json.dumps(alerts_sent), can_id))
+            self.enqueue(events, db)
+            db.execute("DELETE FROM outbox WHERE created_at < ?", (now - OUTBOX_RETENTION,))
+
+    def sweep_stale(self, now, limit=STALE_SWEEP_BATCH):
+        # The (occupied, last_activity) index means only idle tables are visited
+        with self.transaction() as db:
+            rows = db.execute(
+                "SELECT table_id FROM tables WHERE occupied = 1 AND last_activity <= ?"
+                " AND table_id NOT IN (SELECT table_id FROM timers) LIMIT ?",
+                (now - self.idle_after, limit)).fetchall()
+            events = []
+            for (table_id,) in rows:
+                db.execute("UPDATE tables SET occupied = 0, can_id = NULL WHERE table_id = ?", (table_id,))
+                events.append(("table_state", self._table_state(db, table_id, now)))
+            self.enqueue(events, db)
+        self.reclaimed += len(events)
+        return len(events)
+
+    def sweeper_stats(self):
+        queued = self.db().execute(
+            "SELECT COUNT(*) FROM tables WHERE occupied = 1 AND table_id NOT IN (SELECT table_id FROM timers)"
+        ).fetchone()[0]
+        return {"reclaimed": self.reclaimed, "idle_after": self.idle_after, "queued": queued}
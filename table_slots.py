@@ -0,0 +1,347 @@
+import atexit
+import hashlib
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+from timers import ALERT_MARKS, timer_status
+
+TABLE_SLOTS_NAME = "wanton_table_slots"
+TABLE_SLOTS = 1024  # fixed capacity; tables beyond it are served from the store
+SLOTS_STALE_AFTER = 5  # seconds without a leader heartbeat before readers stop trusting the mapping
+SEQLOCK_RETRIES = 1000  # reads of a record mid-write before a reader gives up and uses the store
+WRITE_LOG = 4096  # slot indexes of the latest writes, so readers re-read only what changed
+
+SLOTS_MAGIC = 0x57544E33
+# magic, capacity, used, occupied, active timers, writes, leader heartbeat, tables left without a slot, seq
+HEADER = struct.Struct("<IIIIIIdII")
+HEADER_SEQ = HEADER.size - 4
+# seq, state, alerts mask, version, deadline, can_id hash, table_id, can_id
+SLOT = struct.Struct("<IBBxxQdQ32s32s")
+SEQ = struct.Struct("<I")
+LOG_ENTRY = struct.Struct("<I")
+
+VACANT, OCCUPIED, TIMING, UNPUBLISHED = 0, 1, 2, 255
+
+
+class RecordBusy(Exception):
+    """A slot's sequence number stayed odd: a write is in progress, or its writer died mid-write."""
+
+
+def can_hash(can_id):
+    return int.from_bytes(hashlib.blake2b(can_id.encode(), digest_size=8).digest(), "little")
+
+
+class TableSlots:
+    """Table state published by the timer leader into a fixed-record shared-memory array.
+
+    Only the leader writes (under a local lock); every write bumps the slot's
+    sequence number to odd, fills the record and bumps it back to even, so
+    readers in any worker copy a record and retry if the sequence moved.
+    The header has its own sequence number, used the same way. A slot's
+    version is the outbox id of the change it holds, which keeps late or
+    replayed events from overwriting newer state.
+
+    Write n also stores its slot index at n % WRITE_LOG in a ring after the
+    records. A reader looking up a card it has not indexed re-reads only the
+    slots written since its last lookup, and rescans the whole array only
+    when it has fallen more than WRITE_LOG writes behind.
+    """
+
+    def __init__(self, name=TABLE_SLOTS_NAME, capacity=TABLE_SLOTS):
+        self.name = name
+        self.capacity = capacity
+        self.shm = None
+        self.writer = False
+        self.lock = threading.Lock()  # leader side: serialises writers
+        self.table_index = {}  # table_id -> slot, both sides; slots are never reassigned
+        self.indexed = 0  # reader side: slots already in table_index
+        self.card_index = {}  # can_id hash -> slot, reader side
+        self.slot_cards = {}  # slot -> can_id hash in card_index, to drop it when the slot changes
+        self.card_index_writes = None  # header writes counter card_index is up to date with
+        self.fallbacks = 0
+        self.overflowed = set()  # leader side: tables that found the array full
+
+    @property
+    def size(self):
+        return self.log_offset + WRITE_LOG * LOG_ENTRY.size
+
+    @property
+    def log_offset(self):
+        return HEADER.size + self.capacity * SLOT.size
+
+    # Leader side
+    def create(self):
+        """Map the array for writing and clear it; called once by the process that wins the election."""
+        with self.lock:
+            try:
+                self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=self.size)
+            except FileExistsError:
+                # Left behind by a leader that was killed before it could unlink
+                self.shm = shared_memory.SharedMemory(name=self.name)
+            atexit.register(self.shm.unlink)
+            self.shm.buf[:self.size] = bytes(self.size)
+            self.table_index = {}
+            self.writer = True
+            HEADER.pack_into(self.shm.buf, 0, SLOTS_MAGIC, self.capacity, 0, 0, 0, 0, time.time(), 0, 0)
+            self.overflowed = set()
+
+    def heartbeat(self, now):
+        with self.lock:
+            self._set_header(heartbeat=now)
+
+    def load(self, states, version):
+        """Publish every table from a store snapshot taken at outbox id version."""
+        with self.lock:
+            for state in states:
+                self._publish(state, version)
+
+    def apply(self, events, version):
+        """Publish a committed outbox batch."""
+        with self.lock:
+            for event, payload in events:
+                if event == "table_state":
+                    self._publish(payload, version)
+                elif event == "timer_alert":
+                    self._alert(payload, version)
+                elif event == "timer_ended":
+                    self._ended(payload, version)
+
+    def _publish(self, state, version):
+        index = self.table_index.get(state["table_id"])
+        new = index is None
+        if new:
+            index = len(self.table_index)
+            if index == self.capacity:
+                # Readers get these tables from the store; the header count tells them counts are partial
+                if state["table_id"] not in self.overflowed:
+                    if not self.overflowed:
+                        print(f"Table slots full ({self.capacity}); {state['table_id']} and later new tables are read from the store")
+                    self.overflowed.add(state["table_id"])
+                    self._set_header(overflow=len(self.overflowed))
+                return
+        elif self._read(index)[3] > version:
+            return  # already holds a newer change
+        table_id = state["table_id"].encode()
+        can_id = (state["can_id"] or "").encode()
+        timer = state["timer"]
+        if len(table_id) > 32 or len(can_id) > 32:
+            self._write(index, UNPUBLISHED, 0, version, 0.0, 0, table_id[:32], b"")
+        elif timer:
+            alerts = sum(1 << i for i, mark in enumerate(ALERT_MARKS) if mark in timer["alerts_sent"])
+            self._write(index, TIMING, alerts, version, timer["expires_at"], can_hash(state["can_id"]), table_id, can_id)
+        else:
+            self._write(index, OCCUPIED if state["occupied"] else VACANT, 0, version, 0.0, 0, table_id, can_id)
+        if new:
+            self.table_index[state["table_id"]] = index
+
+    def _alert(self, payload, version):
+        index = self.table_index.get(payload["table_id"])
+        if index is None:
+            return
+        record = list(self._read(index))
+        if record[1] != TIMING or record[3] > version or record[5] != can_hash(payload["can_id"]):
+            return
+        record[2] |= 1 << ALERT_MARKS.index(payload["remaining_time"])
+        record[3] = version
+        self._write(index, *record[1:])
+
+    def _ended(self, payload, version):
+        # The table stays occupied by the card until someone vacates it
+        index = self.table_index.get(payload["table_id"])
+        if index is None:
+            return
+        record = self._read(index)
+        if record[1] != TIMING or record[3] > version or record[5] != can_hash(payload["can_id"]):
+            return
+        self._write(index, OCCUPIED, 0, version, 0.0, 0, record[6], record[7])
+
+    def _write(self, index, state, alerts, version, deadline, card, table_id, can_id):
+        buf = self.shm.buf
+        offset = HEADER.size + index * SLOT.size
+        # Only this thread writes, so the current record can be read without retrying
+        seq, old_state = SLOT.unpack_from(buf, offset)[:2]
+        SEQ.pack_into(buf, offset, seq + 1)
+        SLOT.pack_into(buf, offset, seq + 1, state, alerts, version, deadline, card, table_id, can_id)
+        SEQ.pack_into(buf, offset, (seq + 2) & 0xFFFFFFFF)
+        _, _, used, occupied, active, writes, _, _, _ = HEADER.unpack_from(buf, 0)
+        occupied += (state in (OCCUPIED, TIMING)) - (old_state in (OCCUPIED, TIMING))
+        active += (state == TIMING) - (old_state == TIMING)
+        # The log entry goes in before the counter that makes readers look at it
+        LOG_ENTRY.pack_into(buf, self.log_offset + writes % WRITE_LOG * LOG_ENTRY.size, index)
+        # A new slot is counted in the same header update as its first write, once its table_id is in place,
+        # so readers never index a blank record nor see the write without the slot
+        self._set_header(used=max(used, index + 1), occupied=occupied, active=active,
+                         writes=(writes + 1) & 0xFFFFFFFF)
+
+    def _set_header(self, **fields):
+        buf = self.shm.buf
+        magic, capacity, used, occupied, active, writes, heartbeat, overflow, seq = HEADER.unpack_from(buf, 0)
+        values = {"used": used, "occupied": occupied, "active": active, "writes": writes, "heartbeat": heartbeat,
+                  "overflow": overflow}
+        values.update(fields)
+        SEQ.pack_into(buf, HEADER_SEQ, seq + 1)
+        HEADER.pack_into(buf, 0, magic, capacity, values["used"], values["occupied"], values["active"],
+                         values["writes"], values["heartbeat"], values["overflow"], seq + 1)
+        SEQ.pack_into(buf, HEADER_SEQ, (seq + 2) & 0xFFFFFFFE)
+
+    # Reader side
+    def _attach(self, now):
+        # Readers map lazily and remap when the leader changes (the old mapping stops beating)
+        if self.shm is not None and not self.writer:
+            if now - self._header()[6] <= SLOTS_STALE_AFTER:
+                return True
+            self.shm.close()
+            self.shm = None
+            self.table_index = {}
+            self.indexed = 0
+            self.card_index, self.slot_cards, self.card_index_writes = {}, {}, None
+        if self.shm is None:
+            try:
+                shm = shared_memory.SharedMemory(name=self.name)
+            except FileNotFoundError:
+                return False
+            # Attaching registers the segment with this process's tracker, which would unlink it on exit
+            resource_tracker.unregister(shm._name, "shared_memory")
+            self.shm = shm
+        if HEADER.unpack_from(self.shm.buf, 0)[0] != SLOTS_MAGIC:
+            return False  # another layout, or not initialised yet
+        return now - self._header()[6] <= SLOTS_STALE_AFTER
+
+    def _header(self):
+        buf = self.shm.buf
+        for _ in range(SEQLOCK_RETRIES):
+            header = HEADER.unpack_from(buf, 0)
+            if not header[8] & 1 and SEQ.unpack_from(buf, HEADER_SEQ)[0] == header[8]:
+                return header
+        raise RecordBusy("header")
+
+    def _read(self, index):
+        buf = self.shm.buf
+        offset = HEADER.size + index * SLOT.size
+        for _ in range(SEQLOCK_RETRIES):
+            record = SLOT.unpack_from(buf, offset)
+            if not record[0] & 1 and SEQ.unpack_from(buf, offset)[0] == record[0]:
+                return record
+        raise RecordBusy(index)
+
+    def _find_table(self, table_id):
+        index = self.table_index.get(table_id)
+        if index is None and not self.writer:
+            used = self._header()[2]
+            for index in range(self.indexed, used):
+                self.table_index[self._read(index)[6].rstrip(b"\0").decode()] = index
+            self.indexed = max(self.indexed, used)
+            index = self.table_index.get(table_id)
+        return index
+
+    def _find_card(self, card):
+        index = self.card_index.get(card)
+        if index is not None:
+            record = self._read(index)
+            if record[1] == TIMING and record[5] == card:
+                return record
+        self._index_cards()
+        index = self.card_index.get(card)
+        return self._read(index) if index is not None else None
+
+    def _index_cards(self):
+        # Bring card_index up to date with the slots written since it was last updated
+        _, _, used, _, _, writes, _, _, _ = self._header()
+        if writes == self.card_index_writes:
+            return
+        changed = None
+        if self.card_index_writes is not None and (writes - self.card_index_writes) % 2 ** 32 <= WRITE_LOG:
+            changed = self._written(self.card_index_writes, writes)
+        if changed is None:
+            self.card_index, self.slot_cards = {}, {}
+            changed = range(used)
+        for index in changed:
+            if index >= used:
+                continue  # a torn log entry; the record check on lookup keeps this harmless
+            record = self._read(index)
+            old = self.slot_cards.pop(index, None)
+            if old is not None and self.card_index.get(old) == index:
+                del self.card_index[old]
+            if record[1] == TIMING:
+                self.card_index[record[5]] = index
+                self.slot_cards[index] = record[5]
+        self.card_index_writes = writes
+
+    def _written(self, start, end):
+        """Slots written by writes start..end-1, or None if the log has already moved past start."""
+        buf = self.shm.buf
+        count = (end - start) % 2 ** 32
+        slots = {LOG_ENTRY.unpack_from(buf, self.log_offset + (start + n) % WRITE_LOG * LOG_ENTRY.size)[0]
+                 for n in range(count)}
+        if (self._header()[5] - start) % 2 ** 32 > WRITE_LOG:
+            return None  # the leader wrapped around while these were read
+        return slots
+
+    def _timer(self, record, now, active):
+        timer_data = {
+            "table_id": record[6].rstrip(b"\0").decode(),
+            "expires_at": record[4],
+            "alerts_sent": [mark for i, mark in enumerate(ALERT_MARKS) if record[2] & 1 << i]
+        }
+        return timer_status(timer_data, now, active)
+
+    def timer_status(self, can_id, now):
+        """Status of can_id's running timer, or None if the mapping cannot answer."""
+        try:
+            if not self._attach(now):
+                return None
+            record = self._find_card(can_hash(can_id))
+            if record is not None and record[7].rstrip(b"\0").decode() == can_id:
+                return self._timer(record, now, self._header()[4])
+        except RecordBusy:
+            pass
+        self.fallbacks += 1
+        return None
+
+    def table_state(self, table_id, now):
+        """Same shape as Timers.get_table_state, or None if the mapping cannot answer."""
+        try:
+            if not self._attach(now):
+                return None
+            index = self._find_table(table_id)
+            record = self._read(index) if index is not None else None
+            if record is not None and record[1] != UNPUBLISHED:
+                can_id = record[7].rstrip(b"\0").decode() or None
+                return {
+                    "table_id": table_id,
+                    "occupied": record[1] in (OCCUPIED, TIMING),
+                    "can_id": can_id,
+                    "timer": self._timer(record, now, self._header()[4]) if record[1] == TIMING else None
+                }
+        except RecordBusy:
+            pass
+        self.fallbacks += 1
+        return None
+
+    def count_occupied(self, now):
+        """Occupied tables, or None if the mapping cannot answer (e.g. some tables have no slot)."""
+        try:
+            if not self._attach(now):
+                return None
+            header = self._header()
+            if not header[7]:
+                return header[3]
+        except RecordBusy:
+            pass
+        self.fallbacks += 1
+        return None
+
+    def stats(self):
+        # Diagnostics only, so a header caught mid-write is shown as it is rather than retried
+        header = HEADER.unpack_from(self.shm.buf, 0) if self.shm is not None else None
+        return {
+            "attached": header is not None,
+            "writer": self.writer,
+            "capacity": self.capacity,
+            "used": header[2] if header else 0,
+            "overflow": header[7] if header else 0,
+            "heartbeat_age": time.time() - header[6] if header else None,
+            "fallbacks": self.fallbacks
+        }
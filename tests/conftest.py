@@ -0,0 +1,37 @@
+import itertools
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+HTTPS = "https://localhost"  # SESSION_COOKIE_SECURE: the test client only sends the cookie back over https
+client_addresses = (f"10.0.{n // 250}.{n % 250 + 1}" for n in itertools.count())
+
+
+@pytest.fixture(scope="session")
+def backend(tmp_path_factory):
+    # app.py keeps its state under ./data, so import it from a scratch directory
+    workdir = tmp_path_factory.mktemp("backend")
+    os.makedirs(workdir / "data")
+    os.chdir(workdir)
+    import app
+    app.background_started = True  # no timer thread; tests call timers directly
+    return app
+
+
+@pytest.fixture
+def client(backend):
+    # A fresh address per test keeps the per-IP rate limit from carrying over between tests
+    client = backend.app.test_client()
+    client.environ_base["REMOTE_ADDR"] = next(client_addresses)
+    return client
+
+
+@pytest.fixture
+def admin(backend):
+    client = backend.app.test_client()
+    client.environ_base["REMOTE_ADDR"] = next(client_addresses)
+    client.post("/login", json={"is_admin": True, "password": "admin"}, base_url=HTTPS)
+    return client
@@ -0,0 +1,46 @@
+import threading
+
+from admission import AdmissionControl
+
+
+def test_device_polls_are_not_in_the_read_class(backend):
+    for endpoint in ("get_timer_status", "device_heartbeat"):
+        route_class = backend.admission.classes[backend.ADMISSION_ROUTES[endpoint]]
+        assert route_class.name != "read"
+        assert route_class.priority > backend.admission.classes["read"].priority
+
+
+def test_a_read_burst_sheds_reads_before_device_polls(backend):
+    admission = AdmissionControl(capacity=2, classes=backend.ADMISSION_CLASSES)
+    assert admission.admit("read") and admission.admit("read")  # every slot taken by the dashboard
+    assert not admission.admit("read")  # the next read waits its 0.1s and is shed
+
+    admitted = []
+    poll = threading.Thread(target=lambda: admitted.append(admission.admit("device_poll")))
+    poll.start()
+    admission.release("read")  # the freed slot goes to the queued poll
+    poll.join(5)
+    assert admitted == [True]
+    assert admission.stats()["classes"]["device_poll"]["shed"] == 0
+
+
+def test_device_poll_is_shed_with_retry_after(client, backend, monkeypatch):
+    monkeypatch.setattr(backend.admission, "admit", lambda name: False)
+    response = client.get("/get_timer_status/CAN-1")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_route_tables_name_real_endpoints(backend):
+    endpoints = set(backend.app.view_functions)
+    assert set(backend.ADMISSION_ROUTES) <= endpoints
+    assert set(backend.RATE_LIMITS) <= endpoints
+
+
+def test_metrics_scrape_is_served_while_default_is_saturated(client, backend, monkeypatch):
+    refused = []
+    monkeypatch.setattr(backend.admission, "admit", lambda name: refused.append(name) or False)
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert refused == []
+    assert client.get("/count_occupied_tables").status_code == 503
@@ -0,0 +1,48 @@
+import time
+
+import pytest
+
+from bus import BusClient, BusHub
+from sqlite_timers import SqliteTimers
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def hub(tmp_path):
+    timers = SqliteTimers(str(tmp_path / "timers.db"))
+    hub = BusHub(str(tmp_path / "bus.sock"), timers)
+    timers.on_commit = hub.wake
+    hub.start(cursor=0)
+    return hub
+
+
+def test_worker_gets_each_batch_in_order(hub):
+    received = []
+    client = BusClient(hub.path, received.append)
+    client.start()
+    wait_for(lambda: hub.stats()["subscribers"] == 1)
+    hub.timers.chope_table("B1", "card-a")
+    hub.timers.release_table("B1")
+    wait_for(lambda: len(received) == 2)
+    assert [events[0][1]["occupied"] for events in received] == [True, False]
+
+
+def test_reconnecting_worker_replays_what_it_missed(hub):
+    hub.timers.chope_table("B2", "card-a")
+    hub.timers.chope_table("B3", "card-b")
+    (first_id, _), (last_id, _) = hub.timers.read_outbox(0)
+    wait_for(lambda: hub.stats()["cursor"] == last_id)  # pushed while nobody was listening
+
+    received = []
+    client = BusClient(hub.path, received.append)
+    client.cursor = first_id  # handled the first batch before its connection dropped
+    client.start()
+    wait_for(lambda: len(received) == 1)
+    assert received[0][0][1]["table_id"] == "B3"
+    assert hub.stats()["replayed"] == 1
@@ -0,0 +1,37 @@
+from device_registry import DeviceRegistry
+
+
+def test_only_devices_with_a_verified_token_are_tracked(client, backend):
+    client.post("/device/DR-ANON/heartbeat")
+    assert "DR-ANON" not in backend.device_registry.devices
+
+    token = backend.device_tokens.issue("DR-1")[0]
+    assert client.post("/device/DR-1/heartbeat", headers={"X-Device-Token": token}).status_code == 200
+    assert "DR-1" in backend.device_registry.devices
+
+
+def test_device_goes_offline_and_comes_back():
+    changes = []
+    registry = DeviceRegistry(offline_after=90, on_change=lambda event, payload: changes.append(event))
+    registry.seen("T1", 1000)
+    assert registry.expire(1089) == 0
+    assert registry.expire(1090) == 1
+    assert [device["table_id"] for device in registry.unhealthy(1100)] == ["T1"]
+    registry.seen("T1", 1100)
+    assert changes == ["device_offline", "device_online"]
+    assert registry.unhealthy(1100) == []
+
+
+def test_registry_is_capped_and_forgets_long_offline_devices():
+    registry = DeviceRegistry(offline_after=10, max_devices=2, forget_after=100)
+    for table_id in ("A", "B", "C"):
+        registry.seen(table_id, 0)
+    assert set(registry.devices) == {"A", "B"}
+    assert registry.stats()["dropped"] == 1
+
+    registry.expire(10)
+    assert registry.stats()["offline"] == 2
+    registry.expire(100)
+    assert registry.devices == {} and registry.stats()["forgotten"] == 2
+    registry.seen("C", 101)
+    assert set(registry.devices) == {"C"}
@@ -0,0 +1,46 @@
+def test_chope_rejects_a_body_that_is_not_an_object(client):
+    for body in ("[]", '"K1"', "1", "not json"):
+        response = client.post("/device/K1/chope", data=body, content_type="application/json")
+        assert response.status_code == 400
+        assert response.json["error"]
+
+
+def test_chope_then_release(client):
+    response = client.post("/device/K2/chope", json={"can_id": "card-k2"})
+    assert response.status_code == 200
+    assert response.json["can_id"] == "card-k2"
+    assert client.post("/device/K2/release").status_code == 200
+
+
+def test_retried_chope_with_the_same_key_is_replayed(client):
+    headers = {"Idempotency-Key": "K3-retry"}
+    first = client.post("/device/K3/chope", json={"can_id": "card-k3"}, headers=headers)
+    retry = client.post("/device/K3/chope", json={"can_id": "card-k3"}, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json == first.json
+
+
+def test_in_progress_idempotency_conflict_says_retry(backend, client):
+    key = "POST /device/K4/chope K4-busy"
+    assert backend.idempotency.begin(key)[0] != backend.IdempotencyCache.HIT
+    response = client.post("/device/K4/chope", json={"can_id": "card-k4"}, headers={"Idempotency-Key": "K4-busy"})
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "1"
+    backend.idempotency.release(key)
+
+
+def test_chope_rejects_a_card_id_that_is_not_a_string(client):
+    for can_id in (["x"], {"a": 1}, 7, ""):
+        response = client.post("/device/K5/chope", json={"can_id": can_id})
+        assert response.status_code == 400
+
+
+def test_legacy_writes_reject_bad_bodies(client):
+    for body in ("[]", '"K6"', "not json"):
+        for path in ("/start_timer", "/set_table_vacant"):
+            response = client.post(path, data=body, content_type="application/json")
+            assert response.status_code == 400
+    assert client.post("/start_timer", json={"can_id": ["x"], "table_id": "K6"}).status_code == 400
+    assert client.post("/start_timer", json={"can_id": "card-k6", "table_id": {"a": 1}}).status_code == 400
+    assert client.post("/set_table_vacant", json={"table_id": ["K6"]}).status_code == 400
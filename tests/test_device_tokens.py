@@ -0,0 +1,83 @@
+import pytest
+
+from conftest import HTTPS
+from device_tokens import GATEWAY_TABLE
+
+
+@pytest.fixture
+def tokens_required(backend, monkeypatch):
+    monkeypatch.setattr(backend, "DEVICE_TOKEN_REQUIRED", True)
+
+
+def token_for(backend, table_id):
+    return {"X-Device-Token": backend.device_tokens.issue(table_id)[0]}
+
+
+def test_revoked_token_is_rejected(backend):
+    token, token_id = backend.device_tokens.issue("R1")
+    assert backend.device_tokens.verify(token) == "R1"
+    backend.device_tokens.revoke(token_id, persist=False)
+    assert backend.device_tokens.verify(token) is None
+    assert backend.device_tokens.verify(token + "x") is None
+
+
+def test_token_only_opens_its_own_table(client, backend, tokens_required):
+    headers = token_for(backend, "TA")
+    assert client.post("/device/TB/chope", json={"can_id": "card-tb"}, headers=headers).status_code == 401
+    assert client.post("/device/TA/chope", json={"can_id": "card-ta"}, headers=headers).status_code == 200
+    client.post("/device/TA/release", headers=headers)
+
+
+def test_legacy_routes_need_a_token_for_the_table(client, backend, tokens_required):
+    body = {"can_id": "card-legacy", "table_id": "LB"}
+    assert client.post("/start_timer", json=body).status_code == 401
+    assert client.post("/set_table_vacant", json={"table_id": "LB"}).status_code == 401
+    assert client.post("/end_timer/card-legacy").status_code == 401
+
+    other = token_for(backend, "LA")
+    assert client.post("/start_timer", json=body, headers=other).status_code == 403
+    assert client.post("/set_table_vacant", json={"table_id": "LB"}, headers=other).status_code == 403
+
+    own = token_for(backend, "LB")
+    assert client.post("/start_timer", json=body, headers=own).status_code == 200
+    assert client.post("/end_timer/card-legacy", headers=other).status_code == 404
+    assert client.get("/get_timer_status/card-legacy", headers=other).status_code == 404
+    assert client.get("/get_timer_status/card-legacy", headers=own).status_code == 200
+    assert client.post("/end_timer/card-legacy", headers=own).status_code == 200
+
+
+def test_table_token_cannot_send_events_for_another_table(client, backend, tokens_required):
+    headers = token_for(backend, "EA")
+    event = {"type": "pir_high", "ts": 1}
+    assert client.post("/ingest/events", json={"table_id": "EB", "events": [event]},
+                       headers=headers).status_code == 403
+    assert client.post("/ingest/events", json={"table_id": "EA", "events": [{**event, "table_id": "EB"}]},
+                       headers=headers).status_code == 403
+    assert client.post("/ingest/events", json=[{**event, "table_id": "EB"}], headers=headers).status_code == 403
+
+    response = client.post("/ingest/events", json=[event], headers=headers)
+    assert response.status_code == 200
+    assert response.json["accepted"] == 1
+    assert backend.event_log.since(response.json["cursor"] - 1)[-1]["table_id"] == "EA"
+
+
+def test_gateway_token_may_mix_tables(client, backend, tokens_required):
+    headers = token_for(backend, GATEWAY_TABLE)
+    events = [{"type": "pir_high", "ts": 1, "table_id": "GA"}, {"type": "pir_low", "ts": 2, "table_id": "GB"}]
+    response = client.post("/ingest/events", json=events, headers=headers)
+    assert response.status_code == 200
+    assert response.json["accepted"] == 2
+    assert client.post("/device/GA/chope", json={"can_id": "card-ga"}, headers=headers).status_code == 401
+
+
+def test_gateway_tokens_are_issued_explicitly(admin):
+    assert admin.post("/admin/device_tokens", json={"table_id": GATEWAY_TABLE}, base_url=HTTPS).status_code == 400
+    response = admin.post("/admin/device_tokens", json={"gateway": True}, base_url=HTTPS)
+    assert response.status_code == 201
+    assert response.json["table_id"] == GATEWAY_TABLE
+
+
+def test_pir_frame_is_recorded_for_the_sockets_table(backend):
+    cursor = backend.event_log.stats()["cursor"]
+    assert backend.handle_device_frame("WA", '{"type": "pir", "state": "high", "table_id": "WB"}') is None
+    assert [event["table_id"] for event in backend.event_log.since(cursor)] == ["WA"]
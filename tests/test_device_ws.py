@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize("frame", ["[]", '"card_tap"', "1", "null", "{not json", None, b"\xff"])
+def test_malformed_frames_get_an_error_reply(backend, frame):
+    assert backend.handle_device_frame("W1", frame) == ("error", {"error": "Invalid JSON frame"})
+
+
+def test_unknown_frame_type(backend):
+    kind, payload = backend.handle_device_frame("W1", json.dumps({"type": "dance"}))
+    assert kind == "error" and "dance" in payload["error"]
+
+
+def test_heartbeat_frame_marks_the_device_seen(backend):
+    assert backend.handle_device_frame("W2", json.dumps({"type": "heartbeat"}), track=True) is None
+    assert "W2" in backend.device_registry.devices
+
+
+def test_frames_on_a_socket_without_a_token_are_not_tracked(backend):
+    assert backend.handle_device_frame("W4", json.dumps({"type": "heartbeat"})) is None
+    assert "W4" not in backend.device_registry.devices
+
+
+@pytest.mark.parametrize("can_id", [["x"], {"a": 1}, 7, "", None])
+def test_card_tap_with_a_bad_card_id_gets_an_error_reply(backend, can_id):
+    frame = json.dumps({"type": "card_tap", "can_id": can_id})
+    assert backend.handle_device_frame("W3", frame) == ("error", {"error": "Missing can_id"})
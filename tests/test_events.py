@@ -0,0 +1,37 @@
+import json
+
+from events import EventLog, normalize_event
+
+
+def test_normalize_event_dates_device_events_from_their_age():
+    event = normalize_event({"type": "pir_high", "age_ms": 1500}, "E1", received_at=100.0)
+    assert event == {"table_id": "E1", "type": "pir_high", "ts": 98.5, "received_at": 100.0}
+    assert normalize_event({"type": "dance"}, "E1") is None
+    assert normalize_event({"type": "pir_low"}) is None  # no table to file it under
+    assert normalize_event("pir_low", "E1") is None
+
+
+def test_batch_keeps_good_events_and_counts_the_rest(client, backend):
+    cursor = backend.event_log.stats()["cursor"]
+    batch = [{"type": "pir_high", "ts": 1}, {"type": "card_tap", "can_id": "card-e"}, {"type": "dance"}, 7]
+    response = client.post("/ingest/events", json={"table_id": "E2", "events": batch})
+    assert response.status_code == 200
+    assert response.json["accepted"] == 2 and response.json["rejected"] == 2
+    assert [event["type"] for event in backend.event_log.since(cursor)] == ["pir_high", "card_tap"]
+
+
+def test_oversized_or_shapeless_batches_are_refused(client, backend):
+    events = [{"type": "pir_high"}] * (backend.EVENT_BATCH_MAX + 1)
+    assert client.post("/ingest/events", json={"table_id": "E3", "events": events}).status_code == 413
+    assert client.post("/ingest/events", json={"table_id": "E3"}).status_code == 400
+
+
+def test_journal_rotates_past_its_size_limit(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    log = EventLog(path, capacity=3, journal_max_bytes=200)
+    for n in range(10):
+        log.append([normalize_event({"type": "pir_high", "ts": n}, "E4", received_at=n + 1)])
+    assert [event["seq"] for event in log.since(0)] == [8, 9, 10]  # the ring keeps the newest
+    with open(path + ".1") as rotated, open(path) as current:
+        seqs = [json.loads(line)["seq"] for line in rotated] + [json.loads(line)["seq"] for line in current]
+    assert seqs == sorted(seqs) and seqs[-1] == 10
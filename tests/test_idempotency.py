@@ -0,0 +1,31 @@
+from idempotency import IdempotencyCache
+
+
+def test_claim_store_then_replay():
+    cache = IdempotencyCache()
+    assert cache.begin("k") == (IdempotencyCache.CLAIMED, None)
+    assert cache.begin("k") == (IdempotencyCache.BUSY, None)  # a retry while the first is running
+    cache.store("k", ("body", 200, []))
+    assert cache.begin("k") == (IdempotencyCache.HIT, ("body", 200, []))
+    assert cache.stats()["conflicts"] == 1
+
+
+def test_released_key_runs_again():
+    cache = IdempotencyCache()
+    cache.begin("k")
+    cache.release("k")  # e.g. the handler failed with a 500
+    assert cache.begin("k")[0] == IdempotencyCache.CLAIMED
+
+
+def test_expired_and_evicted_responses_are_not_replayed():
+    cache = IdempotencyCache(max_entries=2, ttl=0)
+    cache.begin("old")
+    cache.store("old", "response")
+    assert cache.begin("old")[0] == IdempotencyCache.CLAIMED
+
+    cache = IdempotencyCache(max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.begin(key)
+        cache.store(key, key)
+    assert cache.begin("a")[0] == IdempotencyCache.CLAIMED
+    assert cache.begin("c")[0] == IdempotencyCache.HIT
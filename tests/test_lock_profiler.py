@@ -0,0 +1,44 @@
+import threading
+import time
+
+from lock_profiler import LockProfiler, ProfiledLock
+
+
+def hold_for(lock, seconds, acquired):
+    with lock:
+        acquired.set()
+        time.sleep(seconds)
+
+
+def wait_for_lock(lock):
+    with lock:
+        pass
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = LockProfiler()
+    lock = ProfiledLock(threading.Lock(), profiler, "shard0")
+    with lock:
+        pass
+    assert profiler.report()["sites"] == []
+
+
+def test_contended_acquisition_is_charged_to_the_caller():
+    profiler = LockProfiler(enabled=True)
+    lock = ProfiledLock(threading.Lock(), profiler, "shard0")
+    acquired = threading.Event()
+    holder = threading.Thread(target=hold_for, args=(lock, 0.1, acquired))
+    holder.start()
+    acquired.wait(5)
+    wait_for_lock(lock)
+    holder.join()
+
+    sites = {site["site"]: site for site in profiler.report()["sites"]}
+    assert sites["wait_for_lock"]["contended"] == 1
+    assert sites["wait_for_lock"]["wait_total_ms"] >= 50
+    assert sites["hold_for"]["hold_total_ms"] >= 50
+    assert any(line.startswith("shard0;") and "wait_for_lock" in line
+               for line in profiler.collapsed("wait").splitlines())
+
+    profiler.set_enabled(True, reset=True)
+    assert profiler.report()["sites"] == []
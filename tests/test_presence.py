@@ -0,0 +1,59 @@
+from presence import PresenceMonitor
+
+WINDOW = 180
+
+
+def chope(monitor, table_id, can_id, now):
+    monitor.on_timer_events([("table_state", {"table_id": table_id, "can_id": can_id, "timer": {"remaining_time": 900}})], now)
+
+
+def pir(monitor, table_id, high, ts):
+    monitor.on_device_events([{"table_id": table_id, "type": "pir_high" if high else "pir_low", "ts": ts}])
+
+
+def make_monitor():
+    released = []
+    monitor = PresenceMonitor(WINDOW, release=lambda table_id, can_id: released.append((table_id, can_id)) or True)
+    return monitor, released
+
+
+def test_chope_on_a_table_without_a_sensor_is_never_released():
+    monitor, released = make_monitor()
+    chope(monitor, "P1", "card", 0)
+    monitor.expire(10 * WINDOW)
+    assert released == []
+
+
+def test_sensor_table_with_nobody_present_is_released():
+    monitor, released = make_monitor()
+    pir(monitor, "P2", False, 0)
+    chope(monitor, "P2", "card", 10)
+    monitor.expire(10 + WINDOW - 1)
+    assert released == []
+    monitor.expire(10 + WINDOW)
+    assert released == [("P2", "card")]
+
+
+def test_first_pir_event_after_the_chope_starts_the_watch():
+    monitor, released = make_monitor()
+    chope(monitor, "P3", "card", 0)
+    pir(monitor, "P3", True, 5)
+    pir(monitor, "P3", False, 20)
+    monitor.expire(20 + WINDOW)
+    assert released == [("P3", "card")]
+
+
+def test_presence_keeps_the_chope():
+    monitor, released = make_monitor()
+    chope(monitor, "P4", "card", 0)
+    pir(monitor, "P4", False, 5)
+    pir(monitor, "P4", True, 100)
+    monitor.expire(5 + WINDOW)
+    assert released == []
+
+
+def test_ended_chopes_on_tables_without_a_sensor_are_forgotten():
+    monitor, _ = make_monitor()
+    chope(monitor, "P5", "card", 0)
+    monitor.on_timer_events([("timer_ended", {"table_id": "P5", "can_id": "card"})], 1)
+    assert "P5" not in monitor.tables
@@ -0,0 +1,26 @@
+import threading
+import time
+
+from profiling import PROFILE_MAX_INTERVAL, SamplingProfiler
+
+
+def test_huge_interval_is_clamped_to_the_profile_length():
+    profiler = SamplingProfiler()
+    started = time.monotonic()
+    stacks, samples = profiler.profile(0.2, interval=1e9)
+    assert time.monotonic() - started < PROFILE_MAX_INTERVAL + 1
+    assert samples >= 1
+    assert profiler.profile(0.01, interval=float("nan")) is not None
+
+
+def test_lock_is_free_while_sampling_and_one_profile_runs_at_a_time():
+    profiler = SamplingProfiler()
+    worker = threading.Thread(target=profiler.profile, args=(0.5,))
+    worker.start()
+    time.sleep(0.1)
+    assert profiler.lock.acquire(timeout=0.05)  # not held across the sleeps
+    profiler.lock.release()
+    assert profiler.profile(0.01) is None
+    worker.join()
+    assert profiler.profile(0.01) is not None
+    assert profiler.runs == 2
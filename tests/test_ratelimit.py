@@ -0,0 +1,27 @@
+from conftest import HTTPS
+from ratelimit import RateLimiter, TokenBucket
+
+
+def test_bucket_allows_a_burst_then_asks_the_caller_to_wait():
+    limiter = RateLimiter({"poll": [TokenBucket("can_id", rate=1, burst=3)]})
+    results = [limiter.check("poll", {"can_id": "CAN-1"}) for _ in range(4)]
+    assert results[:3] == [0, 0, 0]
+    assert results[3] >= 1
+    assert not limiter.check("poll", {"can_id": "CAN-2"})  # one bucket per card
+
+
+def test_throttled_timer_poll_is_a_429_with_retry_after(client):
+    statuses = [client.get("/get_timer_status/CAN-THROTTLED").status_code for _ in range(11)]
+    assert statuses[-1] == 429
+    response = client.get("/get_timer_status/CAN-THROTTLED")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_login_is_limited_per_account_not_per_address(client):
+    guesses = [client.post("/login", json={"is_admin": True, "password": "guess"}, base_url=HTTPS).status_code
+               for _ in range(11)]
+    assert guesses[-1] == 429
+    # Everyone behind the same NAT address can still sign in with their own card
+    for n in range(20):
+        assert client.post("/login", json={"can_id": f"card-nat-{n}"}, base_url=HTTPS).status_code == 200
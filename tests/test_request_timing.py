@@ -0,0 +1,33 @@
+import pytest
+
+from conftest import HTTPS
+from request_timing import PHASES
+
+
+@pytest.fixture
+def timing(admin, backend):
+    admin.post("/admin/request_timing", json={"enabled": True, "reset": True}, base_url=HTTPS)
+    yield backend.request_timer
+    backend.request_timer.set_enabled(False, reset=True)
+
+
+def test_requests_are_split_into_phases_per_route(client, admin, timing):
+    client.post("/device/RT1/chope", json={"can_id": "card-rt"})
+    client.get("/get_timer_status/card-rt")
+    report = admin.get("/admin/request_timing?route=device_chope", base_url=HTTPS).json
+
+    assert report["enabled"] is True
+    [route] = report["routes"]
+    assert route["method"] == "POST" and route["count"] == 1
+    phases = route["avg_phases_ms"]
+    assert set(phases) == set(PHASES) | {"other"}
+    assert phases["handler"] > 0 and phases["json_parse"] > 0
+    assert sum(phases.values()) == pytest.approx(route["avg_ms"])
+    assert report["slowest"][0]["path"] == "/device/RT1/chope"
+
+
+def test_disabled_timer_records_nothing(client, admin, backend):
+    backend.request_timer.set_enabled(False, reset=True)
+    client.get("/get_timer_status/card-none")
+    assert backend.request_timer.report()["routes"] == []
+    assert admin.post("/admin/request_timing", json={"enabled": "yes"}, base_url=HTTPS).status_code == 400
@@ -0,0 +1,67 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+from simple_websocket import Client
+
+from serve import PooledWSGIServer
+
+KEEPALIVE = 1  # seconds
+
+
+def receive_all(ws, count):
+    # The client only reads on after its handshake, so a frame sent together with the handshake
+    # response waits in its buffer until the next one arrives. Collect frames instead of expecting
+    # the greeting before anything has been sent.
+    frames = []
+    while len(frames) < count:
+        frame = ws.receive(timeout=5)
+        assert frame is not None
+        frames.append(frame)
+    return frames
+
+
+@pytest.fixture
+def server(backend):
+    server = PooledWSGIServer("127.0.0.1", 0, backend.app, threads=4, keepalive=KEEPALIVE)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_websocket_outlives_the_keepalive_timeout(server):
+    ws = Client.connect(f"ws://127.0.0.1:{server.server_port}/device/S1/ws")
+    try:
+        time.sleep(KEEPALIVE * 3)  # idle well past the header timeout
+        ws.send("[]")
+        greeting, reply = map(json.loads, receive_all(ws, 2))
+        assert greeting["event"] == "table_state"
+        assert reply == {"event": "error", "error": "Invalid JSON frame"}
+        assert ws.connected
+    finally:
+        ws.close()
+
+
+def test_idle_connection_without_a_request_is_closed(server):
+    with socket.create_connection(("127.0.0.1", server.server_port)) as sock:
+        sock.settimeout(KEEPALIVE * 5)
+        started = time.monotonic()
+        assert sock.recv(1024) == b""  # the server hung up on a client that never sent headers
+        assert time.monotonic() - started < KEEPALIVE * 4
+
+
+def test_socketio_websocket_outlives_the_keepalive_timeout(server):
+    ws = Client.connect(f"ws://127.0.0.1:{server.server_port}/socket.io/?EIO=4&transport=websocket")
+    try:
+        time.sleep(KEEPALIVE * 3)
+        ws.send("40")  # Socket.IO connect to the default namespace
+        opened, connected = receive_all(ws, 2)
+        assert opened.startswith("0{")  # Engine.IO open
+        assert connected.startswith("40{")
+        assert ws.connected
+    finally:
+        ws.close()
@@ -0,0 +1,36 @@
+from cachelib import SimpleCache
+
+from conftest import HTTPS
+from session_store import SessionStore
+
+
+def sid(client, backend):
+    return client.get_cookie(backend.app.config["SESSION_COOKIE_NAME"]).value
+
+
+def test_login_moves_the_session_to_a_new_sid(client, backend):
+    client.post("/login", json={"can_id": "card-fixed"}, base_url=HTTPS)
+    planted = sid(client, backend)
+
+    response = client.post("/login", json={"is_admin": True, "password": "admin"}, base_url=HTTPS)
+    assert response.status_code == 200
+    assert sid(client, backend) != planted
+    assert client.get("/admin/sessions", base_url=HTTPS).status_code == 200
+
+    # Whoever knew the old sid is not logged in as admin, nor as anyone else
+    other = backend.app.test_client()
+    other.set_cookie(backend.app.config["SESSION_COOKIE_NAME"], planted, domain="localhost")
+    assert other.get("/admin/sessions", base_url=HTTPS).status_code == 401
+    assert other.get("/user", base_url=HTTPS).status_code == 401
+
+
+def test_renewals_are_batched_until_flush():
+    backend = SimpleCache()
+    store = SessionStore(backend, renew_after=60)
+    store.set("s1", {"can_id": "c"}, expires_at=1100, now=1000)
+    store.renew("s1", 1130)  # within renew_after of the stored expiry: memory only
+    store.renew("s1", 1200)
+    assert backend.get("s1")[0] == 1100
+    assert store.get("s1", now=1150) == {"can_id": "c"}
+    assert store.flush(now=1000) == 1
+    assert backend.get("s1")[0] == 1200
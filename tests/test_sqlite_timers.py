@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from leader import LeaderElection
+from sqlite_timers import SqliteTimers
+
+
+@pytest.fixture
+def workers(tmp_path):
+    # Two workers sharing one database file, as with gunicorn -w 2
+    path = str(tmp_path / "timers.db")
+    return SqliteTimers(path), SqliteTimers(path)
+
+
+def test_workers_share_chopes(workers):
+    first, second = workers
+    assert first.chope_table("T1", "card-a")["can_id"] == "card-a"
+    assert second.chope_table("T1", "card-b")["can_id"] == "card-a"  # already held
+    assert second.get_timer_status("card-a")["table_id"] == "T1"
+    assert second.count_occupied_tables() == 1
+    assert first.release_table("T1", "card-b") is None  # only the holder's release counts
+    assert first.release_table("T1", "card-a")["occupied"] is False
+    assert second.get_timer_status("card-a") is None
+
+
+def test_outbox_carries_every_change_in_order(workers):
+    first, second = workers
+    committed = []
+    first.on_commit = lambda: committed.append(True)
+    first.chope_table("T2", "card-a")
+    second.tap_card("T2", "card-a")  # the holder taps again: released
+    rows = second.read_outbox(0)
+    assert [events[0][1]["occupied"] for _, events in rows] == [True, False]
+    assert committed == [True]
+    assert first.read_outbox(rows[0][0]) == rows[1:]
+
+
+def test_expired_timer_ends_on_the_leader(workers):
+    first, second = workers
+    first.default_duration = 0
+    first.start_timer("card-a", "T3")
+    cursor = second.read_outbox(0)[-1][0]
+    second.decrement_timers()
+    kinds = [kind for _, events in second.read_outbox(cursor) for kind, _ in events]
+    assert "timer_ended" in kinds
+    assert first.get_timer_status("card-a") is None
+
+
+def test_only_one_leader_holds_the_lock(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    leader, follower = LeaderElection(path), LeaderElection(path)
+    assert leader.acquire()
+    assert not follower.acquire()
+    assert leader.stats()["is_leader"] and not follower.stats()["is_leader"]
+    os.close(leader.fd)  # what the kernel does when the leader's process exits
+    assert follower.acquire()
@@ -0,0 +1,110 @@
+import os
+import time
+
+import pytest
+
+from table_slots import HEADER, HEADER_SEQ, SEQ, WRITE_LOG, TableSlots
+
+
+def state(table_id, occupied=True):
+    return {"table_id": table_id, "occupied": occupied, "can_id": None, "timer": None}
+
+
+def timing(table_id, can_id):
+    return {"table_id": table_id, "occupied": True, "can_id": can_id,
+            "timer": {"expires_at": time.time() + 600, "alerts_sent": []}}
+
+
+def count_reads(reader, monkeypatch):
+    reads = []
+    read = reader._read
+    monkeypatch.setattr(reader, "_read", lambda index: reads.append(index) or read(index))
+    return reads
+
+
+def make_slots(capacity):
+    name = f"test_slots_{os.getpid()}_{time.monotonic_ns()}"
+    writer = TableSlots(name=name, capacity=capacity)
+    writer.create()
+    return writer, TableSlots(name=name, capacity=capacity)
+
+
+@pytest.fixture
+def slots():
+    writer, reader = make_slots(2)
+    yield writer, reader
+    if reader.shm is not None:
+        reader.shm.close()
+
+
+@pytest.fixture
+def many_slots():
+    writer, reader = make_slots(256)
+    yield writer, reader
+    if reader.shm is not None:
+        reader.shm.close()
+
+
+def test_tables_beyond_capacity_fall_back_to_the_store(slots, capsys):
+    writer, reader = slots
+    writer.load([state("A"), state("B"), state("C"), state("D")], version=1)
+    now = time.time()
+    assert reader.table_state("A", now)["occupied"] is True
+    assert reader.table_state("C", now) is None  # no slot: the caller reads the store
+    assert reader.count_occupied(now) is None  # the slot count would miss C and D
+    assert reader.stats()["overflow"] == 2
+    assert "Table slots full" in capsys.readouterr().out
+
+
+def test_count_comes_from_the_slots_while_everything_fits(slots):
+    writer, reader = slots
+    writer.load([state("A"), state("B", occupied=False)], version=1)
+    assert reader.count_occupied(time.time()) == 1
+
+
+def test_a_record_left_mid_write_does_not_hang_readers(slots):
+    writer, reader = slots
+    writer.load([state("A")], version=1)
+    SEQ.pack_into(writer.shm.buf, HEADER.size, 1)  # odd sequence: a writer died mid-update
+    started = time.monotonic()
+    assert reader.table_state("A", time.time()) is None
+    assert reader.timer_status("card", time.time()) is None
+    assert time.monotonic() - started < 1
+    assert reader.fallbacks == 2
+
+
+def test_new_card_lookup_rereads_only_the_slots_written_since(many_slots, monkeypatch):
+    writer, reader = many_slots
+    writer.load([timing(f"T{i}", f"card{i}") for i in range(200)], version=1)
+    now = time.time()
+    assert reader.timer_status("card7", now)["table_id"] == "T7"  # first lookup indexes every slot
+
+    reads = count_reads(reader, monkeypatch)
+    writer.apply([("table_state", timing("T50", "fresh"))], version=2)
+    assert reader.timer_status("fresh", now)["table_id"] == "T50"
+    assert reader.timer_status("card50", now) is None  # moved off T50
+    assert reader.timer_status("card7", now)["table_id"] == "T7"
+    assert len(reads) <= 4
+
+
+def test_reader_far_behind_rebuilds_its_card_index(many_slots):
+    writer, reader = many_slots
+    writer.load([timing("A", "first")], version=1)
+    now = time.time()
+    assert reader.timer_status("first", now) is not None
+    for version in range(2, WRITE_LOG + 3):  # the write log wraps past the reader's position
+        writer.apply([("table_state", timing("B", f"card{version}"))], version=version)
+    writer.apply([("table_state", timing("A", "last"))], version=WRITE_LOG + 3)
+    assert reader.timer_status("last", now)["table_id"] == "A"
+    assert reader.timer_status("first", now) is None
+    assert reader.timer_status(f"card{WRITE_LOG + 2}", now)["table_id"] == "B"
+
+
+def test_header_caught_mid_write_is_not_trusted(slots):
+    writer, reader = slots
+    writer.load([state("A")], version=1)
+    assert reader.count_occupied(time.time()) == 1
+    SEQ.pack_into(writer.shm.buf, HEADER_SEQ, 1)
+    started = time.monotonic()
+    assert reader.count_occupied(time.time()) is None
+    assert time.monotonic() - started < 1
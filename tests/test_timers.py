@@ -0,0 +1,61 @@
+import json
+import threading
+import time
+
+import pytest
+
+from timers import Timers
+
+
+@pytest.fixture
+def timers(tmp_path):
+    return Timers(str(tmp_path / "timers.json"), idle_after=60)
+
+
+def test_sweeper_vacates_tables_left_occupied_without_a_timer(timers):
+    timers.start_timer("card-a", "S1")
+    timers.end_timer("card-a")  # the timer is gone, the table stays occupied
+    timers.chope_table("S2", "card-b")  # still held
+    now = time.time()
+    assert timers.sweep_stale(now + 30) == 0  # not idle long enough yet
+    assert timers.sweep_stale(now + 61) == 1
+    assert timers.get_table_state("S1")["occupied"] is False
+    assert timers.get_table_state("S2")["can_id"] == "card-b"
+    assert timers.sweeper_stats()["reclaimed"] == 1
+    assert timers.sweep_stale(now + 120) == 0
+
+
+def test_sweeper_skips_tables_touched_since_they_were_queued(timers):
+    timers.start_timer("card-a", "S3")
+    timers.end_timer("card-a")
+    later = time.time() + 50
+    timers.shard_for("S3").touch("S3", later)  # activity after the first idle deadline was queued
+    assert timers.sweep_stale(later + 30) == 0
+    assert timers.sweep_stale(later + 61) == 1
+
+
+def test_saves_made_during_a_write_are_grouped_into_the_next_one(timers):
+    writes = []
+    release = threading.Event()
+
+    def on_save(seconds, written):
+        writes.append(written)
+        if len(writes) == 1:
+            release.wait(5)  # hold the save lock as a slow disk would
+
+    timers.on_save = on_save
+    first = threading.Thread(target=timers.start_timer, args=("card-0", "G0"))
+    first.start()
+    while not writes:
+        time.sleep(0.001)
+    others = [threading.Thread(target=timers.start_timer, args=(f"card-{n}", f"G{n}")) for n in range(1, 20)]
+    for thread in others:
+        thread.start()
+    for thread in others:
+        thread.join(5)
+        assert not thread.is_alive()  # did not wait for the write in progress
+    release.set()
+    first.join(5)
+    assert len(writes) == 2  # the saver picked up all 19 changes in one more write
+    with open(timers.filepath) as file:
+        assert len(json.load(file)["timers"]) == 20
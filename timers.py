@@ -1,60 +1,429 @@
-import time
+import heapq
 import json
+import math
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+ALERT_MARKS = [300, 240, 180, 120, 60]  # seconds left when an alert goes out
+ALERT_GRACE = 5  # an alert may still fire this late if a tick was delayed
+
+# Devices count down locally from expires_at and only check back when told to
+POLL_MIN_INTERVAL = 1
+POLL_MAX_INTERVAL = 30
+POLL_BUSY_TIMERS = 100  # above this many active timers, stretch idle polls further
+
+# end_timer leaves a table occupied; after this long with no activity the sweeper vacates it
+STALE_TABLE_AFTER = 1800  # seconds
+STALE_SWEEP_BATCH = 100  # tables vacated per tick
+
+# Tables are partitioned by hash of table_id so writers on different tables rarely share a lock
+TIMER_SHARDS = 8
+
+
+class Snapshot:
+    """Read-only copy of a shard's state, published after every mutation batch."""
+
+    __slots__ = ("timers", "tables", "occupied", "version")
+
+    def __init__(self, timers, tables, version):
+        self.timers = timers
+        self.tables = tables
+        self.occupied = sum(1 for table in tables.values() if table["occupied"])
+        self.version = version
+
+
+# These read from anything with .timers and .tables: a shard under its lock, or a Snapshot
+def remaining_time(timer_data, now):
+    return max(0, math.ceil(timer_data["expires_at"] - now))
+
+
+def poll_interval(remaining, active_timers):
+    # Nothing changes for the device until the next alert mark or expiry
+    upcoming = [remaining - mark for mark in ALERT_MARKS if mark < remaining]
+    until_event = min(upcoming) if upcoming else remaining
+    ceiling = POLL_MAX_INTERVAL
+    if active_timers > POLL_BUSY_TIMERS:
+        ceiling *= 2
+    return max(POLL_MIN_INTERVAL, min(until_event, ceiling))
+
 
+def timer_status(timer_data, now, active_timers):
+    remaining = remaining_time(timer_data, now)
+    return {
+        "table_id": timer_data["table_id"],
+        "remaining_time": remaining,
+        "alerts_sent": list(timer_data["alerts_sent"]),
+        "expires_at": timer_data["expires_at"],
+        "server_time": now,
+        "poll_after": poll_interval(remaining, active_timers)
+    }
+
+
+def next_deadline(timer_data, now):
+    # Wall-clock time of the timer's next alert mark or its expiry
+    expires_at = timer_data["expires_at"]
+    due = [expires_at - mark for mark in ALERT_MARKS
+           if mark not in timer_data["alerts_sent"] and expires_at - mark + ALERT_GRACE > now]
+    return min(due + [expires_at])
+
+
+def holder(state, table_id):
+    # can_id with a running timer on this table, if any
+    can_id = state.tables.get(table_id, {}).get("can_id")
+    timer_data = state.timers.get(can_id)
+    if timer_data is None or timer_data["table_id"] != table_id:
+        return None
+    return can_id
+
+
+def table_state(state, table_id, now, active_timers):
+    table = state.tables.get(table_id, {"occupied": False, "can_id": None})
+    can_id = holder(state, table_id)
+    return {
+        "table_id": table_id,
+        "occupied": table["occupied"],
+        "can_id": table["can_id"],
+        "timer": timer_status(state.timers[can_id], now, active_timers) if can_id else None
+    }
+
+
+class TimerShard:
+    """One partition of the tables, with its own lock, timers, idle index and version."""
+
+    def __init__(self, index, idle_after):
+        self.index = index
+        self.idle_after = idle_after
+        self.lock = threading.Lock()
+        self.timers = {}  # can_id -> timer for tables in this shard
+        self.tables = {}
+        self.activity_index = []  # heap of (idle deadline, table_id) for occupied tables
+        self.version = 0
+        self.snapshot = Snapshot({}, {}, 0)
+
+    def commit(self):
+        # Call with self.lock held at the end of a mutation batch
+        self.version += 1
+        self.snapshot = Snapshot(
+            {can_id: dict(timer_data, alerts_sent=tuple(timer_data["alerts_sent"]))
+             for can_id, timer_data in self.timers.items()},
+            {table_id: dict(table) for table_id, table in self.tables.items()},
+            self.version
+        )
+
+    def touch(self, table_id, now):
+        self.tables[table_id]["last_activity"] = now
+        heapq.heappush(self.activity_index, (now + self.idle_after, table_id))
+
+
+# Timer Management
 class Timers:
-    def __init__(self):
-        self.timers = {}  # Tracks active timers
-        self.timer_duration = 300  # Default timer duration
+    def __init__(self, filepath, on_events=None, idle_after=STALE_TABLE_AFTER, shards=TIMER_SHARDS):
+        self.filepath = filepath
+        self.on_events = on_events  # receives [(event, payload)] after the locks are released
+        self.default_duration = 900  # Default timer duration: 15 minutes
+        self.idle_after = idle_after
+        self.shards = [TimerShard(index, idle_after) for index in range(shards)]
+        # can_id -> table_id of its running timer; written under that table's shard lock
+        self.card_tables = {}
+        self.reclaimed = 0
+        # Saves merge the shard snapshots outside every shard lock
+        self.save_lock = threading.Lock()
+        self.saved_versions = None
+        self.on_save = None  # on_save(seconds, bytes) after each write of the state file
         self.load_timers()
 
-    def save_timers(self):
-        """Save timers to a JSON file."""
-        with open('data/timers.json', 'w') as file:
-            json.dump(self.timers, file)
+    def shard_for(self, table_id):
+        return self.shards[zlib.crc32(table_id.encode()) % len(self.shards)]
 
     def load_timers(self):
-        """Load timers from a JSON file."""
+        timers, tables = {}, {}
+        if os.path.exists(self.filepath):
+            with open(self.filepath, "r") as file:
+                data = json.load(file)
+                timers = data.get("timers", {})
+                tables = data.get("tables", {})
+        now = time.time()
+        for table_id, table in tables.items():
+            shard = self.shard_for(table_id)
+            shard.tables[table_id] = table
+            if table["occupied"]:
+                shard.touch(table_id, table.get("last_activity", now))
+        for can_id, timer_data in timers.items():
+            # Older state files stored a ticking remaining_time instead of a deadline
+            if "expires_at" not in timer_data:
+                timer_data["expires_at"] = now + timer_data.pop("remaining_time", self.default_duration)
+            self.shard_for(timer_data["table_id"]).timers[can_id] = timer_data
+            self.card_tables[can_id] = timer_data["table_id"]
+        for shard in self.shards:
+            shard.commit()
+        self.saved_versions = self.versions()
+
+    def versions(self):
+        return tuple(shard.snapshot.version for shard in self.shards)
+
+    def save_timers(self):
+        # Group commit: while one thread writes, others just leave their changes for it
+        while self.versions() != self.saved_versions:
+            if not self.save_lock.acquire(blocking=False):
+                return  # the saver re-checks versions after it releases the lock
+            try:
+                while True:
+                    snapshots = [shard.snapshot for shard in self.shards]
+                    versions = tuple(snapshot.version for snapshot in snapshots)
+                    if versions == self.saved_versions:
+                        break
+                    timers, tables = {}, {}
+                    for snapshot in snapshots:
+                        timers.update(snapshot.timers)
+                        tables.update(snapshot.tables)
+                    started = time.perf_counter()
+                    tmp_path = self.filepath + ".tmp"
+                    with open(tmp_path, "w") as file:
+                        json.dump({"timers": timers, "tables": tables}, file)
+                        written = file.tell()
+                    os.replace(tmp_path, self.filepath)
+                    self.saved_versions = versions
+                    if self.on_save is not None:
+                        self.on_save(time.perf_counter() - started, written)
+            finally:
+                self.save_lock.release()
+
+    def publish(self, events):
+        if events and self.on_events:
+            self.on_events(events)
+
+    @contextmanager
+    def locked(self, table_id, can_id=None):
+        # Locks the table's shard, plus the shard of can_id's current timer if that differs.
+        # Shards are always locked in index order so two cross-shard moves cannot deadlock.
+        while True:
+            current = self.card_tables.get(can_id) if can_id is not None else None
+            shards = {self.shard_for(table_id)}
+            if current is not None:
+                shards.add(self.shard_for(current))
+            shards = sorted(shards, key=lambda shard: shard.index)
+            for shard in shards:
+                shard.lock.acquire()
+            if can_id is None or self.card_tables.get(can_id) == current:
+                break
+            for shard in reversed(shards):
+                shard.lock.release()
         try:
-            with open('data/timers.json', 'r') as file:
-                self.timers = json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.timers = {}
+            yield shards
+        finally:
+            for shard in reversed(shards):
+                shard.lock.release()
+
+    def active_timers(self):
+        return len(self.card_tables)
 
     def start_timer(self, can_id, table_id):
-        """Start a timer for a CAN ID and associate it with a table."""
-        self.timers[can_id] = {
-            "duration": self.timer_duration,
-            "start_time": time.time(),
-            "table_id": table_id
-        }
+        now = time.time()
+        with self.locked(table_id, can_id) as shards:
+            self._start(can_id, table_id, now)
+            for shard in shards:
+                shard.commit()
+            shard = self.shard_for(table_id)
+            status = timer_status(shard.timers[can_id], now, self.active_timers())
+            state = table_state(shard, table_id, now, self.active_timers())
         self.save_timers()
+        self.publish([("table_state", state)])
+        return status
+
+    def _start(self, can_id, table_id, now):
+        # A card has one timer: starting it elsewhere drops the old one
+        previous = self.card_tables.get(can_id)
+        if previous is not None and previous != table_id:
+            self.shard_for(previous).timers.pop(can_id, None)
+        shard = self.shard_for(table_id)
+        shard.timers[can_id] = {
+            "table_id": table_id,
+            "expires_at": now + self.default_duration,
+            "alerts_sent": []
+        }
+        shard.tables[table_id] = {"occupied": True, "can_id": can_id}
+        shard.touch(table_id, now)
+        self.card_tables[can_id] = table_id
 
     def get_timer_status(self, can_id):
-        """Retrieve the remaining time and table ID for a CAN ID."""
-        timer = self.timers.get(can_id)
-        if not timer:
+        table_id = self.card_tables.get(can_id)
+        if table_id is None:
             return None
-        elapsed = time.time() - timer["start_time"]
-        remaining = max(0, timer["duration"] - elapsed)
-        return {
-            "can_id": can_id,
-            "remaining_time": int(remaining),
-            "table_id": timer["table_id"]
-        }
+        timer_data = self.shard_for(table_id).snapshot.timers.get(can_id)
+        if timer_data is None:
+            return None
+        return timer_status(timer_data, time.time(), self.active_timers())
 
     def end_timer(self, can_id):
-        """End a timer for a CAN ID and free the associated table."""
-        if can_id in self.timers:
-            del self.timers[can_id]
+        table_id = self.card_tables.get(can_id)
+        if table_id is None:
+            return False
+        with self.locked(table_id, can_id):
+            table_id = self.card_tables.get(can_id)  # may have moved before the lock was taken
+            if table_id is None:
+                return False
+            shard = self.shard_for(table_id)
+            now = time.time()
+            shard.tables[table_id]["occupied"] = True  # Table remains occupied
+            shard.touch(table_id, now)
+            del shard.timers[can_id]
+            del self.card_tables[can_id]
+            shard.commit()
+            state = table_state(shard, table_id, now, self.active_timers())
+        self.save_timers()
+        self.publish([("table_state", state)])
+        return True
+
+    def set_table_vacant(self, table_id):
+        with self.locked(table_id):
+            shard = self.shard_for(table_id)
+            if table_id in shard.tables and shard.tables[table_id]["occupied"]:
+                shard.tables[table_id]["occupied"] = False
+                shard.tables[table_id]["can_id"] = None
+                shard.commit()
+                state = table_state(shard, table_id, time.time(), self.active_timers())
+            else:
+                return False
+        self.save_timers()
+        self.publish([("table_state", state)])
+        return True
+
+    # Device transitions: the whole state change happens under one lock and one save
+    def chope_table(self, table_id, can_id):
+        now = time.time()
+        with self.locked(table_id, can_id) as shards:
+            shard = self.shard_for(table_id)
+            changed = holder(shard, table_id) in (None, can_id)
+            if changed:
+                self._start(can_id, table_id, now)
+                for locked_shard in shards:
+                    locked_shard.commit()
+            state = table_state(shard, table_id, now, self.active_timers())
+        if changed:
             self.save_timers()
-            return True
-        return False
+            self.publish([("table_state", state)])
+        return state
+
+    def release_table(self, table_id, can_id=None):
+        # With can_id, only release if that card still holds the table
+        now = time.time()
+        with self.locked(table_id):
+            shard = self.shard_for(table_id)
+            if table_id not in shard.tables or (can_id is not None and holder(shard, table_id) != can_id):
+                return None
+            self._release(shard, table_id)
+            shard.commit()
+            state = table_state(shard, table_id, now, self.active_timers())
+        self.save_timers()
+        self.publish([("table_state", state)])
+        return state
 
-    def update_timer_duration(self, new_duration):
-        """Update the default timer duration."""
-        self.timer_duration = new_duration
+    def tap_card(self, table_id, can_id):
+        # Same rules as the firmware: free table chopes, same card releases, other card clashes
+        now = time.time()
+        with self.locked(table_id, can_id) as shards:
+            shard = self.shard_for(table_id)
+            current = holder(shard, table_id)
+            if current is None:
+                action = "choped"
+                self._start(can_id, table_id, now)
+            elif current == can_id:
+                action = "released"
+                self._release(shard, table_id)
+            else:
+                return "clash", table_state(shard, table_id, now, self.active_timers())
+            for locked_shard in shards:
+                locked_shard.commit()
+            state = table_state(shard, table_id, now, self.active_timers())
         self.save_timers()
+        self.publish([("table_state", state)])
+        return action, state
+
+    def _release(self, shard, table_id):
+        table = shard.tables[table_id]
+        if holder(shard, table_id) is not None:
+            del shard.timers[table["can_id"]]
+            del self.card_tables[table["can_id"]]
+        table["occupied"] = False
+        table["can_id"] = None
+
+    def get_table_state(self, table_id):
+        return table_state(self.shard_for(table_id).snapshot, table_id, time.time(), self.active_timers())
+
+    def sweep_stale(self, now, limit=STALE_SWEEP_BATCH):
+        # Only pops tables whose idle deadline has passed; never walks the whole table dict
+        events = []
+        for shard in self.shards:
+            if not shard.activity_index or shard.activity_index[0][0] > now:
+                continue
+            reclaimed = 0
+            with shard.lock:
+                while shard.activity_index and shard.activity_index[0][0] <= now and len(events) < limit:
+                    _, table_id = heapq.heappop(shard.activity_index)
+                    table = shard.tables.get(table_id)
+                    if table is None or not table["occupied"] or holder(shard, table_id) is not None:
+                        continue
+                    if table["last_activity"] + self.idle_after > now:
+                        continue  # touched since; its newer entry is still queued
+                    table["occupied"] = False
+                    table["can_id"] = None
+                    events.append(("table_state", table_state(shard, table_id, now, self.active_timers())))
+                    reclaimed += 1
+                if reclaimed:
+                    shard.commit()
+        if events:
+            self.save_timers()
+        self.reclaimed += len(events)
+        self.publish(events)
+        return len(events)
+
+    def sweeper_stats(self):
+        return {
+            "reclaimed": self.reclaimed,
+            "idle_after": self.idle_after,
+            "queued": sum(len(shard.activity_index) for shard in self.shards)
+        }
 
-    def get_all_timers(self):
-        """Return the status of all active timers."""
-        return self.timers
+    def count_occupied_tables(self):
+        return sum(shard.snapshot.occupied for shard in self.shards)
+
+    def next_deadline(self, now):
+        """Earliest alert mark or expiry over all running timers, or None; lets a caller sleep until it."""
+        return min((next_deadline(timer_data, now) for shard in self.shards
+                    for timer_data in shard.snapshot.timers.values()), default=None)
+
+    def decrement_timers(self):
+        # Timers hold a deadline, so a tick only has to look for alerts and expiry
+        now = time.time()
+        events = []
+        for shard in self.shards:
+            with shard.lock:
+                changed = len(events)
+                for can_id, timer_data in list(shard.timers.items()):
+                    remaining = remaining_time(timer_data, now)
+                    for mark in ALERT_MARKS:
+                        if remaining <= mark < remaining + ALERT_GRACE and mark not in timer_data["alerts_sent"]:
+                            events.append(('timer_alert', {
+                                "can_id": can_id,
+                                "table_id": timer_data["table_id"],
+                                "remaining_time": mark
+                            }))
+                            timer_data["alerts_sent"].append(mark)
+                    if remaining <= 0:
+                        events.append(('timer_ended', {
+                            "can_id": can_id,
+                            "table_id": timer_data["table_id"]
+                        }))
+                        del shard.timers[can_id]
+                        del self.card_tables[can_id]
+                        if timer_data["table_id"] in shard.tables:
+                            shard.touch(timer_data["table_id"], now)
+                if len(events) > changed:
+                    shard.commit()
+        if events:
+            self.save_timers()
+        # Emit outside the locks so slow clients never hold up the engine
+        self.publish(events)